@@ -0,0 +1,285 @@
+import argparse
+import hashlib
+import os
+
+import numpy as np
+import pandas as pd
+
+from frame_cache import DEFAULT_MAX_BYTES, evict_files
+
+# Version of the blank statistics and of the baseline file layout. It is part of every key, so baselines saved by
+# another version are computed again instead of reused.
+BASELINE_VERSION = 1
+
+def blank_key(gas_matrix, segments):
+    '''
+    Compute the key of a LICOR's blank baseline from the rows it is reduced from.
+
+    Args:
+        gas_matrix GasMatrix of the data
+        segments List of integer metadata positions of the LICOR's blank measurements
+    Return:
+        String of the hex sha256 digest of the gas names, data type, and every blank window's gas and 21 m/z values, in
+        order. Identical blank rows in another run or another sheet give the same key.
+    '''
+
+    digest = hashlib.sha256()
+    digest.update(("%d %s\0" % (BASELINE_VERSION, gas_matrix.values.dtype)).encode("utf-8"))
+    digest.update("\0".join(map(str, gas_matrix.columns)).encode("utf-8"))
+
+    for segment in segments:
+        window = np.ascontiguousarray(gas_matrix.window(segment))
+        digest.update(np.array(window.shape, dtype=np.int64))
+        digest.update(window)
+        digest.update(np.ascontiguousarray(gas_matrix.housekeeping_window("21 m/z", segment)))
+
+    return digest.hexdigest()
+
+class BlankBaseline():
+    '''
+    A LICOR's blank statistics, which are all the plant reduction needs from its blanks: the average and standard
+    deviation of each gas and the average 21 m/z over the blank measurements.
+
+    Saved as a small compressed .npz file of the gas names and the statistics in the data type they were computed in.
+    '''
+
+    def __init__(self, mean, std, mz21_mean, key=None):
+        '''
+        Default constructor.
+
+        Args:
+            mean Series of the average of each gas over the blanks
+            std Series of the standard deviation of each gas over the blanks
+            mz21_mean Float average 21 m/z over the blanks
+            key Optional string blank_key() of the rows the baseline was computed from
+        '''
+
+        self.mean = mean
+        self.std = std
+        self.mz21_mean = mz21_mean
+        self.key = key
+
+    def statistics(self, columns):
+        '''
+        Args:
+            columns Index of the gas names of the data being reduced
+        Return:
+            A Series of the average of each gas over the blanks, a Series of the standard deviation of each gas over the
+            blanks, and the average 21 m/z over the blanks, as from GasMatrix.blank_statistics()
+        '''
+
+        missing = columns.difference(self.mean.index)
+
+        if len(missing):
+            raise ValueError("Blank baseline has no statistics for gases: " + ", ".join(map(str, missing)))
+
+        return self.mean.reindex(columns), self.std.reindex(columns), self.mz21_mean
+
+    def save(self, path):
+        '''
+        Save the baseline, through a temporary file so that concurrent readers never see a partial one.
+
+        Args:
+            path String path to the file to write
+        '''
+
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+
+        with open(temp_path, "wb") as baseline_file:
+            np.savez_compressed(baseline_file, version=np.array(BASELINE_VERSION), key=np.array(self.key or ""),
+                                gases=np.array([str(gas) for gas in self.mean.index], dtype=str),
+                                mean=self.mean.to_numpy(), std=self.std.to_numpy(),
+                                mz21_mean=np.array(self.mz21_mean, dtype=np.float64))
+
+        os.replace(temp_path, path)
+
+    @staticmethod
+    def load(path):
+        '''
+        Load a saved baseline.
+
+        Args:
+            path String path to a file written by save()
+        Return:
+            The BlankBaseline
+        '''
+
+        with np.load(path, allow_pickle=False) as baseline_file:
+            if int(baseline_file["version"]) != BASELINE_VERSION:
+                raise ValueError("Blank baseline " + str(path) + " is version " + str(int(baseline_file["version"])) +
+                                 ", not " + str(BASELINE_VERSION))
+
+            gases = pd.Index(baseline_file["gases"].tolist())
+
+            return BlankBaseline(pd.Series(baseline_file["mean"], index=gases),
+                                 pd.Series(baseline_file["std"], index=gases), baseline_file["mz21_mean"][()],
+                                 str(baseline_file["key"]) or None)
+
+class BaselineCache():
+    '''
+    Blank baselines of each LICOR, reused instead of reducing the same blanks again.
+
+    Computed baselines are keyed by blank_key(), a hash of the rows they are reduced from, and kept in memory and,
+    with a directory, on disk for later runs. A LICOR's blanks are then reduced once however many times they are
+    reanalyzed, and blanks shared by several sheets are reduced once for all of them. Hashing the rows still reads them.
+
+    Baselines given as overrides are used for their LICORs as they are, without reading the blanks at all, so a run that
+    only needs the plants can skip blank processing entirely.
+
+    When the directory grows beyond max_bytes the least recently used baselines are removed.
+    '''
+
+    def __init__(self, directory=None, overrides=None, max_bytes=DEFAULT_MAX_BYTES):
+        '''
+        Default constructor.
+
+        Args:
+            directory Optional string path to the directory to store baselines in. Created if it doesn't exist.
+            overrides Optional dictionary from LICOR names to the BlankBaseline to use for that LICOR
+            max_bytes Integer maximum total size of the stored baselines in bytes
+        '''
+
+        self.directory = directory
+        self.overrides = dict(overrides or {})
+        self.max_bytes = max_bytes
+
+        # Baselines loaded or computed by this cache, by key
+        self.memory = {}
+
+        # Dictionary from LICOR names to the BlankBaseline last used for each, to save or to override later runs with
+        self.latest = {}
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def path(self, key):
+        '''
+        Args:
+            key String blank_key()
+        Return:
+            String path the baseline is stored at
+        '''
+
+        return os.path.join(self.directory, key + ".npz")
+
+    def get(self, key):
+        '''
+        Args:
+            key String blank_key()
+        Return:
+            The cached BlankBaseline, or None if it isn't cached
+        '''
+
+        if key in self.memory:
+            return self.memory[key]
+
+        if self.directory is None or not os.path.exists(self.path(key)):
+            return None
+
+        baseline = self.memory[key] = BlankBaseline.load(self.path(key))
+
+        # Mark the baseline as recently used for eviction
+        os.utime(self.path(key))
+
+        return baseline
+
+    def put(self, key, baseline):
+        '''
+        Store a baseline, then evict old ones if the directory is over its size limit.
+
+        Args:
+            key String blank_key()
+            baseline BlankBaseline to store
+        '''
+
+        self.memory[key] = baseline
+
+        if self.directory is not None:
+            baseline.save(self.path(key))
+            evict_files(self.directory, (".npz",), self.max_bytes)
+
+    def lookup(self, licor, gas_matrix, segments):
+        '''
+        Find a LICOR's blank statistics without computing them.
+
+        Args:
+            licor Name of the LICOR
+            gas_matrix GasMatrix of the data
+            segments List of integer metadata positions of the LICOR's blank measurements
+        Return:
+            The key to save() the statistics under once computed, or None for an override, and the statistics as from
+            GasMatrix.blank_statistics(), or None if they aren't cached
+        '''
+
+        if licor in self.overrides:
+            self.latest[licor] = self.overrides[licor]
+            return None, self.overrides[licor].statistics(gas_matrix.columns)
+
+        key = blank_key(gas_matrix, segments)
+        baseline = self.get(key)
+
+        if baseline is None:
+            return key, None
+
+        self.latest[licor] = baseline
+
+        return key, baseline.statistics(gas_matrix.columns)
+
+    def save(self, licor, key, statistics):
+        '''
+        Store the blank statistics computed after a lookup() missed.
+
+        Args:
+            licor Name of the LICOR
+            key String key from lookup()
+            statistics Tuple of the statistics from GasMatrix.blank_statistics()
+        '''
+
+        self.latest[licor] = BlankBaseline(*statistics, key=key)
+        self.put(key, self.latest[licor])
+
+    def blank_statistics(self, licor, gas_matrix, segments):
+        '''
+        Get a LICOR's blank statistics from the cache, reducing its blanks only if they aren't cached.
+
+        Args:
+            licor Name of the LICOR
+            gas_matrix GasMatrix of the data
+            segments List of integer metadata positions of the LICOR's blank measurements
+        Return:
+            The statistics as from GasMatrix.blank_statistics()
+        '''
+
+        key, statistics = self.lookup(licor, gas_matrix, segments)
+
+        if statistics is None:
+            statistics = gas_matrix.blank_statistics(segments)
+            self.save(licor, key, statistics)
+
+        return statistics
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Save each LICOR's blank baseline, to reduce later runs against.")
+    parser.add_argument("data", type=str, help="Path to the data file")
+    parser.add_argument("sheet", type=str, help="Name of the sheet the data is in")
+    parser.add_argument("metadata", type=str, help="Path to the metadata file")
+    parser.add_argument("output", type=str, help="Directory to save <LICOR>.npz to for each LICOR")
+    parser.add_argument("--float32", action="store_true", help="Compute the baselines in float32")
+    args = parser.parse_args()
+
+    from dac import licor_measurements, load_files, prepare_reduction
+
+    data, metadata = load_files(args.data, args.sheet, args.metadata)
+    _, segment_index, gas_matrix, _ = prepare_reduction(data, metadata,
+                                                        dtype="float32" if args.float32 else "float64")
+
+    os.makedirs(args.output, exist_ok=True)
+
+    for licor in metadata.LICOR.unique():
+        blank_segments, _ = licor_measurements(segment_index, licor)
+        baseline = BlankBaseline(*gas_matrix.blank_statistics(blank_segments),
+                                 key=blank_key(gas_matrix, blank_segments))
+        baseline.save(os.path.join(args.output, str(licor) + ".npz"))
+
+        print(licor, len(blank_segments), "blanks", baseline.key)
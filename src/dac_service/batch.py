@@ -0,0 +1,283 @@
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import time
+import traceback
+
+import pandas as pd
+
+from collections import Counter
+from concurrent.futures import as_completed, ProcessPoolExecutor
+
+from dac import finish_reduction, load_files, reduce_campaign as reduce_data
+from frame_cache import FrameCache
+
+# Default pattern for the part of a file name shared by a campaign's data and metadata files, the date in
+# 2024_05_09_T6261_Complete.xlsx and 2024_05_09_Metadata.xlsx
+DEFAULT_PAIR_PATTERN = r"(\d{4}_\d{2}_\d{2})"
+
+def read_manifest(path):
+    '''
+    Read the list of campaigns to reduce from a manifest file.
+
+    The manifest is either a csv file with a header row or a JSON list of objects. Each campaign has "data", "sheet",
+    and "metadata" entries, and optionally a "name" and a "cutoff". Relative paths are resolved against the manifest's
+    directory.
+
+    Args:
+        path String path to the csv or JSON manifest
+    Return:
+        A list of campaign dictionaries
+    '''
+
+    if path.lower().endswith(".json"):
+        with open(path) as manifest_file:
+            campaigns = json.load(manifest_file)
+    else:
+        campaigns = pd.read_csv(path, dtype=str).to_dict(orient="records")
+
+    base = os.path.dirname(os.path.abspath(path))
+
+    for campaign in campaigns:
+        for key in ("data", "metadata"):
+            campaign[key] = os.path.join(base, campaign[key])
+
+    return campaigns
+
+def find_campaigns(data_glob, metadata_glob, sheet, pair_pattern=DEFAULT_PAIR_PATTERN):
+    '''
+    Pair data and metadata files matched by two glob patterns into campaigns.
+
+    Files are paired by the first match of pair_pattern in their names. Each campaign is named after its data file,
+    since several data files from one day share that day's metadata file. Data files without a matching metadata file
+    are reported as campaigns with a "missing" entry so that they show up as failures.
+
+    Args:
+        data_glob String glob pattern for the data files
+        metadata_glob String glob pattern for the metadata files
+        sheet String sheet name where each data file has the data saved
+        pair_pattern String regular expression whose first match in a file name identifies the campaign
+    Return:
+        A list of campaign dictionaries sorted by name
+    '''
+
+    def campaign_key(path):
+        match = re.search(pair_pattern, os.path.basename(path))
+        return match.group(0) if match else os.path.splitext(os.path.basename(path))[0]
+
+    metadata_files = {campaign_key(path): path for path in glob.glob(metadata_glob)}
+    campaigns = []
+
+    for data_file in sorted(glob.glob(data_glob)):
+        key = campaign_key(data_file)
+        campaign = {"name": os.path.splitext(os.path.basename(data_file))[0], "data": data_file, "sheet": sheet, 
+                    "metadata": metadata_files.get(key)}
+
+        if campaign["metadata"] is None:
+            campaign["missing"] = "No metadata file matching " + key
+
+        campaigns.append(campaign)
+
+    return campaigns
+
+def campaign_name(campaign):
+    '''
+    Args:
+        campaign Campaign dictionary
+    Return:
+        String name for the campaign, its "name" if given or else the data file's name without extension
+    '''
+
+    name = campaign.get("name")
+
+    if name is None or (isinstance(name, float) and pd.isna(name)) or name == "":
+        name = os.path.splitext(os.path.basename(campaign["data"]))[0]
+
+    return str(name)
+
+def reduce_campaign(campaign, output_directory, cutoff, cache_directory=None, store_path=None):
+    '''
+    Load and reduce one campaign, writing its outputs to a subdirectory of output_directory.
+
+    Any error is caught and returned in the summary so that one bad campaign doesn't stop the rest of the batch.
+
+    Args:
+        campaign Campaign dictionary with "data", "sheet", and "metadata" entries
+        output_directory String path to the directory to write the campaign's outputs under
+        cutoff Float high variance cutoff, used unless the campaign sets its own
+        cache_directory Optional string path to a FrameCache directory
+        store_path Optional string path to a result_store.ResultStore database to add the results to. Campaigns whose
+            files are already in it are skipped.
+    Return:
+        A summary dictionary with the campaign's "name", "status" ("ok", "skipped", or "failed"), "seconds", and either
+        counts of the results or the "error"
+    '''
+
+    name = campaign_name(campaign)
+    start = time.perf_counter()
+
+    try:
+        if "missing" in campaign:
+            raise FileNotFoundError(campaign["missing"])
+
+        if store_path is not None:
+            from result_store import campaign_start, ResultStore, source_key
+
+            key = source_key(campaign["data"], campaign["sheet"], campaign["metadata"])
+
+            with ResultStore(store_path) as store:
+                if store.has(key):
+                    return {"name": name, "status": "skipped", "seconds": time.perf_counter() - start}
+
+        campaign_cutoff = campaign.get("cutoff")
+        if campaign_cutoff is None or pd.isna(campaign_cutoff) or campaign_cutoff == "":
+            campaign_cutoff = cutoff
+
+        cache = FrameCache(cache_directory) if cache_directory is not None else None
+        data, metadata = load_files(campaign["data"], campaign["sheet"], campaign["metadata"], cache=cache)
+        reduction = reduce_data(data, metadata)
+        output = finish_reduction(reduction, float(campaign_cutoff))
+
+        if store_path is not None:
+            with ResultStore(store_path) as store:
+                store.add(name, reduction, key, campaign_start(metadata))
+
+        campaign_directory = os.path.join(output_directory, name)
+        os.makedirs(campaign_directory, exist_ok=True)
+
+        with open(os.path.join(campaign_directory, "out.csv"), "w") as out_file:
+            out_file.write(output["data"])
+
+        output["gas_prevelances"].to_csv(os.path.join(campaign_directory, "prevalences.csv"), index=False)
+
+        with open(os.path.join(campaign_directory, "results.json"), "w") as results_file:
+            json.dump({
+                "abnormal": output["abnormal"],
+                "above_threshold": output["above_threshold"],
+                "high_variance": output["high_variance"],
+            }, results_file, indent=2)
+
+        return {
+            "name": name,
+            "status": "ok",
+            "seconds": time.perf_counter() - start,
+            "plants": len(output["above_threshold"]),
+            "abnormal": len(output["abnormal"]),
+            "high_variance": len(output["high_variance"]),
+        }
+
+    except Exception:
+        return {
+            "name": name,
+            "status": "failed",
+            "seconds": time.perf_counter() - start,
+            "error": traceback.format_exc(),
+        }
+
+def run_batch(campaigns, output_directory, cutoff, workers=None, cache_directory=None, store_path=None):
+    '''
+    Reduce many campaigns in parallel on a process pool.
+
+    Args:
+        campaigns List of campaign dictionaries
+        output_directory String path to write each campaign's outputs and the combined summary to
+        cutoff Float default high variance cutoff
+        workers Integer number of worker processes, or None for one per CPU
+        cache_directory Optional string path to a FrameCache directory shared by the workers
+        store_path Optional string path to a result_store.ResultStore database shared by the workers
+    Return:
+        A list of campaign summaries from reduce_campaign(), in the order of campaigns
+    '''
+
+    # Campaigns with the same name would write to the same output directory and replace each other in the store
+    duplicates = [name for name, count in Counter(campaign_name(campaign) for campaign in campaigns).items() 
+                  if count > 1]
+    if duplicates:
+        raise ValueError("Several campaigns are named " + ", ".join(duplicates) + ". Give each a unique name.")
+
+    os.makedirs(output_directory, exist_ok=True)
+    summaries = [None] * len(campaigns)
+
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            executor.submit(reduce_campaign, campaign, output_directory, cutoff, cache_directory, store_path): i
+            for i, campaign in enumerate(campaigns)
+        }
+
+        for future in as_completed(futures):
+            i = futures[future]
+
+            # A worker process that dies takes its campaign with it but not the batch
+            try:
+                summaries[i] = future.result()
+            except Exception:
+                summaries[i] = {"name": campaign_name(campaigns[i]), "status": "failed", "seconds": None,
+                                "error": traceback.format_exc()}
+
+            print(summaries[i]["name"] + ": " + summaries[i]["status"], flush=True)
+
+    write_summary(summaries, output_directory)
+
+    return summaries
+
+def write_summary(summaries, output_directory):
+    '''
+    Write the combined summary of a batch as summary.json and summary.csv.
+
+    Args:
+        summaries List of campaign summaries from reduce_campaign()
+        output_directory String path to the directory to write the summary to
+    '''
+
+    with open(os.path.join(output_directory, "summary.json"), "w") as summary_file:
+        json.dump(summaries, summary_file, indent=2)
+
+    pd.DataFrame(summaries).drop(columns="error", errors="ignore").to_csv(
+        os.path.join(output_directory, "summary.csv"), index=False)
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reduce many campaigns in parallel.")
+    parser.add_argument("--manifest", type=str, default=None,
+                        help="csv or JSON file listing campaigns with data, sheet, metadata, and optional name and cutoff")
+    parser.add_argument("--data-glob", type=str, default=None, help="Glob pattern for data files")
+    parser.add_argument("--metadata-glob", type=str, default=None, help="Glob pattern for metadata files")
+    parser.add_argument("--sheet", type=str, default="TS_all_ppbV", help="Sheet name for data files found by glob")
+    parser.add_argument("--pair-pattern", type=str, default=DEFAULT_PAIR_PATTERN,
+                        help="Regular expression identifying the campaign in data and metadata file names")
+    parser.add_argument("--cutoff", type=float, default=0.1)
+    parser.add_argument("--output", type=str, default="batch_output", help="Directory to write results to")
+    parser.add_argument("--workers", type=int, default=None, help="Number of worker processes, default one per CPU")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Directory to cache parsed sheets in")
+    parser.add_argument("--store", type=str, default=None,
+                        help="SQLite result store to add each campaign to, skipping campaigns already in it")
+    args = parser.parse_args()
+
+    if args.manifest is not None:
+        campaigns = read_manifest(args.manifest)
+    elif args.data_glob is not None and args.metadata_glob is not None:
+        campaigns = find_campaigns(args.data_glob, args.metadata_glob, args.sheet, args.pair_pattern)
+    else:
+        parser.error("Either --manifest or both --data-glob and --metadata-glob are required")
+
+    try:
+        summaries = run_batch(campaigns, args.output, args.cutoff, args.workers, args.cache_dir, args.store)
+    except ValueError as error:
+        parser.error(str(error))
+
+    failures = [summary for summary in summaries if summary["status"] == "failed"]
+    skipped = [summary for summary in summaries if summary["status"] == "skipped"]
+
+    print("\nReduced " + str(len(summaries) - len(failures) - len(skipped)) + " of " + str(len(summaries)) + " campaigns")
+
+    if skipped:
+        print("Skipped " + str(len(skipped)) + " campaigns already in " + args.store)
+
+    for failure in failures:
+        print("\nFailed: " + failure["name"])
+        print(failure["error"])
+
+    sys.exit(1 if failures else 0)
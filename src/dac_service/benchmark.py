@@ -0,0 +1,314 @@
+import argparse
+import json
+import resource
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+
+import numpy as np
+import pandas as pd
+
+from io import StringIO
+
+from dac import build_segment_index, data_reduction, load_files
+from parallel import parallel_data_reduction
+from streaming import read_chunks, streaming_data_reduction
+from synthetic import generate_campaign, write_campaign
+
+def reduce_in_memory(data, metadata, cutoff, paths):
+    '''
+    Reference engine, the standard in memory data_reduction().
+    '''
+
+    return data_reduction(data.copy(), metadata.copy(), cutoff)
+
+def reduce_streaming(data, metadata, cutoff, paths):
+    '''
+    Streaming engine, reading the csv copy of the data in chunks.
+    '''
+
+    return streaming_data_reduction(read_chunks(paths["csv"]), metadata.copy(), cutoff)
+
+def reduce_parallel_threads(data, metadata, cutoff, paths):
+    '''
+    Parallel engine, reducing LICOR and time range partitions on a thread pool.
+    '''
+
+    return parallel_data_reduction(data.copy(), metadata.copy(), cutoff, worker_type="thread")
+
+def reduce_parallel_processes(data, metadata, cutoff, paths):
+    '''
+    Parallel engine, reducing LICOR and time range partitions on a process pool.
+    '''
+
+    return parallel_data_reduction(data.copy(), metadata.copy(), cutoff, worker_type="process")
+
+# Reduction engines that can be benchmarked and checked against the reference, with the relative tolerance their
+# numeric output is held to. Each takes the data, metadata, cutoff, and paths to the written campaign files.
+ENGINES = {
+    "in_memory": (reduce_in_memory, 0.0),
+    "streaming": (reduce_streaming, 1e-9),
+    "parallel_threads": (reduce_parallel_threads, 0.0),
+    "parallel_processes": (reduce_parallel_processes, 0.0),
+}
+
+# Engine all others are checked against
+REFERENCE_ENGINE = "in_memory"
+
+# Seconds between samples of the resident set size while a stage runs
+RSS_INTERVAL = 0.005
+
+def excel_engines():
+    '''
+    Return:
+        A list of the names of the installed Excel reader backends
+    '''
+
+    engines = ["openpyxl"]
+
+    try:
+        import python_calamine
+        engines.append("calamine")
+    except ImportError:
+        pass
+
+    return engines
+
+def sample_rss(interval=RSS_INTERVAL):
+    '''
+    Start sampling the resident set size of this process and its children, such as process pool workers, on a
+    background thread.
+
+    Args:
+        interval Float seconds between samples
+    Return:
+        A function that stops the sampling and returns the resident set size in bytes when sampling started and the
+        highest one sampled, or None and None if psutil isn't installed
+    '''
+
+    try:
+        import psutil
+    except ImportError:
+        return lambda: (None, None)
+
+    process = psutil.Process()
+
+    def rss():
+        total = process.memory_info().rss
+
+        for child in process.children(recursive=True):
+            try:
+                total += child.memory_info().rss
+            except psutil.Error:
+                pass
+
+        return total
+
+    start = rss()
+    peak = [start]
+    stop = threading.Event()
+
+    def sample():
+        while not stop.wait(interval):
+            peak[0] = max(peak[0], rss())
+
+    thread = threading.Thread(target=sample, daemon=True)
+    thread.start()
+
+    def finish():
+        stop.set()
+        thread.join()
+
+        return start, max(peak[0], rss())
+
+    return finish
+
+def measure(function, *args, trace_memory=True):
+    '''
+    Run a function, measuring its wall time, CPU time, peak resident set size, and peak traced memory.
+
+    The resident set size of this process and its children is sampled while the function runs, so it covers memory
+    that tracing misses, such as numpy buffers and process workers. Memory freed by earlier stages may still be held by
+    the allocator, so the increase over the size the stage started at is reported as well. Memory tracing slows Python
+    code down considerably, so the traced peak is measured in a second run after the timed one.
+
+    Args:
+        function Function to run
+        args Arguments to function
+        trace_memory Boolean whether to make the second run to measure peak traced memory
+    Return:
+        The function's return value and a dictionary of "wall_seconds", "cpu_seconds", "peak_rss_mb" and
+        "rss_increase_mb", which are None without psutil, and "peak_mb", the peak traced memory, which is None without
+        trace_memory
+    '''
+
+    finish_sampling = sample_rss()
+    wall_start = time.perf_counter()
+    cpu_start = time.process_time()
+    result = function(*args)
+    cpu_seconds = time.process_time() - cpu_start
+    wall_seconds = time.perf_counter() - wall_start
+    rss_start, rss_peak = finish_sampling()
+
+    peak = None
+
+    if trace_memory:
+        tracemalloc.start()
+        try:
+            function(*args)
+            peak = tracemalloc.get_traced_memory()[1] / 1024 ** 2
+        finally:
+            tracemalloc.stop()
+
+    return result, {"wall_seconds": wall_seconds, "cpu_seconds": cpu_seconds,
+                    "peak_rss_mb": None if rss_peak is None else rss_peak / 1024 ** 2,
+                    "rss_increase_mb": None if rss_peak is None else (rss_peak - rss_start) / 1024 ** 2, "peak_mb": peak}
+
+def peak_rss_mb():
+    '''
+    Return:
+        Float peak resident set size of this process so far in MB
+    '''
+
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    # Linux reports kilobytes and macOS bytes
+    return peak / 1024 ** 2 if sys.platform == "darwin" else peak / 1024
+
+def compare_outputs(expected, actual, rtol=0.0):
+    '''
+    Check that two data reduction outputs are equivalent.
+
+    Args:
+        expected Output dictionary from the reference data_reduction()
+        actual Output dictionary from the engine under test
+        rtol Float relative tolerance for the per plant averages. With 0 the csv data must match exactly.
+    Return:
+        A list of strings describing each difference, empty if the outputs match
+    '''
+
+    differences = []
+
+    if rtol == 0.0:
+        if expected["data"] != actual["data"]:
+            differences.append("data csv differs")
+    else:
+        expected_data = pd.read_csv(StringIO(expected["data"]), index_col=0)
+        actual_data = pd.read_csv(StringIO(actual["data"]), index_col=0)
+
+        if not expected_data.columns.equals(actual_data.columns) or \
+            not expected_data["plant_tag"].equals(actual_data["plant_tag"]):
+            differences.append("data csv has different plants or gases")
+        elif not np.allclose(expected_data.iloc[:, 1:], actual_data.iloc[:, 1:], rtol=rtol, atol=0.0, equal_nan=True):
+            differences.append("data csv values differ beyond rtol " + str(rtol))
+
+    for key in ("abnormal", "above_threshold", "high_variance"):
+        if expected[key] != actual[key]:
+            differences.append(key + " differs")
+
+    if not expected["gas_prevelances"].equals(actual["gas_prevelances"]):
+        differences.append("gas_prevelances differs")
+
+    return differences
+
+def benchmark_size(rows, args, directory):
+    '''
+    Benchmark ingestion, segmentation, and reduction on one synthetic campaign size.
+
+    Args:
+        rows Integer number of data rows
+        args Parsed command line arguments
+        directory String path to a scratch directory for the campaign files
+    Return:
+        A list of result dictionaries, one per stage or engine
+    '''
+
+    data, metadata = generate_campaign(rows, args.gases, args.licors, args.plants, args.blank_placement, seed=args.seed)
+    formats = ["csv"] + ([] if args.skip_xlsx else ["xlsx"])
+    paths = write_campaign(data, metadata, directory, "rows_" + str(rows), formats)
+    results = []
+
+    def record(stage, stats):
+        stats.update({"stage": stage, "rows": rows, "rows_per_second": rows / max(stats["wall_seconds"], 1e-12)})
+        results.append(stats)
+        peak = "-" if stats["peak_mb"] is None else "%.1f" % stats["peak_mb"]
+        rss = "-" if stats["peak_rss_mb"] is None else "%.1f (+%.1f)" % (stats["peak_rss_mb"], stats["rss_increase_mb"])
+        print("%-24s %10d rows %9.3f s %9.3f cpu s %9s MB traced %16s MB RSS %12.0f rows/s" % (stage, rows,
+              stats["wall_seconds"], stats["cpu_seconds"], peak, rss, stats["rows_per_second"]), flush=True)
+
+    for _ in range(args.repeat):
+
+        if not args.skip_xlsx:
+            for engine in excel_engines():
+                _, stats = measure(load_files, paths["xlsx"], "TS_all_ppbV", paths["metadata"], None, engine,
+                                   trace_memory=args.memory)
+                record("ingest_xlsx_" + engine, stats)
+
+        _, stats = measure(load_files, paths["csv"], None, paths["metadata"], None, "csv", trace_memory=args.memory)
+        record("ingest_csv", stats)
+
+        filtered = data[data.DO1 == 1]
+        _, stats = measure(build_segment_index, filtered, metadata, trace_memory=args.memory)
+        record("segmentation", stats)
+
+        reference = ENGINES[REFERENCE_ENGINE][0](data, metadata, args.cutoff, paths)
+
+        for engine in args.engines:
+            function, rtol = ENGINES[engine]
+            output, stats = measure(function, data, metadata, args.cutoff, paths, trace_memory=args.memory)
+            differences = compare_outputs(reference, output, rtol)
+            stats["matches_reference"] = len(differences) == 0
+            stats["differences"] = differences
+            record("reduce_" + engine, stats)
+
+            for difference in differences:
+                print("    MISMATCH against " + REFERENCE_ENGINE + ": " + difference)
+
+    return results
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Benchmark the data reduction on synthetic campaigns.")
+    parser.add_argument("--rows", type=int, nargs="+", default=[10000, 50000, 200000],
+                        help="Data row counts for the scaling curve")
+    parser.add_argument("--gases", type=int, default=200)
+    parser.add_argument("--licors", type=int, default=2)
+    parser.add_argument("--plants", type=int, default=50)
+    parser.add_argument("--blank-placement", type=str, default="ends", choices=["ends", "start", "interleaved"])
+    parser.add_argument("--cutoff", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--repeat", type=int, default=1)
+    parser.add_argument("--engines", type=str, nargs="+", default=list(ENGINES), choices=list(ENGINES))
+    parser.add_argument("--no-memory", dest="memory", action="store_false",
+                        help="Skip the traced runs that measure peak memory of each stage")
+    parser.add_argument("--skip-xlsx", action="store_true", help="Skip writing and parsing xlsx, which is slow")
+    parser.add_argument("--output", type=str, default=None, help="Path to write the results as JSON")
+    args = parser.parse_args()
+
+    results = []
+
+    with tempfile.TemporaryDirectory() as directory:
+        for rows in args.rows:
+            results += benchmark_size(rows, args, directory)
+
+    print("\nPeak RSS of the whole run: %.1f MB" % peak_rss_mb())
+
+    # Scaling curve of the median wall time of each stage against the number of rows
+    curve = pd.DataFrame(results).groupby(["stage", "rows"])["wall_seconds"].median().unstack("rows")
+    print("\nMedian wall seconds by stage and row count:")
+    print(curve.to_string())
+
+    if results and results[0]["peak_rss_mb"] is not None:
+        rss_curve = pd.DataFrame(results).groupby(["stage", "rows"])["peak_rss_mb"].max().unstack("rows")
+        print("\nPeak RSS MB by stage and row count:")
+        print(rss_curve.to_string())
+
+    mismatches = [result for result in results if result.get("matches_reference") is False]
+
+    if args.output is not None:
+        with open(args.output, "w") as output_file:
+            json.dump({"results": results, "peak_rss_mb": peak_rss_mb()}, output_file, indent=2)
+
+    sys.exit(1 if mismatches else 0)
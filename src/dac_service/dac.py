@@ -1,20 +1,52 @@
 import argparse
+import os
 
+import numpy as np
 import pandas as pd
 
 from collections import Counter
 from datetime import datetime
 
-def data_reduction(df, metadata, cutoff):
+from frame_cache import FrameCache
+from gas_matrix import column_means, GasMatrix, subtract_blanks
+from profiling import activate, Profiler, span
+from stats import QuantileSketch
+
+# Number of blank standard deviations a gas must be above the blank, and the smallest threshold allowed
+BLANK_STD_MULTIPLIER = 3
+BLANK_STD_FLOOR = 0.000000000005
+
+# Fraction a 21 m/z value may differ from the LICOR's blank average, and the PC_Pressure range, for normal conditions
+MZ21_TOLERANCE = 0.25
+MIN_PRESSURE = 320
+MAX_PRESSURE = 480
+
+# Columns of the instrument data that aren't gas concentrations
+NON_GAS_COLUMNS = ["time_string", "time_number", "21 m/z", "PC_Pressure", "Mpvalve", "DO1"]
+
+def data_reduction(df, metadata, cutoff, sketches=False, dtype="float64", progressive=False, baselines=None):
     '''
     Perform the data reduction for the given LICOR data.
     
+    df may also be a dictionary from sheet names to the data of each sheet of a workbook, as from load_files() with a 
+    list of sheets, in which case every sheet is reduced against one segmentation as described for reduce_sheets() and 
+    the result is a dictionary from sheet names to the output for each sheet.
+    
+    With progressive, the result is instead a generator of each part of the results as soon as it is known, as 
+    described for reduce_progressively(), ending with {"type": "result", "output": the output Dictionary below}.
+    
     Args:
         data_file String path to the xlsx format data file
         sheet_name String sheet name where data_file has the data saved
         meradata_file String path to the xlsx format metadata file.
         cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high 
             variance list
+        sketches Boolean whether to also return "plant_sketches" and "blank_sketches" as described for 
+            reduce_campaign()
+        dtype String "float64", or "float32" to halve the memory of the gas concentrations at the cost of precision
+        progressive Boolean whether to return a generator of partial results, for a single sheet
+        baselines Optional baselines.BaselineCache to reuse each LICOR's blank statistics from, as described for 
+            reduce_campaign()
     Returns:
         A Dictionary of strings in the format:
         {
@@ -31,190 +63,560 @@ def data_reduction(df, metadata, cutoff):
         }
     '''
     
-    # DO1 is 0 or 1, with 1 represent one of the middle three measurements which are to be kept, so throw away anything with 0
-    df = df[:][df.DO1 == 1]
+    if progressive:
+        if isinstance(df, dict) or sketches:
+            raise ValueError("Progressive data reduction is only available for a single sheet without sketches")
+        
+        return progressive_output(reduce_progressively(df, metadata, dtype, baselines), cutoff)
+    
+    if isinstance(df, dict):
+        return {sheet: finish_reduction(reduction, cutoff) 
+                for sheet, reduction in reduce_sheets(df, metadata, sketches, dtype, baselines).items()}
+    
+    return finish_reduction(reduce_campaign(df, metadata, sketches, dtype, baselines), cutoff)
+
+def reduce_campaign(df, metadata, sketches=False, dtype="float64", baselines=None):
+    '''
+    Perform every part of the data reduction that doesn't depend on the high variance cutoff, so that the result can 
+    be reused for any cutoff through finish_reduction().
+    
+    Args:
+        df Dataframe of the LICOR data
+        metadata Dataframe of the measurement metadata
+        sketches Boolean whether to also sketch the distribution of every gas for each plant and each LICOR's blanks
+        dtype String "float64", or "float32" to halve the memory of the gas concentrations at the cost of precision
+        baselines Optional baselines.BaselineCache to take each LICOR's blank statistics from, so blanks it has already
+            reduced, or LICORs it has an override for, skip blank processing
+    Return:
+        The reduction Dictionary as described for summarize_plants(). With sketches, it also has "plant_sketches", a 
+        dictionary from plant tags to a QuantileSketch of the gases over the plant's measurement, and "blank_sketches", 
+        a dictionary from LICOR names to a QuantileSketch of the gases over all of the LICOR's blanks. See sketches.py.
+    '''
+    
+    return reduce_prepared(*prepare_reduction(df, metadata, dtype=dtype), metadata, sketches, baselines)
+
+def reduce_sheets(frames, metadata, sketches=False, dtype="float64", baselines=None):
+    '''
+    Perform the cutoff independent part of the data reduction for several sheets of one workbook, such as the same 
+    measurements in different units or calibrations.
+    
+    The metadata's windows are located once. Sheets whose kept rows have the same timestamps as an earlier sheet reuse 
+    its segmentation, so only their gas columns are reduced again.
+    
+    Args:
+        frames Dictionary from sheet names to Dataframes of each sheet's data
+        metadata Dataframe of the measurement metadata
+        sketches Boolean whether to also sketch each sheet's gases as described for reduce_campaign()
+        dtype String "float64" or "float32" for the gas concentrations, as described for reduce_campaign()
+        baselines Optional baselines.BaselineCache, as described for reduce_campaign(). Sheets with the same blank rows 
+            share one baseline.
+    Return:
+        A dictionary from sheet names to the reduction Dictionary of each as described for reduce_campaign()
+    '''
     
-    # Convert all time strings into hour + minute datetimes
-    df["time_string"] = df["time_string"].apply(lambda x: x.to_pydatetime())
+    reductions = {}
+    segment_index = None
     
+    for sheet, df in frames.items():
+        with span("reduce.sheet", sheet=sheet):
+            prepared = prepare_reduction(df, metadata, segment_index, dtype)
+            segment_index = prepared[1]
+            reductions[sheet] = reduce_prepared(*prepared, metadata, sketches, baselines)
+        
+    return reductions
+
+def reduce_prepared(df, segment_index, gas_matrix, extremes, metadata, sketches=False, baselines=None):
+    '''
+    Perform the cutoff independent part of the data reduction on data from prepare_reduction().
     
-    # Convert all time strings into hour + minute datetimes
-    metadata["PTR Start Time"] = metadata["PTR Start Time"].apply(lambda x: x.to_pydatetime())   
+    Args:
+        df Dataframe of the kept rows of the columns that aren't gases
+        segment_index SegmentIndex of df
+        gas_matrix GasMatrix of the gas columns of df
+        extremes Dataframe of 21 m/z and PC_Pressure extremes in each window
+        metadata Dataframe of the measurement metadata
+        sketches Boolean whether to also sketch the distribution of every gas for each plant and each LICOR's blanks
+        baselines Optional baselines.BaselineCache, as described for reduce_campaign()
+    Return:
+        The reduction Dictionary as described for reduce_campaign()
+    '''
     
     # Divide the results of the two LICORs.
     licor_names = metadata.LICOR.unique()
     
-    # Dictionary from LICOR names to metadata for that LICOR's measurements
-    metadata_per_licor = {}
-    
     # Dictionary from LICOR names to the data for that LICOR's blanks
     blanks_per_licor = {}
     
     # Dictionary from LICOR names to the mean values for 21mz concentrations for that LICOR
     blank_21mz_mean_per_licor = {}
     
-    # Dictionary from LICOR names to three times the Standard Deviation for the measurements on that LICOR's blank or the 
-    # floor value of 5 x 10 ^ -12
+    # Dictionary from LICOR names to the Standard Deviation for the measurements on that LICOR's blank
     blank_std_per_licor = {}
     
     # Dictionary of dictionaries, where the first key is the LICOR name, the second key is the species name, and the value is
-    # the Dataframe containing that species's measurements.
+    # the position of that species's measurement in the segment index.
     df_per_licor = {}
     
+    # Dictionary from LICOR names to arrays of the average concentrations of each of the LICOR's plants
+    means_per_licor = {}
+    
+    # Dictionaries from plant tags and LICOR names to their QuantileSketch, when sketching
+    plant_sketches = {}
+    blank_sketches = {}
+    
     # Organize the data for each LICOR's measurements in turn.
     for licor in licor_names:   
+        blank_segments, df_per_licor[licor] = licor_measurements(segment_index, licor)
         
-        # Grab the metadata for this LICOR's measurements
-        metadata_per_licor[licor] = metadata[:][metadata.LICOR == licor]  
-        
-        # Get only the rows with blank data in them.
-        blank_metadata = \
-            metadata_per_licor[licor][metadata_per_licor[licor]["Plant Tag"].str.startswith('Blank')]
-            
-        blanks = []
-        
-        for index, md_row in metadata_per_licor[licor].iterrows():
-            
-            if md_row["Plant Tag"].startswith("Blank"):
-            
-                # The first blank will exist be the first measurement. Get its start time.
-                start = md_row["PTR Start Time"]
-                
-                # Get the first blank's position in the list of all measurements
-                metadata_index = metadata[metadata["PTR Start Time"] == start].index[0]
-                #end1 = metadata_per_licor[licor].iloc[1]["PTR Start Time"]
-                
-                
-                if metadata_index + 1 == metadata.shape[0]:
-                    
-                    # If this was the last measurement of all, read from the start to the end of the file
-                    blanks.append(df[df["time_string"] >= start])
-                else:
-                    
-                    # If this was not the last measurement for all LICORS, get the next measurement's start time and the data between
-                    # those two times
-                    end = metadata.iloc[metadata_index + 1]["PTR Start Time"]
-                    blanks.append(df[(df["time_string"] >= start) & (df["time_string"] < end)])
+        if sketches:
+            with span("reduce.sketches", segments=len(blank_segments) + len(df_per_licor[licor])):
+                blank_sketches[licor] = window_sketch(gas_matrix, blank_segments)
                 
+                for plant_tag, segment in df_per_licor[licor].items():
+                    plant_sketches[plant_tag] = window_sketch(gas_matrix, [segment])
         
-        # Combine the first and last blank measurements
-        blank = pd.concat(blanks)
+        with span("reduce.blank_statistics", segments=len(blank_segments)):
+            blanks_per_licor[licor], blank_std_per_licor[licor], blank_21mz_mean_per_licor[licor] = \
+                licor_blank_statistics(gas_matrix, licor, blank_segments, baselines)
+     
+    # List of all abnormal tags, defined as any tag wherein at least one timestamp had a 21 m/z or PC_Pressure value more than
+    # 20% away from the expected values of 2200 or 400 respectively
+    abnormal_tags = []
     
-        # Save the 21 m/z mean before we delete it
-        blank_21mz_mean_per_licor[licor] = blank["21 m/z"].mean()
-                
-        # Remove all the metadata columns
-        blank = remove_non_gas_columns(blank)
+    # Find all abnormal tags
+    with span("reduce.abnormal_detection", segments=sum(len(plants) for plants in df_per_licor.values())):
+        for licor in licor_names:
+            abnormal_tags += find_abnormal(extremes, df_per_licor[licor], blank_21mz_mean_per_licor[licor])
+    
+    # Take the average for all gas concentration columns for each plant tag. These stay per window reductions of the 
+    # gas slices rather than a groupby or reduceat, as those use a different summation order and would change the
+    # trailing digits of the results.
+    with span("reduce.plant_means", segments=sum(len(plants) for plants in df_per_licor.values())):
+        for licor in licor_names:
+            means_per_licor[licor] = gas_matrix.window_means(list(df_per_licor[licor].values()))
         
-        # Make a copy of the blank's data and take the average of each gas's concentration
-        blank_mean = blank.copy()
-        blank_mean[blank_mean.columns.difference(['time_string', 'time_number'])] = \
-            blank_mean[blank_mean.columns.difference(['time_string', 'time_number'])].mean()
-        blanks_per_licor[licor] = blank.mean(axis=0)
+    reduction = collect_reduction({licor: list(plants.keys()) for licor, plants in df_per_licor.items()}, 
+                                  means_per_licor, gas_matrix.columns, blanks_per_licor, blank_std_per_licor, 
+                                  abnormal_tags)
+    
+    if sketches:
+        reduction["plant_sketches"] = plant_sketches
+        reduction["blank_sketches"] = blank_sketches
         
-        # Create a copy of the blank data and take the standard deviation
-        blank_std = blank.copy().std()
-        blank_std = blank_std.mul(3)
+    return reduction
+
+def reduce_progressively(df, metadata, dtype="float64", baselines=None):
+    '''
+    Perform the cutoff independent part of the data reduction as reduce_campaign() does, yielding each part of the 
+    results as soon as it is known, so an interactive user sees the first plants long before the whole campaign is 
+    reduced.
+    
+    Each LICOR's blanks are reduced first, then each of its plants in measurement order. The final reduction is built 
+    from the same plant means as reduce_campaign(), so it is identical to it.
+    
+    Args:
+        df Dataframe of the LICOR data
+        metadata Dataframe of the measurement metadata
+        dtype String "float64" or "float32" for the gas concentrations, as described for reduce_campaign()
+        baselines Optional baselines.BaselineCache, as described for reduce_campaign()
+    Return:
+        A generator of Dictionaries of JSON compatible values, each with a "type" of:
+        {
+            "blanks": once for each LICOR, with the "licor", the "mean", "std", and "threshold" dictionaries from gases
+                to the blank statistics, and the blank's "21mz_mean",
+            "plant": once for each plant, with the "plant_tag", the "licor", a dictionary of the blank subtracted 
+                "concentrations" of each gas, the list of gases "above_threshold", and whether it is "abnormal",
+            "reduction": last, with the "reduction" Dictionary as described for reduce_campaign()
+        }
+    '''
+    
+    df, segment_index, gas_matrix, extremes = prepare_reduction(df, metadata, dtype=dtype)
+    columns = gas_matrix.columns
+    gases = columns.to_list()
+    
+    plants_per_licor = {}
+    means_per_licor = {}
+    blanks_per_licor = {}
+    blank_std_per_licor = {}
+    abnormal_tags = []
+    
+    for licor in metadata.LICOR.unique():
+        blank_segments, plant_segments = licor_measurements(segment_index, licor)
+        plants_per_licor[licor] = list(plant_segments.keys())
         
-        # This is the floor value for the gas concentration magnitude check. Round up all std values to it if they are lower.
-        blank_std[blank_std < 0.000000000005] = 0.000000000005
+        with span("reduce.blank_statistics", segments=len(blank_segments)):
+            blanks_per_licor[licor], blank_std_per_licor[licor], blank_21mz_mean = \
+                licor_blank_statistics(gas_matrix, licor, blank_segments, baselines)
+            threshold = blank_threshold(blank_std_per_licor[licor])
         
-        blank_std_per_licor[licor] = blank_std
+        yield {
+            "type": "blanks",
+            "licor": licor,
+            "mean": dict(zip(gases, blanks_per_licor[licor].astype(float).to_list())),
+            "std": dict(zip(gases, blank_std_per_licor[licor].astype(float).to_list())),
+            "threshold": dict(zip(gases, threshold.astype(float).to_list())),
+            "21mz_mean": float(blank_21mz_mean),
+        }
         
-        # The index for the current measurement for this LICOR.
-        i = 0
-        df_per_licor[licor] = {}
+        means_per_licor[licor] = np.empty((len(plant_segments), len(columns)), dtype=gas_matrix.values.dtype)
         
-        # Iterate through all metadata rows for measurments, stopping before the last measurement which will be the second
-        # blank
-        while i < metadata_per_licor[licor].shape[0]:
-            
-            # Skip rows for the blanks
-            if metadata_per_licor[licor].iloc[i]["Plant Tag"].startswith("Blank"):
-                i += 1
-                continue
-            
-            # Get the start time for the current measurement
-            start = metadata_per_licor[licor].iloc[i]["PTR Start Time"]
+        # Each plant is averaged, blank subtracted, and checked on its own so it can be sent before the next
+        for row, (plant_tag, segment) in enumerate(plant_segments.items()):
+            means_per_licor[licor][row] = column_means(gas_matrix.window(segment))
+            subtracted, above = subtract_blanks(means_per_licor[licor][row:row + 1], blanks_per_licor[licor], threshold)
+            abnormal = find_abnormal(extremes, {plant_tag: segment}, blank_21mz_mean)
+            abnormal_tags += abnormal
             
-            # Get the measurement's position in the list of all measurements
-            metadata_index = metadata[metadata["PTR Start Time"] == start].index[0]
-            #end = metadata_per_licor[licor].iloc[i + 1]["PTR Start Time"]
-            
-            # Read this measurement's species identifier
-            name = metadata_per_licor[licor].iloc[i]["Plant Tag"]
-            
-            if i < metadata_per_licor[licor].shape[0] - 1:
-                
-                # The measurement ends with the start of the next one
-                end = metadata.iloc[metadata_index + 1]["PTR Start Time"]
-                
-                # Get the data between this current measurement's start and end times.
-                df_per_licor[licor][name] = df[(df["time_string"] >= start) & (df["time_string"] < end)]
-                
-            else:
-                
-                # This is the last metadata row, so get all data after the start
-                df_per_licor[licor][name] = df[df["time_string"] >= start]
-                
-            i += 1
-     
-    # List of all abnormal tags, defined as any tag wherein at least one timestamp had a 21 m/z or PC_Pressure value more than
-    # 20% away from the expected values of 2200 or 400 respectively
+            yield {
+                "type": "plant",
+                "plant_tag": plant_tag,
+                "licor": licor,
+                "concentrations": dict(zip(gases, subtracted[0].astype(float).tolist())),
+                "above_threshold": columns[above[0]].to_list(),
+                "abnormal": bool(abnormal),
+            }
+    
+    yield {"type": "reduction", 
+           "reduction": collect_reduction(plants_per_licor, means_per_licor, columns, blanks_per_licor, 
+                                          blank_std_per_licor, abnormal_tags)}
+
+def progressive_output(events, cutoff):
+    '''
+    Apply the high variance cutoff to the end of a progressive reduction.
+    
+    Args:
+        events Generator from reduce_progressively()
+        cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high 
+            variance list
+    Return:
+        A generator of the same partial results, with the final reduction replaced by {"type": "result", "output": the 
+        output Dictionary as described for data_reduction()}
+    '''
+    
+    for event in events:
+        if event["type"] == "reduction":
+            yield {"type": "result", "output": finish_reduction(event["reduction"], cutoff)}
+        else:
+            yield event
+
+def window_sketch(gas_matrix, segments):
+    '''
+    Sketch the distribution of each gas over the rows of some measurements.
+    
+    Args:
+        gas_matrix GasMatrix of the data
+        segments List of integer positions of the measurements
+    Return:
+        A QuantileSketch over the gas columns
+    '''
+    
+    sketch = QuantileSketch(gas_matrix.columns)
+    
+    for segment in segments:
+        sketch.update(gas_matrix.window(segment).T)
+        
+    return sketch
+
+def prepare_reduction(df, metadata, segment_index=None, dtype="float64", gases=None):
+    '''
+    Filter the data, convert timestamps, and locate every measurement's window of rows, as the first step of the data
+    reduction.
+    
+    Args:
+        df Dataframe of the LICOR data
+        metadata Dataframe of the measurement metadata. Its start times are converted in place.
+        segment_index Optional SegmentIndex built for other data with the same metadata, such as another sheet of the 
+            workbook, to reuse if the kept rows have the same timestamps
+        dtype String "float64", or "float32" to halve the memory of the gas concentrations at the cost of precision
+        gases Optional list of the gas columns to copy into the GasMatrix, every gas by default
+    Return:
+        A Dataframe of the kept rows of the columns that aren't gases, its SegmentIndex, a GasMatrix of the kept rows of 
+        the gas columns, and the Dataframe of 21 m/z and PC_Pressure extremes in each window from 
+        SegmentIndex.extremes()
+    '''
+    
+    # DO1 is 0 or 1, with 1 represent one of the middle three measurements which are to be kept, so throw away anything with 0.
+    # Only the columns that aren't gases are filtered here, and the gases are copied once, straight into the GasMatrix.
+    with span("reduce.filter", rows=len(df)):
+        keep = (df.DO1 == 1).to_numpy()
+        gases = gas_columns(df) if gases is None else list(gases)
+        source = df
+        df = df.loc[keep, [column for column in df.columns if column in NON_GAS_COLUMNS]]
+    
+    with span("reduce.timestamps", rows=len(df)):
+        
+        # Convert all time strings into datetimes, all at once rather than row by row
+        df["time_string"] = pd.to_datetime(df["time_string"])
+        
+        # Convert all time strings into datetimes
+        metadata["PTR Start Time"] = pd.to_datetime(metadata["PTR Start Time"])
+    
+    # Locate every measurement's window of rows in a single pass over the data
+    with span("reduce.segment_index", rows=len(df), segments=len(metadata)) as stage:
+        if segment_index is None or not segment_index.matches(df):
+            segment_index = build_segment_index(df, metadata)
+        else:
+            stage.count(reused=1)
+    
+    # The gas concentration columns are only separated from the metadata columns once, and each window is then a view 
+    # of them
+    with span("reduce.gas_matrix", rows=len(df), gases=len(gases)):
+        gas_matrix = GasMatrix.from_frame(source, gases, segment_index, keep, dtype=dtype)
+    
+    # Smallest and largest 21 m/z and PC_Pressure values in every window, found in one grouped pass
+    with span("reduce.extremes", rows=len(df), segments=len(metadata)):
+        extremes = segment_index.extremes(df, ["21 m/z", "PC_Pressure"])
+    
+    return df, segment_index, gas_matrix, extremes
+
+def licor_measurements(segment_index, licor):
+    '''
+    Find a LICOR's blank and plant measurements.
+    
+    Args:
+        segment_index SegmentIndex of the campaign
+        licor Name of the LICOR
+    Return:
+        An Index of the positions of the LICOR's blanks in the metadata, and a dictionary from the LICOR's plant tags to 
+        the position of each plant's measurement. Later measurements with the same plant tag replace earlier ones.
+    '''
+    
+    # Positions of this LICOR's blank and plant measurements within the metadata
+    licor_segments = segment_index.segments[segment_index.segments["LICOR"] == licor]
+    blank_segments = licor_segments.index[licor_segments["blank"]]
+    
+    plant_segments = {}
+    
+    # Record the measurement for each plant, skipping the rows for the blanks
+    for segment in licor_segments.index[~licor_segments["blank"]]:
+        plant_segments[licor_segments.at[segment, "Plant Tag"]] = segment
+    
+    return blank_segments, plant_segments
+
+def licor_blank_statistics(gas_matrix, licor, blank_segments, baselines=None):
+    '''
+    Get a LICOR's blank statistics, from a cache of baselines if there is one.
+    
+    Args:
+        gas_matrix GasMatrix of the data
+        licor Name of the LICOR
+        blank_segments List of integer metadata positions of the LICOR's blank measurements
+        baselines Optional baselines.BaselineCache
+    Return:
+        A Series of the average of each gas over the blanks, a Series of the standard deviation of each gas over the
+        blanks, and the average 21 m/z over the blanks
+    '''
+    
+    if baselines is None:
+        return gas_matrix.blank_statistics(blank_segments)
+    
+    return baselines.blank_statistics(licor, gas_matrix, blank_segments)
+
+def blank_threshold(blank_std, multiplier=BLANK_STD_MULTIPLIER, floor=BLANK_STD_FLOOR):
+    '''
+    Calculate the concentration threshold for each gas from the standard deviation of a LICOR's blanks.
+    
+    Args:
+        blank_std Series of the standard deviation of each gas over the blank measurements
+        multiplier Float number of standard deviations a gas must be above the blank
+        floor Float smallest threshold
+    Return:
+        A Series of multiplier times blank_std, by default three times, raised to a floor, by default 5 x 10 ^ -12
+    '''
+    
+    blank_std = blank_std.mul(multiplier)
+    
+    # This is the floor value for the gas concentration magnitude check. Round up all std values to it if they are lower.
+    blank_std[blank_std < floor] = floor
+    
+    return blank_std
+
+def is_abnormal(min_21_mz, max_21_mz, min_pressure, max_pressure, blank_21mz_mean):
+    '''
+    Check whether a plant measurement had abnormal conditions, defined as any timestamp with a 21 m/z more than 25% away 
+    from the LICOR's blank average or a PC_Pressure outside the range 320-480.
+    
+    Args:
+        min_21_mz Float smallest 21 m/z value during the measurement
+        max_21_mz Float largest 21 m/z value during the measurement
+        min_pressure Float smallest PC_Pressure value during the measurement
+        max_pressure Float largest PC_Pressure value during the measurement
+        blank_21mz_mean Float mean 21 m/z value over the LICOR's blanks
+    Return:
+        True if the measurement was abnormal, False otherwise
+    '''
+    
+    # Calculate the minimum/maximum expected 21 m/z as the blank's avererage +/- 25%
+    min_21_mz_limit = blank_21mz_mean - (blank_21mz_mean * MZ21_TOLERANCE)
+    max_21_mz_limit = blank_21mz_mean + (blank_21mz_mean * MZ21_TOLERANCE)
+    
+    return bool(min_21_mz <= min_21_mz_limit or max_21_mz >= max_21_mz_limit or min_pressure <= MIN_PRESSURE or \
+                max_pressure >= MAX_PRESSURE)
+
+def find_abnormal(extremes, plant_segments, blank_21mz_mean):
+    '''
+    Find a LICOR's plants with abnormal conditions.
+    
+    Args:
+        extremes Dataframe of 21 m/z and PC_Pressure extremes in each window from SegmentIndex.extremes()
+        plant_segments Dictionary from the LICOR's plant tags to the position of each plant's measurement
+        blank_21mz_mean Float mean 21 m/z value over the LICOR's blanks
+    Return:
+        A list of the plant tags with abnormal conditions, in the order of plant_segments
+    '''
+    
     abnormal_tags = []
     
-    # Find all abnormal tags
-    for licor in licor_names:
-        
-        # Calculate the minimum/maximum expected 21 m/z as the blank's avererage +/- 25%
-        blank_mean = blank_21mz_mean_per_licor[licor]
-        min_21_mz = blank_mean - (blank_mean * 0.25)
-        max_21_mz = blank_mean + (blank_mean * 0.25)
-        
-        for plant_tag in df_per_licor[licor].keys():
-            plant_df = df_per_licor[licor][plant_tag]
-            if (plant_df["21 m/z"] <= min_21_mz).any() or \
-                (plant_df["21 m/z"] >= max_21_mz).any() or \
-                (plant_df["PC_Pressure"] <= 320).any() or \
-                (plant_df["PC_Pressure"] >= 480).any():
-                abnormal_tags.append(plant_tag)
-    
-    # Take the average for all gas concentration columns for each plant tag
-    for licor in licor_names:
-        for plant_tag in df_per_licor[licor].keys():
-            df_per_licor[licor][plant_tag] = remove_non_gas_columns(df_per_licor[licor][plant_tag]).mean()
-        
-    # List of all plant tags
+    for plant_tag, segment in plant_segments.items():
+        if is_abnormal(extremes.at[segment, "21 m/z min"], extremes.at[segment, "21 m/z max"], 
+                       extremes.at[segment, "PC_Pressure min"], extremes.at[segment, "PC_Pressure max"], 
+                       blank_21mz_mean):
+            abnormal_tags.append(plant_tag)
+    
+    return abnormal_tags
+
+def collect_reduction(plants_per_licor, means_per_licor, columns, blanks_per_licor, blank_std_per_licor, abnormal_tags):
+    '''
+    Subtract the blanks from each plant's average gas concentrations and combine the results.
+    
+    Args:
+        plants_per_licor Dictionary from LICOR names to lists of the LICOR's plant tags
+        means_per_licor Dictionary from LICOR names to arrays of shape (plants, gases) of the average gas concentrations
+            of each of the LICOR's plants, in the same order as plants_per_licor
+        columns Index of the gas names
+        blanks_per_licor Dictionary from LICOR names to Series of the average gas concentrations over that LICOR's blanks
+        blank_std_per_licor Dictionary from LICOR names to Series of the standard deviation of each gas over that 
+            LICOR's blanks
+        abnormal_tags List of plant tags with abnormal conditions
+    Return:
+        The reduction Dictionary as described for summarize_plants()
+    '''
+    
+    # List of all plant tags, and the LICOR that measured each
     plant_tags = []
+    plant_licors = []
     
-    # Dataframe containing final results, with each row containing a plant rag and average values for all that plant's gas
-    # concentrations
-    full_df = []
+    # Blank subtracted concentrations of each LICOR's plants, and whether each is above the LICOR's threshold
+    subtracted = []
+    above = []
     
     # Dictionary from string plant tag names to lists of strings for the gases that are above the threshold value for
     # that plant.
     plants_to_gases = {}
         
-    for licor in licor_names:
-        for plant_tag in df_per_licor[licor].keys():
-            
-            # Subtract the blank's background values from each gas's concentration
-            plant_df = df_per_licor[licor][plant_tag]
-            df_per_licor[licor][plant_tag] = plant_df.sub(blanks_per_licor[licor], axis=0)
-            
-            # Get the list of all gases above the 3 x standard deviation cutoff value for this plant
-            plant_df = df_per_licor[licor][plant_tag]
-            above_threshold = plant_df.gt(blank_std_per_licor[licor])
-            plants_to_gases[plant_tag] = above_threshold[above_threshold == True].index.to_list()
+    with span("reduce.blank_subtraction", segments=sum(len(plants) for plants in plants_per_licor.values())):
+        for licor, plants in plants_per_licor.items():
+        
+            # Three times the Standard Deviation for the measurements on the LICOR's blank or the floor value, 
+            # subtracted and compared for all of the LICOR's plants at once
+            licor_subtracted, licor_above = subtract_blanks(means_per_licor[licor], blanks_per_licor[licor], 
+                                                            blank_threshold(blank_std_per_licor[licor]))
+            subtracted.append(licor_subtracted)
+            above.append(licor_above)
             
-            # Create individual tag csv files
-            #plant_df.to_csv(plant_tag + ".csv")
-            #blanks_per_licor[licor].to_csv(licor + "_blank.csv")
-            #blank_std_per_licor[licor].to_csv(licor + "_std.csv")
+            plant_tags += plants
+            plant_licors += [licor] * len(plants)
+        
+        subtracted = np.concatenate(subtracted) if subtracted else np.empty((0, len(columns)))
+        above = np.concatenate(above) if above else np.empty((0, len(columns)), dtype=bool)
             
-            plant_tags.append(plant_tag)
-            full_df.append(plant_df)
+        for row, plant_tag in enumerate(plant_tags):
+            plants_to_gases[plant_tag] = columns[above[row]].to_list()
+        
+        # One row per plant, with each gas's values contiguous as pandas lays out a frame built from rows
+        full_df = pd.DataFrame(np.ascontiguousarray(subtracted.T).T, columns=columns)
+    
+    return summarize_plants(plant_tags, plant_licors, full_df, plants_to_gases, abnormal_tags, blanks_per_licor, 
+                            blank_std_per_licor)
+
+def subtract_blank(plant_mean, blank_mean, blank_std):
+    '''
+    Subtract a LICOR's blank from a plant's average gas concentrations and find the gases above the threshold.
+    
+    Args:
+        plant_mean Series of the plant's average concentration for each gas
+        blank_mean Series of the average concentration for each gas over the LICOR's blanks
+        blank_std Series of the threshold for each gas from blank_threshold()
+    Return:
+        A Series of the plant's blank subtracted concentrations and a list of the gases above the threshold
+    '''
+    
+    # Subtract the blank's background values from each gas's concentration
+    plant_df = plant_mean.sub(blank_mean, axis=0)
+    
+    # Get the list of all gases above the 3 x standard deviation cutoff value for this plant
+    above_threshold = plant_df.gt(blank_std)
+    
+    return plant_df, above_threshold[above_threshold == True].index.to_list()
+
+def summarize_plants(plant_tags, plant_licors, full_df, plants_to_gases, abnormal_tags, blanks_per_licor, 
+                     blank_std_per_licor):
+    '''
+    Combine the blank subtracted results for each plant into every part of the data reduction output that doesn't
+    depend on the high variance cutoff.
+    
+    Args:
+        plant_tags List of plant tags in output order
+        plant_licors List of the LICOR that measured each plant, in the same order as plant_tags
+        full_df List of Series of each plant's blank subtracted concentrations, in the same order as plant_tags, or a 
+            Dataframe of them with one row per plant
+        plants_to_gases Dictionary from plant tags to lists of the gases above the threshold for that plant
+        abnormal_tags List of plant tags with abnormal conditions
+        blanks_per_licor Dictionary from LICOR names to Series of the average gas concentrations over that LICOR's blanks
+        blank_std_per_licor Dictionary from LICOR names to Series of the standard deviation of each gas over that 
+            LICOR's blanks
+    Return:
+        A Dictionary in the format:
+        {
+            "plants": Dataframe of the csv data, a "plant_tag" column followed by each plant's blank subtracted 
+                concentrations,
+            "plant_licors": [ "the LICOR that measured each row of plants" ],
+            "gas_std": Series of the standard deviation of each gas over all plants,
+            "abnormal": [ "list of plant tags with abnormal metadata" ],
+            "above_threshold": { "plant1": [ "list of gases for plant1 above the threshold" ] },
+            "gas_prevelances": sorted Dataframe of the percentage of plants each gas was above the threshold for,
+            "blanks": { "LICOR1": Series of the average gas concentrations over the LICOR's blanks },
+            "blank_stds": { "LICOR1": Series of the standard deviation of each gas over the LICOR's blanks }
+        }
+        which finish_reduction() turns into the output of data_reduction(). The csv data is only formatted once it is
+        needed, by plants_csv().
+    '''
+    
+    with span("reduce.prevalences", plants=len(plants_to_gases)):
+        gas_prevalences = count_prevalences(plants_to_gases)
             
+    # Combine list of plant dataframes into one full dataframe        
+    full_df = pd.DataFrame(full_df)    
+    
+    # Standard deviation of each gas over plant species, for the high variance check
+    gas_std = full_df.std()
+    pd.set_option('display.max_colwidth', None)
+    
+    # Add the list of plant tags as a new column
+    full_df.insert(0, "plant_tag", plant_tags)
+    
+    reduction = {}
+    reduction["plants"] = full_df
+    reduction["plant_licors"] = plant_licors
+    reduction["gas_std"] = gas_std
+    reduction["abnormal"] = abnormal_tags
+    reduction["above_threshold"] = plants_to_gases
+    reduction["gas_prevelances"] = gas_prevalences
+    reduction["blanks"] = blanks_per_licor
+    reduction["blank_stds"] = blank_std_per_licor
+    
+    return reduction
+
+def count_prevalences(plants_to_gases):
+    '''
+    Find the fraction of plants each gas was above the threshold for.
+    
+    Args:
+        plants_to_gases Dictionary from plant tags to lists of the gases above the threshold for that plant
+    Return:
+        A Dataframe of "Gas" and "Prevalence" columns, sorted by descending prevalence
+    '''
+    
     # Create a list of all gases that were above the threshold, appearing a number of times equal to the number of
     # plants for which each was above the threshold
     full_above_threshold_gas_list = []
@@ -226,50 +628,109 @@ def data_reduction(df, metadata, cutoff):
     gas_prevalences = pd.DataFrame(Counter(full_above_threshold_gas_list).items(), columns=['Gas', 'Prevalence'])
     gas_prevalences['Prevalence'] = gas_prevalences['Prevalence'].apply(lambda x: x / len(plants_to_gases.keys()))
     gas_prevalences = gas_prevalences.sort_values('Prevalence',ascending=False).reset_index(drop=True)
-            
-    # Combine list of plant dataframes into one full dataframe        
-    full_df = pd.DataFrame(full_df)    
+    
+    return gas_prevalences
+
+def plants_csv(reduction):
+    '''
+    Get the csv data for the output file of a reduction, formatting it the first time it is needed. Binary outputs
+    (see result_format.py) never need it.
+    
+    Args:
+        reduction Dictionary from summarize_plants()
+    Return:
+        The csv data in string format
+    '''
+    
+    if "data" not in reduction:
+        with span("reduce.csv_serialization", plants=len(reduction["plants"])):
+            reduction["data"] = reduction["plants"].to_csv()
+    
+    return reduction["data"]
+
+def finish_reduction(reduction, cutoff, csv=True):
+    '''
+    Apply the high variance cutoff to a reduction from summarize_plants().
+    
+    Args:
+        reduction Dictionary from summarize_plants()
+        cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high 
+            variance list
+        csv Boolean whether to include the csv "data", which binary outputs don't need
+    Return:
+        The output Dictionary as described for data_reduction()
+    '''
     
     #high_variance = full_df.apply(lambda x: True if x.max() * 0.95 >= x.min() else False, axis=0)
     # We take as high varience those gases whose standard deviation over plant species is > 0.1
-    high_variance = full_df.columns[(full_df.std() >= cutoff).to_list()]
-    #print("Gasses with high variance")
-    pd.set_option('display.max_colwidth', None)
-    #print(high_variance)        
-    
-    # Add the list of plant tags as a new column
-    full_df.insert(0, "plant_tag", plant_tags)
+    with span("reduce.high_variance", gases=len(reduction["gas_std"])):
+        gas_std = reduction["gas_std"]
+        high_variance = gas_std.index[(gas_std >= cutoff).to_list()]
     
     output = {}
-    output["data"] = full_df.to_csv()
-    output["abnormal"] = abnormal_tags
-    output["above_threshold"] = plants_to_gases
+    if csv:
+        output["data"] = plants_csv(reduction)
+    output["abnormal"] = reduction["abnormal"]
+    output["above_threshold"] = reduction["above_threshold"]
     output["high_variance"] = high_variance.to_list()
-    output["gas_prevelances"] = gas_prevalences
+    output["gas_prevelances"] = reduction["gas_prevelances"]
+    
+    for sketches in ("plant_sketches", "blank_sketches"):
+        if sketches in reduction:
+            output[sketches] = reduction[sketches]
     
     # Create the output csv file.
     return output
         
-def load_files(data, sheet, metadata):
+def load_files(data, sheet, metadata, cache=None, engine=None, schema=None, timings=None):
     '''
     Load the files of LICOR data into data frames
     
+    Only the columns the reduction uses and the rows with DO1 set are loaded, and timestamps are parsed as datetime64. 
+    See ingest.py.
+    
+    A list of sheet names, or None for a workbook, loads those sheets or every sheet from one opening of the workbook, 
+    for reduce_sheets() or data_reduction().
+    
     Args:
-        data_file String path to the xlsx format data file
-        sheet_name String sheet name where data_file has the data saved
+        data_file String path to the xlsx, csv, or Parquet format data file
+        sheet_name String sheet name where data_file has the data saved, a list of sheet names, or None for every sheet
         meradata_file String path to the xlsx format metadata file.
+        cache Optional FrameCache to read previously parsed sheets from instead of parsing the files again
+        engine Optional string name of the reader backend for the data file in ingest.READERS, chosen from the file 
+            extension by default
+        schema Optional ingest.DataSchema of the data, the PTR data layout by default
+        timings Optional dictionary to record the seconds each loading stage took in
     Return
-        Two dataframes, the first with the contents of the data file and the second with the contents of the metadata file
+        Two dataframes, the first with the contents of the data file and the second with the contents of the metadata 
+        file. For several sheets the first is a dictionary from sheet names to the dataframe of each.
     '''
     
+    from ingest import DEFAULT_SCHEMA, default_engine, load_data, load_metadata, load_sheets
+    
+    engine = engine or default_engine(data)
+    
     # Read in the data file and specify the sheet name the data is under
-    df = pd.read_excel(data, sheet_name=sheet)
+    if isinstance(sheet, (list, tuple)) or (sheet is None and engine in ("openpyxl", "calamine")):
+        df = load_sheets(data, sheet, schema or DEFAULT_SCHEMA, engine, cache, timings=timings)
+    else:
+        df = load_data(data, sheet, schema or DEFAULT_SCHEMA, engine, cache, timings=timings)
     
     # Read the metadata file
-    metadata = pd.read_excel(metadata)
+    metadata = load_metadata(metadata, cache=cache, timings=timings)
     
     return df, metadata
+
+def gas_columns(df):
+    '''
+    Args:
+        df Dataframe of instrument data
+    Return:
+        A list of the names of the columns of df that are gas concentrations
+    '''
     
+    # Columns left out when loading the data are already gone
+    return [column for column in df.columns if column not in NON_GAS_COLUMNS]
 
 def remove_non_gas_columns(df):
     '''
@@ -281,13 +742,215 @@ def remove_non_gas_columns(df):
         A Dataframe containing only the gas columns from df
     '''
     
-    df = df.drop("time_string", axis=1)
-    df = df.drop("time_number", axis=1)
-    df = df.drop("21 m/z", axis=1)      
-    df = df.drop("PC_Pressure", axis=1)
-    df = df.drop("Mpvalve", axis=1)
-    df = df.drop("DO1", axis=1)
-    return df
+    return df[gas_columns(df)]
+
+class SegmentIndex():
+    '''
+    Index from each metadata measurement to the rows of instrument data recorded during it.
+    
+    Rows are held in time order, so every measurement's window is a contiguous range [row_start, row_stop) of that
+    ordering and can be cut out without scanning the whole data set.
+    
+    Attributes:
+        order: Integer array of data row positions sorted by time, or None if the data was already in time order with
+            no missing timestamps.
+        segments: Dataframe of measurement windows from measurement_windows(), with the "row_start" and "row_stop" of 
+            each window added.
+        times: datetime64[ns] array of the timestamps of the data rows the index was built from, in their original 
+            order, or None if unknown.
+    '''
+    
+    def __init__(self, order, segments, times=None):
+        '''
+        Default constructor.
+        
+        Args:
+            order Integer array of data row positions in time order, or None for data already in time order
+            segments Dataframe of measurement windows as described for the class
+            times Optional datetime64[ns] array of the timestamps of the data rows, to check other data against
+        '''
+        
+        self.order = order
+        self.segments = segments
+        self.times = times
+        self.row_start = segments["row_start"].to_numpy()
+        self.row_stop = segments["row_stop"].to_numpy()
+    
+    def matches(self, df):
+        '''
+        Check whether the index also applies to other data, because its rows have the same timestamps in the same order.
+        
+        Args:
+            df Dataframe of instrument data with a datetime64 "time_string" column
+        Return:
+            True if the index can be used for df
+        '''
+        
+        if self.times is None:
+            return False
+        
+        return np.array_equal(df["time_string"].to_numpy().astype("datetime64[ns]"), self.times)
+        
+    def window(self, frame, segment):
+        '''
+        Get the rows of frame that belong to a measurement.
+        
+        Args:
+            frame Dataframe or Series aligned row for row with the data the index was built from
+            segment Integer metadata position of the measurement
+        Return:
+            The rows of frame for the measurement, in their original order
+        '''
+        
+        start = self.row_start[segment]
+        stop = self.row_stop[segment]
+        
+        if self.order is None:
+            return frame.iloc[start:stop]
+        
+        # Sorting the positions keeps the rows in the order a boolean mask over the data would have produced
+        return frame.iloc[np.sort(self.order[start:stop])]
+    
+    def extremes(self, frame, columns):
+        '''
+        Find the minimum and maximum of some columns within every measurement window in one vectorized pass.
+        
+        Args:
+            frame Dataframe aligned row for row with the data the index was built from
+            columns List of string column names
+        Return:
+            A Dataframe indexed by metadata position with "<column> min" and "<column> max" for each column. Missing 
+            values are ignored and windows without data have NaN for both.
+        '''
+        
+        extremes = pd.DataFrame(index=self.segments.index)
+        
+        if len(self.segments) == 0:
+            return extremes
+        
+        # Interleave the window bounds so that every even reduceat result covers exactly one window. The NaN sentinel 
+        # keeps the bounds of windows running to the end of the data in range.
+        bounds = np.column_stack((self.row_start, self.row_stop)).ravel()
+        empty = self.row_stop <= self.row_start
+        
+        for column in columns:
+            values = frame[column].to_numpy(dtype=float)
+            
+            if self.order is not None:
+                values = values[self.order]
+                
+            values = np.append(values, np.nan)
+            
+            minimums = np.fmin.reduceat(values, bounds)[::2]
+            maximums = np.fmax.reduceat(values, bounds)[::2]
+            minimums[empty] = np.nan
+            maximums[empty] = np.nan
+            
+            extremes[column + " min"] = minimums
+            extremes[column + " max"] = maximums
+            
+        return extremes
+        
+
+def measurement_windows(metadata):
+    '''
+    Find the time window covered by each measurement in the metadata.
+    
+    A measurement runs from its "PTR Start Time" until the start time of the next row of the metadata. The last 
+    measurement runs until the end of the data, as does the last plant measurement for each LICOR.
+    
+    Args:
+        metadata Dataframe of measurement metadata with "Plant Tag", "LICOR", and "PTR Start Time" columns
+    Return:
+        A Dataframe with one row per metadata row, indexed by metadata position, with the "Plant Tag", "LICOR", whether
+        the measurement is a "blank", and its "PTR Start Time" and "PTR End Time". The end time is NaT for measurements
+        that run until the end of the data.
+    '''
+    
+    starts = pd.to_datetime(metadata["PTR Start Time"]).to_numpy().astype("datetime64[ns]")
+    num_measurements = starts.shape[0]
+    
+    # A measurement's position is that of the first metadata row with the same start time, and it ends at the start of
+    # the following row
+    _, first, inverse = np.unique(starts, return_index=True, return_inverse=True)
+    next_position = first[inverse.reshape(-1)] + 1
+    ends = starts[np.minimum(next_position, max(num_measurements - 1, 0))]
+    
+    blank = metadata["Plant Tag"].str.startswith("Blank").to_numpy(dtype=bool)
+    last_for_licor = ~metadata["LICOR"].duplicated(keep="last").to_numpy()
+    open_ended = np.where(blank, False, last_for_licor) | (next_position >= num_measurements)
+    
+    return pd.DataFrame({
+        "Plant Tag": metadata["Plant Tag"].to_numpy(),
+        "LICOR": metadata["LICOR"].to_numpy(),
+        "blank": blank,
+        "PTR Start Time": starts,
+        "PTR End Time": np.where(open_ended, np.datetime64("NaT", "ns"), ends),
+    })
+
+def locate_windows(sorted_times, windows):
+    '''
+    Find the range of rows in time sorted data that falls in each measurement window.
+    
+    Args:
+        sorted_times Array of datetime64[ns] timestamps in ascending order, without NaT
+        windows Dataframe of measurement windows from measurement_windows()
+    Return:
+        Two integer arrays with the first row and one past the last row of each window
+    '''
+    
+    ends = windows["PTR End Time"].to_numpy().astype("datetime64[ns]")
+    open_ended = np.isnat(ends)
+    
+    starts = windows["PTR Start Time"].to_numpy().astype("datetime64[ns]")
+    
+    row_start = np.searchsorted(sorted_times, starts, side="left")
+    row_stop = np.searchsorted(sorted_times, np.where(open_ended, starts, ends), side="left")
+    row_stop = np.where(open_ended, sorted_times.shape[0], row_stop)
+    
+    return row_start, np.maximum(row_stop, row_start)
+
+def sort_times(times):
+    '''
+    Order timestamps for binary searching, dropping any that are missing.
+    
+    Args:
+        times Array of datetime64[ns] timestamps
+    Return:
+        An integer array of the positions of the present timestamps in ascending time order, or None if times is 
+        already sorted with none missing, and the sorted timestamps
+    '''
+    
+    valid = ~np.isnat(times)
+    
+    if valid.all() and (np.diff(times) >= np.timedelta64(0, "ns")).all():
+        return None, times
+    
+    order = np.flatnonzero(valid)
+    order = order[np.argsort(times[order], kind="stable")]
+    return order, times[order]
+
+def build_segment_index(df, metadata):
+    '''
+    Divide the instrument data into the windows for each measurement in the metadata.
+    
+    The data is sorted by time once and each window's bounds are then found with a binary search instead of comparing
+    every row against every measurement.
+    
+    Args:
+        df Dataframe of instrument data with a "time_string" column
+        metadata Dataframe of measurement metadata with "Plant Tag", "LICOR", and "PTR Start Time" columns
+    Return:
+        A SegmentIndex for the measurements in metadata over the rows of df
+    '''
+    
+    segments = measurement_windows(metadata)
+    
+    times = pd.to_datetime(df["time_string"]).to_numpy().astype("datetime64[ns]")
+    order, sorted_times = sort_times(times)
+    segments["row_start"], segments["row_stop"] = locate_windows(sorted_times, segments)
+    
+    return SegmentIndex(order, segments, times)
 
 if __name__ == "__main__":
     
@@ -298,23 +961,152 @@ if __name__ == "__main__":
     parser.add_argument("sheet", type=str, default="TS_all_ppbV")
     parser.add_argument("metadata", type=str, default="2024_05_09_Metadata.xlsx")
     parser.add_argument("cutoff", type=float, default=0.1)
+    parser.add_argument("--cache-dir", type=str, default=None, 
+                        help="Directory to cache parsed sheets in, so that later runs on the same files skip parsing")
+    parser.add_argument("--cache-size", type=float, default=2.0, help="Maximum size of the cache directory in GB")
+    parser.add_argument("--stream", action="store_true", 
+                        help="Read the data file in chunks with bounded memory. Supports xlsx, csv, and Parquet data files.")
+    parser.add_argument("--chunk-rows", type=int, default=50000, help="Number of data rows per chunk with --stream")
+    parser.add_argument("--engine", type=str, default=None, choices=["openpyxl", "calamine", "csv", "parquet"], 
+                        help="Reader for the data file, chosen from its extension by default")
+    parser.add_argument("--timings", action="store_true", help="Print the time each loading stage took")
+    parser.add_argument("--profile", type=str, default=None, 
+                        help="Path to write the time, memory, and counts of each loading and reduction stage to")
+    parser.add_argument("--profile-format", type=str, default="json", choices=["json", "chrome"], 
+                        help="Write the profile as JSON spans and totals, or as a Chrome trace")
+    parser.add_argument("--profile-memory", action="store_true", 
+                        help="Also trace the peak memory of each stage, which slows the run down")
+    parser.add_argument("--workers", type=int, default=None, 
+                        help="Reduce each LICOR's blanks and time ranges of its plants in parallel on this many workers")
+    parser.add_argument("--worker-type", type=str, default="thread", choices=["thread", "process"], 
+                        help="Type of worker for --workers")
+    parser.add_argument("--format", type=str, default="csv", choices=["csv", "arrow", "parquet"], 
+                        help="Save the plant matrix as out.csv, or every result table as out_<table>.arrow or .parquet")
+    parser.add_argument("--sketches", type=str, default=None, 
+                        help="Path to save quantile sketches of every gas for each plant and each LICOR's blanks to")
+    parser.add_argument("--store", type=str, default=None, 
+                        help="SQLite result store to add the results to, see result_store.py")
+    parser.add_argument("--campaign", type=str, default=None, 
+                        help="Name of the campaign in --store, the data file's name by default")
+    parser.add_argument("--float32", action="store_true", 
+                        help="Hold the gas concentrations as float32, halving their memory at the cost of precision")
+    parser.add_argument("--baselines", type=str, default=None, 
+                        help="Directory to keep each LICOR's blank baseline in, so later runs on the same blanks skip them")
+    parser.add_argument("--blank-baseline", type=str, nargs=2, action="append", default=[], metavar=("LICOR", "PATH"), 
+                        help="Use the blank baseline saved at PATH by baselines.py for LICOR instead of reducing its blanks")
+    sheets = parser.add_mutually_exclusive_group()
+    sheets.add_argument("--sheets", type=str, nargs="+", default=None, 
+                        help="Reduce these sheets of the workbook against one segmentation instead of only sheet")
+    sheets.add_argument("--all-sheets", action="store_true", help="Reduce every sheet of the workbook, as for --sheets")
     args = parser.parse_args()    
     
-    data, metadata = load_files(args.data, args.sheet, args.metadata)
+    multiple_sheets = args.sheets is not None or args.all_sheets
+    if multiple_sheets and (args.stream or args.workers is not None):
+        parser.error("--sheets and --all-sheets can't be combined with --stream or --workers")
+    if args.float32 and args.stream:
+        parser.error("--float32 can't be combined with --stream")
+    if args.stream and (args.baselines is not None or args.blank_baseline):
+        parser.error("--baselines and --blank-baseline can't be combined with --stream")
+    dtype = "float32" if args.float32 else "float64"
+    
+    cache = None
+    if args.cache_dir is not None:
+        cache = FrameCache(args.cache_dir, max_bytes=int(args.cache_size * 1024 ** 3))
+    
+    baselines = None
+    if args.baselines is not None or args.blank_baseline:
+        from baselines import BaselineCache, BlankBaseline
+        
+        baselines = BaselineCache(args.baselines, 
+                                  {licor: BlankBaseline.load(path) for licor, path in args.blank_baseline})
+    
     pd.set_option('display.max_colwidth', None)
     pd.set_option('display.max_columns', None)
     pd.set_option('display.max_rows', None)
-
-    output = data_reduction(data, metadata, args.cutoff)
-    with open("out.csv", "w") as out_file:
-        out_file.write(output["data"])
-        
-    print("Abnormal conditions detected for the following plants:")
-    print(output["abnormal"])
-    for plant in output["above_threshold"]:
-        print("\nGases above threshold detected for plant " + plant)
-        print(output["above_threshold"][plant])
-    print("\nGases with the percentage of plants for which they were above the concentration threshold:")
-    print(output["gas_prevelances"])
-    print("\nGases with high variance over different plant species")
-    print(output["high_variance"])
+    
+    profiler = Profiler(trace_memory=args.profile_memory) if args.profile is not None else None
+    
+    with activate(profiler):
+        if args.stream:
+            from streaming import read_chunks, streaming_reduce_campaign
+        
+            metadata = cache.read_excel(args.metadata) if cache is not None else pd.read_excel(args.metadata)
+            reduction = streaming_reduce_campaign(read_chunks(args.data, args.sheet, args.chunk_rows), metadata, 
+                                                  args.sketches is not None)
+        else:
+            timings = {}
+            data, metadata = load_files(args.data, args.sheets if multiple_sheets else args.sheet, args.metadata, 
+                                        cache=cache, engine=args.engine, timings=timings)
+            
+            if multiple_sheets:
+                reductions = reduce_sheets(data, metadata, args.sketches is not None, dtype, baselines)
+            elif args.workers is not None:
+                from parallel import parallel_reduce_campaign
+                
+                reduction = parallel_reduce_campaign(data, metadata, args.workers, args.worker_type, 
+                                                     sketches=args.sketches is not None, dtype=dtype, 
+                                                     baselines=baselines)
+            else:
+                reduction = reduce_campaign(data, metadata, args.sketches is not None, dtype, baselines)
+        
+            if args.timings:
+                for stage, seconds in timings.items():
+                    print("%-20s %9.3f s" % (stage, seconds))
+        
+        # A single sheet is written to the original file names, and each of several sheets to out_<sheet>
+        if not multiple_sheets:
+            reductions = {None: reduction}
+        
+        store = None
+        if args.store is not None:
+            from result_store import campaign_start, ResultStore, source_key
+            
+            store = ResultStore(args.store)
+            campaign = args.campaign or os.path.splitext(os.path.basename(args.data))[0]
+        
+        outputs = {}
+        for sheet, reduction in reductions.items():
+            prefix = "out" if sheet is None else "out_" + str(sheet)
+            output = outputs[sheet] = finish_reduction(reduction, args.cutoff, csv=args.format == "csv")
+        
+            if args.format == "csv":
+                with open(prefix + ".csv", "w") as out_file:
+                    out_file.write(output["data"])
+            else:
+                from result_format import encode_tables, write_tables
+                
+                write_tables(encode_tables(reduction, args.cutoff, args.format), prefix, args.format)
+            
+            if args.sketches is not None:
+                from sketches import save_sketches
+                
+                root, extension = os.path.splitext(args.sketches)
+                save_sketches(reduction, args.sketches if sheet is None else root + "_" + str(sheet) + extension)
+            
+            # Campaigns whose files were already added are skipped
+            if store is not None:
+                store.add(campaign if sheet is None else campaign + "/" + str(sheet), reduction, 
+                          source_key(args.data, args.sheet if sheet is None else sheet, args.metadata), 
+                          campaign_start(metadata))
+        
+        if store is not None:
+            store.close()
+    
+    if profiler is not None:
+        profiler.write(args.profile, args.profile_format)
+        profiler.print_summary()
+        print()
+        
+    for sheet, output in outputs.items():
+        if sheet is not None:
+            print("\n===== Sheet " + str(sheet) + " =====\n")
+        
+        print("Abnormal conditions detected for the following plants:")
+        print(output["abnormal"])
+        for plant in output["above_threshold"]:
+            print("\nGases above threshold detected for plant " + plant)
+            print(output["above_threshold"][plant])
+        print("\nGases with the percentage of plants for which they were above the concentration threshold:")
+        print(output["gas_prevelances"])
+        print("\nGases with high variance over different plant species")
+        print(output["high_variance"])
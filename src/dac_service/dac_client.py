@@ -1,8 +1,13 @@
 import argparse
 import json
+import os
+import time
+import uuid
+
 import pandas as pd
 
-from dac import load_files
+from object_store import DEFAULT_CHUNK_BYTES, fetch_verified, put_chunked, store_from_config
+from result_format import above_threshold_lists, decode_table, EXTENSIONS, fetch_tables, FORMATS, write_tables
 
 from intersect_sdk import (
     INTERSECT_JSON_VALUE,
@@ -13,41 +18,422 @@ from intersect_sdk import (
     default_intersect_lifecycle_loop,
 )
 
+# Hierarchy of the data reduction service
+SERVICE = "oak-ridge-national-laboratory.none.bessd-pilot.dac.data-reduction"
 
-def simple_client_callback(
-    _source: str, _operation: str, _has_error: bool, payload: INTERSECT_JSON_VALUE
-) -> None:
-    """This simply prints the response from the service to your console.
 
-    As we don't want to engage in a back-and-forth, we simply throw an exception to break out of the message loop.
-    Ways to continue listening to messages or sending messages will be explored in other examples.
+def resolve_output(output, store):
+    """
+    Get the output dictionary of a response, fetching it from the object store if it was returned by reference.
 
     Params:
-      _source: the source of the response message. In this case it will always be from the hello_service.
-      _operation: the name of the function we called in the original message. In this case it will always be "say_hello_to_name".
-      _has_error: Boolean value which represents an error. Since there is never an error in this example, it will always be "False".
-      payload: Value of the response from the Service. The typing of the payload varies, based on the operation called and whether or not
-        _has_error was set to "True". In this case, since we do not have an error, we can defer to the operation's response type. This response type is
-        "str", so the type will be "str". The value will always be "Hello, hello_client!".
-
-        Note that the payload will always be a deserialized Python object, but the types are fairly limited: str, bool, float, int, None, List[T], and Dict[str, T]
-        are the only types the payload can have. "T" in this case can be any of the 7 types just mentioned.
-    """
-
-    with open("out.csv", "w") as out_file:
-        out_file.write(payload["data"])
-        
-    print("Abnormal conditions detected for the following plants:")
-    print(payload["abnormal"])
-    for plant in payload["above_threshold"]:
-        print("\nGases above threshold detected for plant " + plant)
-        print(payload["above_threshold"][plant])
+      output: the output of a reduction, as returned by perform_data_reduction and in data_reduction_result events.
+      store: the object store large results are fetched from.
+    Return:
+      The output dictionary.
+    """
+
+    # Large results come back as a reference to the object store rather than inline
+    if "result_ref" in output:
+        with open(fetch_verified(store, output["result_ref"]), "r") as result_file:
+            output = json.load(result_file)
+
+    return output
+
+
+def save_output(output, store, prefix="out"):
+    """
+    Save the results of a response, the csv as prefix.csv or each binary table as prefix_<table> with its extension.
+
+    Params:
+      output: the output dictionary from resolve_output.
+      store: the object store binary tables are fetched from.
+      prefix: the path prefix to save to.
+    Return:
+      The dictionary of plant tags to gases above the threshold, and a description of the saved files.
+    """
+
+    # Binary results are tables rather than a csv string, saved as they arrived without parsing any text
+    if "tables" in output:
+        tables = fetch_tables(output, store)
+        write_tables(tables, prefix, output["format"])
+        above_threshold = above_threshold_lists(decode_table(tables["above_threshold"], output["format"]))
+        saved = prefix + "_*" + EXTENSIONS[output["format"]]
+    else:
+        above_threshold = output["above_threshold"]
+
+        with open(prefix + ".csv", "w") as out_file:
+            out_file.write(output["data"])
+        saved = prefix + ".csv"
+
+    return above_threshold, saved
+
+
+def print_output(output, store, progressive=False):
+    """
+    Print the results of a reduction and save its output files.
+
+    Params:
+      output: the output dictionary from resolve_output.
+      store: the object store binary tables are fetched from.
+      progressive: whether each plant's results were already printed by the event callback, so only the aggregate
+        results are printed.
+    """
+
+    above_threshold, saved = save_output(output, store)
+
+    if progressive:
+        print("\nReduced %d plants, %d with abnormal conditions" % (len(above_threshold), len(output["abnormal"])))
+    else:
+        print("Abnormal conditions detected for the following plants:")
+        print(output["abnormal"])
+        for plant in above_threshold:
+            print("\nGases above threshold detected for plant " + plant)
+            print(above_threshold[plant])
+    if progressive and "gas_prevelances" in output:
+        print("\nGases with the percentage of plants for which they were above the concentration threshold:")
+        print(pd.DataFrame(output["gas_prevelances"]))
     print("\nGases with high variance over different plant species")
-    print(payload["high_variance"])
-    print("\nSaved output to out.csv")
-    
-    # raise exception to break out of message loop - we only send and wait for one message
-    raise Exception
+    print(output["high_variance"])
+    print("\nSaved output to " + saved)
+
+
+def make_event_callback(store, request_id=None, progressive=False):
+    """
+    Create the callback that handles the service's events for a request: the partial results of a progressive request,
+    printed as they arrive, and the result of a submitted one.
+
+    Params:
+      store: the object store large results are fetched from.
+      request_id: the request_id sent with the request.
+      progressive: whether each plant's results are printed as they arrive, so only the aggregate results are printed
+        with the result.
+    Return:
+      The event callback function for the INTERSECT client.
+    """
+
+    start = time.perf_counter()
+
+    def event_callback(_source: str, _operation: str, event_name: str, payload: INTERSECT_JSON_VALUE) -> None:
+        """
+        As with the response callback, we throw an exception to break out of the message loop once the result arrives.
+
+        Params:
+          _source: the source of the event. In this case it will always be from the data-reduction service.
+          _operation: the name of the function that emitted the event.
+          event_name: the name of the event, data_reduction_progress for partial results and data_reduction_result for
+            a finished job.
+          payload: the JSON string of a partial result, as described for dac.reduce_progressively(), or of the job's
+            status, as returned by get_data_reduction_result.
+        """
+
+        event = json.loads(payload) if isinstance(payload, str) else payload
+
+        # Every client listening to the service receives its events, so skip those of other clients' requests
+        if event.get("request_id") != request_id:
+            return
+
+        elapsed = time.perf_counter() - start
+
+        if event_name == "data_reduction_result":
+            if event["status"] != "done":
+                print(event.get("error", "Data reduction " + event["status"]))
+            else:
+                print_output(resolve_output(event["result"], store), store, progressive)
+
+            # raise exception to break out of message loop - we only send and wait for one message
+            raise Exception
+        elif event_name != "data_reduction_progress":
+            return
+
+        if event["type"] == "blanks":
+            print("[%6.2f s] Blanks for %s: 21 m/z mean %.1f" % (elapsed, event["licor"], event["21mz_mean"]), flush=True)
+        elif event["type"] == "plant":
+            print("[%6.2f s] Plant %s on %s%s: %s" % (elapsed, event["plant_tag"], event["licor"],
+                                                     " (abnormal conditions)" if event["abnormal"] else "",
+                                                     ", ".join(event["above_threshold"]) or "no gases above threshold"),
+                  flush=True)
+
+    return event_callback
+
+
+def make_client_callback():
+    """
+    Create the callback that handles the service's response to the submission.
+
+    Return:
+      The callback function for the INTERSECT client.
+    """
+
+    def simple_client_callback(
+        _source: str, _operation: str, _has_error: bool, payload: INTERSECT_JSON_VALUE
+    ) -> None:
+        """This simply prints an error from the service to your console. The result itself arrives as an event.
+
+        As we don't want to engage in a back-and-forth, we simply throw an exception to break out of the message loop.
+        BatchSubmitter keeps sending messages over the same connection instead.
+
+        Params:
+          _source: the source of the response message. In this case it will always be from the data-reduction service.
+          _operation: the name of the function we called in the original message.
+          _has_error: Boolean value which represents an error.
+          payload: Value of the response from the Service. This is the JSON string returned by submit_data_reduction,
+            of either the job_id or the error.
+        """
+
+        if _has_error:
+            print(payload)
+            raise Exception
+
+        response = json.loads(payload) if isinstance(payload, str) else payload
+
+        if "error" in response:
+            print(response["error"])
+            raise Exception
+
+    return simple_client_callback
+
+
+def read_batch(path):
+    """
+    Read the list of reductions for a batch.
+
+    Params:
+      path: path to a csv file with "data", "sheet", "metadata", and "cutoff" columns, and optionally a "name" column
+        for the prefix each reduction's results are saved under.
+    Return:
+      A list of dictionaries, one for each row.
+    """
+
+    batch = pd.read_csv(path, dtype=str).to_dict(orient="records")
+
+    for index, request in enumerate(batch):
+        if not isinstance(request.get("name"), str):
+            request["name"] = str(index) + "_" + os.path.splitext(os.path.basename(request["data"]))[0]
+
+    return batch
+
+
+class BatchSubmitter():
+    """
+    Submits many reductions over one client connection, keeping up to a window of them in flight at once.
+
+    Requests are queued with submit_data_reduction, so the service reduces the whole window at once on its workers, and
+    each result arrives as a data_reduction_result event. Each request carries a "request_id" that the service echoes
+    back in the response and the event, so results are matched to their requests in whatever order they arrive and
+    saved as soon as they do. Each result frees a slot in the window for the next request, whose input files are only
+    uploaded then, overlapping the uploads with the service's work. Inputs are
+    uploaded as compressed chunks with object_store.put_chunked(), and files shared by several requests, such as a
+    season's metadata, are uploaded once.
+    """
+
+    def __init__(self, requests, store, format="parquet", window=4, chunk_bytes=DEFAULT_CHUNK_BYTES, output_dir="."):
+        """
+        Default constructor.
+
+        Params:
+          requests: list of request dictionaries from read_batch.
+          store: the object store to upload inputs to and fetch large results from.
+          format: the format to receive the results in.
+          window: the number of requests to keep in flight.
+          chunk_bytes: the size of the uncompressed chunks inputs are uploaded in.
+          output_dir: the directory to save results in.
+        """
+
+        self.requests = requests
+        self.store = store
+        self.format = format
+        self.window = window
+        self.chunk_bytes = chunk_bytes
+        self.output_dir = output_dir
+
+        # Prefix of this batch's request IDs, so responses to an earlier client's requests aren't mistaken for ours
+        self.batch_id = uuid.uuid4().hex[:12]
+        self.references = {}
+        self.next_request = 0
+        self.pending = {}
+        self.failed = []
+        self.completed = 0
+        self.start = time.perf_counter()
+
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _reference(self, path):
+        """
+        Upload an input file once and return the JSON string of its chunk manifest.
+        """
+
+        if path not in self.references:
+            self.references[path] = json.dumps(put_chunked(self.store, path, self.chunk_bytes))
+
+        return self.references[path]
+
+    def _next_messages(self, count):
+        """
+        Upload the inputs of up to count more requests and build their messages.
+
+        Params:
+          count: the number of requests to send.
+        Return:
+          A list of IntersectDirectMessageParams.
+        """
+
+        messages = []
+
+        while count > 0 and self.next_request < len(self.requests):
+            request = self.requests[self.next_request]
+            request_id = self.batch_id + "-" + str(self.next_request)
+
+            params = {
+                "data_ref": self._reference(request["data"]),
+                "metadata_ref": self._reference(request["metadata"]),
+                "sheet": request["sheet"],
+                "cutoff": str(request["cutoff"]),
+                "format": self.format,
+                "request_id": request_id,
+            }
+
+            messages.append(reduction_message(params))
+            self.pending[request_id] = (request, time.perf_counter())
+            self.next_request += 1
+            count -= 1
+
+        return messages
+
+    def initial_messages(self):
+        """
+        Return:
+          The messages for the first window of requests.
+        """
+
+        return self._next_messages(self.window)
+
+    def callback(self, _source: str, _operation: str, _has_error: bool, payload: INTERSECT_JSON_VALUE):
+        """
+        Handle the response to a submission. A queued request keeps its slot in the window until its result event
+        arrives, while a request the service couldn't queue fails and frees its slot for the next request.
+
+        Params:
+          _source: the source of the response message.
+          _operation: the name of the function we called in the original message.
+          _has_error: Boolean value which represents an error. Errors the service raises can't be matched to a request,
+            while errors returned with a request_id can.
+          payload: the JSON string returned by submit_data_reduction, with the request_id and either the job_id or the
+            error.
+        Return:
+          An IntersectClientCallback with the next message, if any are left.
+        """
+
+        response = json.loads(payload) if isinstance(payload, str) else payload
+        request_id = response.get("request_id") if isinstance(response, dict) else None
+
+        if request_id not in self.pending:
+
+            # The result event of a quick request can arrive before the response to its submission
+            if not _has_error and "job_id" in response:
+                return None
+
+            print("Unmatched response: " + str(payload))
+
+            # A reply that isn't an error and isn't ours, such as a stale one from an earlier batch, answers none of 
+            # our requests
+            if not _has_error or not self.pending:
+                return None
+
+            # The request an error raised by the service answered can't be known, so give up on the oldest to keep the 
+            # window moving
+            request_id = next(iter(self.pending))
+            request, sent = self.pending.pop(request_id)
+            self.failed.append(request["name"])
+        elif _has_error or "error" in response:
+            request, sent = self.pending.pop(request_id)
+            self.failed.append(request["name"])
+            print(request["name"] + ": failed: " + str(payload if _has_error else response["error"]), flush=True)
+        else:
+            # Queued, and the result arrives as an event
+            return None
+
+        return self._advance()
+
+    def event_callback(self, _source: str, _operation: str, event_name: str, payload: INTERSECT_JSON_VALUE):
+        """
+        Save the result of a finished request and send the next request in its place.
+
+        Params:
+          _source: the source of the event.
+          _operation: the name of the function that emitted the event.
+          event_name: the name of the event, data_reduction_result for a finished job.
+          payload: the JSON string of the job's status with the request_id, as returned by get_data_reduction_result.
+        Return:
+          An IntersectClientCallback with the next message, if any are left.
+        """
+
+        if event_name != "data_reduction_result":
+            return None
+
+        event = json.loads(payload) if isinstance(payload, str) else payload
+
+        # Every client listening to the service receives its events, so skip the results of other clients' requests 
+        # and of our own requests that already failed
+        if event.get("request_id") not in self.pending:
+            return None
+
+        request, sent = self.pending.pop(event["request_id"])
+
+        if event["status"] != "done":
+            self.failed.append(request["name"])
+
+            # The error is the job's whole traceback, whose last line says what went wrong
+            print(request["name"] + ": failed: " + event.get("error", event["status"]).strip().splitlines()[-1], 
+                  flush=True)
+        else:
+            output = resolve_output(event["result"], self.store)
+            above_threshold, saved = save_output(output, self.store, os.path.join(self.output_dir, request["name"]))
+            self.completed += 1
+            print("%s: %d abnormal, %d plants, %.2f s, saved %s" % (request["name"], len(output["abnormal"]), 
+                                                                     len(above_threshold), 
+                                                                     time.perf_counter() - sent, saved), flush=True)
+
+        return self._advance()
+
+    def _advance(self):
+        """
+        Send the next request in place of an answered one, raising an exception to break out of the message loop once
+        every request has been answered.
+
+        Return:
+          An IntersectClientCallback with the next message, if any are left.
+        """
+
+        messages = self._next_messages(1)
+
+        if not messages and not self.pending:
+            seconds = time.perf_counter() - self.start
+            print("\n%d of %d reductions done in %.1f s (%.2f per second)" % 
+                  (self.completed, len(self.requests), seconds, len(self.requests) / seconds))
+            if self.failed:
+                print("Failed: " + ", ".join(self.failed))
+
+            # raise exception to break out of message loop - every request has been answered
+            raise Exception
+
+        return IntersectClientCallback(messages_to_send=messages) if messages else None
+
+
+def reduction_message(params, operation="submit_data_reduction"):
+    """
+    Params:
+      params: the parameters of a data reduction request.
+      operation: the operation of the service to send them to.
+    Return:
+      The IntersectDirectMessageParams to send them to the data reduction service.
+    """
+
+    return IntersectDirectMessageParams(
+        destination=SERVICE,
+        operation="BESSDDAC." + operation,
+        payload=params,
+    )
 
 
 if __name__ == "__main__":
@@ -77,31 +463,60 @@ if __name__ == "__main__":
 
     # Add argument parsing for the command and the configuration file
     parser = argparse.ArgumentParser()
-    parser.add_argument("data", nargs='*', default="2024_05_09_T6261_Complete.xlsx")
-    parser.add_argument("sheet", nargs='*', default="TS_all_ppbV")
-    parser.add_argument("metadata", nargs='*', default="2024_05_09_Metadata.xlsx")
-    parser.add_argument("cutoff", type=float, nargs='*', default=0.1)
+    parser.add_argument("data", type=str, nargs="?", default=None)
+    parser.add_argument("sheet", type=str, nargs="?", default=None)
+    parser.add_argument("metadata", type=str, nargs="?", default=None)
+    parser.add_argument("cutoff", type=float, nargs="?", default=None)
+    parser.add_argument("--object-store-dir", type=str, default=None, 
+                        help="Directory shared with the service to exchange files through instead of MinIO")
+    parser.add_argument("--format", type=str, default="parquet", choices=FORMATS, 
+                        help="Format to receive the results in, binary tables or the original csv")
+    parser.add_argument("--batch", type=str, default=None, 
+                        help="csv file of data, sheet, metadata, cutoff, and optional name columns to reduce over one "
+                             "connection instead of the single reduction in the arguments")
+    parser.add_argument("--window", type=int, default=4, help="Number of batch reductions to keep in flight at once")
+    parser.add_argument("--output-dir", type=str, default=".", help="Directory to save batch results in")
+    parser.add_argument("--progressive", action="store_true", 
+                        help="Print each LICOR's blanks and each plant's results as soon as the service has them")
+    parser.add_argument("--chunk-mb", type=float, default=DEFAULT_CHUNK_BYTES / 1024 ** 2, 
+                        help="Size in MB of the compressed chunks input files are uploaded in")
     args = parser.parse_args()    
     
-    params["sheet"] = args.sheet
+    if args.batch is None and args.cutoff is None:
+        parser.error("data, sheet, metadata, and cutoff are required without --batch")
+    if args.batch is not None and args.progressive:
+        parser.error("--progressive is only available for a single reduction")
     
-    with open(args.data, 'r') as file:
-        params["data"] = file.read()
+    # Upload the input files to the data store and send only references to them, so the message stays small however 
+    # large the files are
+    store = store_from_config(from_config_file["data_stores"], args.object_store_dir)
+    chunk_bytes = int(args.chunk_mb * 1024 ** 2)
     
-    with open(args.metadata, 'r') as file:
-        params["metadata"] = file.read()    
-
-    initial_messages = [
-        IntersectDirectMessageParams(
-            destination="oak-ridge-national-laboratory.none.bessd-pilot.dac.data-reduction",
-            operation="BESSDDAC.data_reduction",
-            payload=params,
-        )
-    ]
+    if args.batch is not None:
+        batch = BatchSubmitter(read_batch(args.batch), store, args.format, args.window, chunk_bytes, args.output_dir)
+        initial_messages = batch.initial_messages()
+        callback = batch.callback
+        event_callback = batch.event_callback
+    else:
+        params = {
+            "data_ref": json.dumps(put_chunked(store, args.data, chunk_bytes)),
+            "metadata_ref": json.dumps(put_chunked(store, args.metadata, chunk_bytes)),
+            "sheet": args.sheet,
+            "cutoff": str(args.cutoff),
+            "format": args.format,
+        }
+        if args.progressive:
+            params["progressive"] = "true"
+        request_id = params["request_id"] = uuid.uuid4().hex
+        initial_messages = [reduction_message(params)]
+        callback = make_client_callback()
+        event_callback = make_event_callback(store, request_id, args.progressive)
 
     config = IntersectClientConfig(
         initial_message_event_config=IntersectClientCallback(
-            messages_to_send=initial_messages
+            messages_to_send=initial_messages,
+            # Results and partial results arrive as events from the service rather than as responses
+            services_to_start_listening_for_events=[SERVICE],
         ),
         **from_config_file,
     )
@@ -111,7 +526,7 @@ if __name__ == "__main__":
 
     We also need a callback to handle incoming user messages.
     """
-    client = IntersectClient(config=config, user_callback=simple_client_callback)
+    client = IntersectClient(config=config, user_callback=callback, event_callback=event_callback)
 
     """
     step four - start lifecycle loop. The only necessary parameter is your client.
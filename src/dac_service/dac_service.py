@@ -1,32 +1,516 @@
+import time
+
+# Start of the import, to report how long the service took to start
+IMPORT_START = time.perf_counter()
+
+import argparse
 import json
 import os
 
-import matplotlib.pyplot as plt
-import pandas as pd
-
-from io import StringIO
-from typing import Dict, Union
+from functools import partial
+from typing import Dict
 
 from intersect_sdk import (
     default_intersect_lifecycle_loop,
     HierarchyConfig,
     IntersectBaseCapabilityImplementation,
     IntersectDataHandler,
+    IntersectEventDefinition,
     IntersectService,
     IntersectServiceConfig,
+    intersect_event,
     intersect_message,
     intersect_status,
 )
 
-from dac import data_reduction
+# pandas and the modules of the reduction are imported on first use rather than here, so the service starts in well
+# under a second. warm_up() imports them ahead of the first request.
+from frame_cache import FrameCache, hash_source
+from jobs import JobQueue, QueueFullError
+from object_store import DEFAULT_INLINE_LIMIT, fetch_verified, store_from_config
+from profiling import activate, ProfileAggregates, Profiler, span
+from result_cache import ResultCache
+
+# Seconds the imports above took
+IMPORT_SECONDS = time.perf_counter() - IMPORT_START
+
+# Event the partial results of progressive requests are emitted as
+PROGRESS_EVENT = "data_reduction_progress"
+
+# Event the status of each finished job is emitted as
+RESULT_EVENT = "data_reduction_result"
+
+def input_path(input_root, path):
+    """
+    Resolve the path of an input file named in a request. Requests come from any client, so only files inside the
+    service's input directory are read, and paths that resolve outside it are rejected.
+
+    Args:
+        input_root: Path to the directory requests may name files in, or None to refuse paths altogether.
+        path: Path from the request, relative to input_root.
+    Return:
+        String real path to the file.
+    """
+
+    if input_root is None:
+        raise ValueError("This service doesn't read files by path, send data_ref and metadata_ref instead")
+
+    root = os.path.realpath(input_root)
+    resolved = os.path.realpath(os.path.join(root, str(path)))
+
+    if os.path.commonpath([root, resolved]) != root:
+        raise ValueError("Input " + str(path) + " is outside " + str(input_root))
+
+    return resolved
+
+def request_key(params, results, input_root=None):
+    """
+    Get the result cache key for a request's inputs.
+
+    Args:
+        params: Dictionary of request parameters as for load_request.
+        results: ResultCache to get the key for.
+        input_root: Path to the directory requests may name files in, as for load_request.
+    Return:
+        String cache key.
+    """
+
+    if "data_ref" in params:
+        data_hash = json.loads(params["data_ref"])["sha256"]
+        metadata_hash = json.loads(params["metadata_ref"])["sha256"]
+    else:
+        data_hash = hash_source(input_path(input_root, params["data"]))
+        metadata_hash = hash_source(input_path(input_root, params["metadata"]))
+
+    return results.key(data_hash, params["sheet"], metadata_hash)
+
+def load_request(params, store=None, cache=None, input_root=None):
+    """
+    Fetch and parse the input files for a request.
+
+    Args:
+        params: Dictionary of "sheet" to the data sheet name, along with either "data_ref" and "metadata_ref" to JSON 
+            object store references for the files, or "data" and "metadata" to paths to the files in input_root.
+        store: Object store the references are in.
+        cache: Optional FrameCache that parsed files are kept in by content hash.
+        input_root: Path to the directory requests may name files in, or None to accept only references.
+    Return:
+        The data and metadata Dataframes.
+    """
+
+    from ingest import load_data, load_metadata
+
+    with span("service.fetch"):
+        if "data_ref" in params:
+            data_ref = json.loads(params["data_ref"])
+            metadata_ref = json.loads(params["metadata_ref"])
+            data_file = fetch_verified(store, data_ref)
+            metadata_file = fetch_verified(store, metadata_ref)
+        else:
+            data_ref = metadata_ref = {"sha256": None}
+            data_file = input_path(input_root, params["data"])
+            metadata_file = input_path(input_root, params["metadata"])
+
+    # Only the needed columns and rows are loaded, see ingest.py
+    df = load_data(data_file, params["sheet"], cache=cache, content_hash=data_ref["sha256"])
+    metadata = load_metadata(metadata_file, cache=cache, content_hash=metadata_ref["sha256"])
+
+    return df, metadata
+
+def perform_request(request, store=None, cache=None, profile=False, input_root=None):
+    """
+    Parse the input files for a request, run the data reduction on them, and format the output for the request's
+    cutoff, as a job on the worker pool. Large results are stored by the worker too, so only caching the results is
+    left to the service.
+
+    Args:
+        request: Tuple of the request's result cache key and its dictionary of parameters as for load_request, with
+            "cutoff" and optionally "format".
+        store: Object store the references are in and large results are returned through.
+        cache: Optional FrameCache that parsed files are kept in by content hash.
+        profile: Whether to profile the stages of the reduction.
+        input_root: Path to the directory requests may name files in, as for load_request.
+    Return:
+        The reduction dictionary from dac.reduce_campaign(), the output JSON string from format_output(), and the list
+        of profiling spans or None without profile.
+    """
+
+    from dac import reduce_campaign
+
+    _, params = request
+    profiler = Profiler() if profile else None
+
+    with activate(profiler):
+        reduction = reduce_campaign(*load_request(params, store, cache, input_root))
+        output = format_output(reduction, float(params["cutoff"]), request_format(params), store)
+
+    return reduction, output, profiler.spans if profiler is not None else None
+
+def serialize_output(output, store=None, inline_limit=DEFAULT_INLINE_LIMIT):
+    """
+    Convert a data reduction output into the service's JSON response.
+
+    Args:
+        output: Output dictionary from dac.data_reduction() or dac.finish_reduction().
+        store: Object store that large results are returned through.
+        inline_limit: Size in bytes above which results are returned by reference when there is a store.
+    Return:
+        JSON string of the data reduction output, or of a dictionary with "result_ref" to a reference to it.
+    """
+
+    with span("service.serialize"):
+
+        # The prevalences Dataframe isn't JSON serializable, so send it as a list of {"Gas", "Prevalence"} rows
+        output["gas_prevelances"] = output["gas_prevelances"].to_dict(orient="records")
+
+        result = json.dumps(output)
+
+    # Keep broker messages small by sending large results through the object store
+    if store is not None and len(result) > inline_limit:
+        with span("service.store_result", bytes=len(result)):
+            return json.dumps({"result_ref": store.put_bytes(result.encode("utf-8"))})
+
+    return result
+
+def request_format(params):
+    """
+    Get the output format a request asked for.
+
+    Args:
+        params: Dictionary of request parameters, with an optional "format" of "csv" (the default), "arrow", or
+            "parquet".
+    Return:
+        String output format.
+    """
+
+    from result_format import FORMATS
+
+    format = params.get("format", "csv")
+
+    if format not in FORMATS:
+        raise ValueError("Unknown output format " + str(format) + ", expected one of " + ", ".join(FORMATS))
+
+    return format
+
+def request_progressive(params):
+    """
+    Args:
+        params: Dictionary of request parameters, with an optional "progressive" of "true" or "false" (the default).
+    Return:
+        Whether the request asked for its partial results as they are ready.
+    """
+
+    return str(params.get("progressive", "false")).lower() == "true"
+
+def format_output(reduction, cutoff, format="csv", store=None, inline_limit=DEFAULT_INLINE_LIMIT):
+    """
+    Apply a cutoff to a reduction and convert it into the service's JSON response in the requested format.
+
+    Args:
+        reduction: Reduction dictionary from dac.reduce_campaign().
+        cutoff: Float high variance cutoff.
+        format: "csv" for the output of dac.data_reduction(), or "arrow" or "parquet" for the tables of
+            result_format.result_tables().
+        store: Object store that large results are returned through.
+        inline_limit: Size in bytes above which results are returned by reference when there is a store.
+    Return:
+        JSON string of the response.
+    """
+
+    from dac import finish_reduction
+    from result_format import binary_output
+
+    if format == "csv":
+        return serialize_output(finish_reduction(reduction, cutoff), store, inline_limit)
+
+    # The tables are sent as binary files, so only the small lists are formatted as JSON
+    output = binary_output(reduction, cutoff, format, store, inline_limit)
+
+    with span("service.serialize"):
+        return json.dumps(output)
+
+def warm_up(formats=("csv", "parquet")):
+    """
+    Import the modules and reader engines of the reduction and run a tiny synthetic reduction through every step of a
+    request, so the first real request doesn't pay for imports and first call initialization.
+
+    Args:
+        formats: Output formats to produce from the synthetic reduction. Binary formats are skipped without pyarrow.
+    Return:
+        Dictionary of the seconds the "imports" and the "reduction" took.
+    """
+
+    start = time.perf_counter()
+
+    from io import BytesIO
+
+    import pandas as pd
+
+    from dac import reduce_campaign
+    from ingest import default_engine, load_data, load_metadata
+    from synthetic import generate_campaign
+
+    engine = default_engine("warm_up.xlsx")
+
+    try:
+        import pyarrow
+        from pyarrow import parquet
+    except ImportError:
+        formats = [format for format in formats if format == "csv"]
+
+    imported = time.perf_counter()
+
+    # Write the workbooks in memory and read them back with the engine requests use
+    data, metadata = generate_campaign(rows=100, gases=4, licors=2, plants=4)
+    data_file = BytesIO()
+    metadata_file = BytesIO()
+    data.to_excel(data_file, sheet_name="TS_all_ppbV", index=False)
+    metadata.to_excel(metadata_file, index=False)
+
+    reduction = reduce_campaign(load_data(data_file, "TS_all_ppbV", engine=engine),
+                                load_metadata(metadata_file, engine=engine))
+
+    for format in formats:
+        format_output(reduction, 0.1, format)
+
+    return {"imports": imported - start, "reduction": time.perf_counter() - imported}
+
+def correlate(request_id, output=None, error=None):
+    """
+    Wrap a response with the ID of the request it answers, so a client with many requests in flight can match them up.
+
+    Args:
+        request_id: String ID the client sent with the request.
+        output: JSON string of the response, which is embedded as it is rather than parsed and formatted again.
+        error: String error message if the request failed, instead of output.
+    Return:
+        JSON string of a dictionary of the "request_id" and either the "result" or the "error".
+    """
+
+    if error is not None:
+        return json.dumps({"request_id": request_id, "error": error})
+
+    return '{"request_id": ' + json.dumps(request_id) + ', "result": ' + output + '}'
+
+def job_response(job, request_id=None):
+    """
+    Convert a job's status into the service's JSON response.
+
+    Args:
+        job: Status dictionary from JobQueue.result().
+        request_id: Optional string ID the client sent with the request, to include in the response.
+    Return:
+        JSON string of the status, with a finished job's output embedded in "result" as it is rather than parsed and
+        formatted again.
+    """
+
+    response = {key: value for key, value in job.items() if key != "result"}
+
+    if request_id is not None:
+        response["request_id"] = request_id
+
+    if "result" not in job:
+        return json.dumps(response)
+
+    return json.dumps(response)[:-1] + ', "result": ' + job["result"] + '}'
 
 class DACCapability(IntersectBaseCapabilityImplementation):
     """
     Capability to run DAC data processing.
+
+    Reductions run as jobs on a pool of workers, so a large request doesn't block the service for other clients. Clients
+    submit them with submit_data_reduction and receive each result as a data_reduction_result event, so the thread
+    handling messages never waits for a reduction. Results are kept in a ResultCache, so repeated requests are answered
+    without a job and requests that only change the cutoff skip everything but the high variance step.
     """
 
     intersect_sdk_capability_name = "BESSDDAC"
 
+    def __init__(self, workers=2, worker_type="thread", max_queue=16, store=None, cache=None, results=None,
+                 profile=False, warm=False, input_root=None):
+        """
+        Default constructor.
+
+        Args:
+            workers: Number of reductions to run at once.
+            worker_type: "thread" or "process" workers.
+            max_queue: Maximum number of reductions waiting for a worker before new requests are rejected.
+            store: Object store that input references are fetched from and large results are returned through.
+            cache: Optional FrameCache for parsed input files.
+            results: ResultCache for reductions and outputs, defaulting to an in memory one.
+            profile: Whether to profile the stages of every reduction, reporting rolling totals in the status.
+            warm: Whether every process worker runs warm_up() as it starts, for warm_up() to prepare the workers.
+            input_root: Directory requests may name input files in by path, or None to accept only object store
+                references.
+        """
+
+        super().__init__()
+        self.startup = {"import_seconds": IMPORT_SECONDS, "warm_up_seconds": None, "ready_seconds": None,
+                        "first_result_seconds": None}
+        self.store = store
+        self.cache = cache
+        self.input_root = input_root
+        self.results = results if results is not None else ResultCache()
+        self.profiles = ProfileAggregates() if profile else None
+        self.jobs = JobQueue(partial(perform_request, store=store, cache=cache, profile=profile, input_root=input_root),
+                             workers, worker_type, max_queue, on_result=self._finish_request,
+                             on_finish=self.emit_job_result, initializer=warm_up if warm else None)
+
+    def warm_up(self):
+        """
+        Run warm_up() in the service and start every worker, each running warm_up() as it starts, before requests
+        arrive. The capability must have been created with warm.
+
+        Return:
+            Float seconds the warm up took.
+        """
+
+        start = time.perf_counter()
+        self.jobs.warm()
+        self.startup["warm_up_seconds"] = time.perf_counter() - start
+
+        return self.startup["warm_up_seconds"]
+
+    def ready(self):
+        """
+        Record that the service is ready for requests.
+
+        Return:
+            Float seconds from the start of the import to now.
+        """
+
+        self.startup["ready_seconds"] = time.perf_counter() - IMPORT_START
+
+        return self.startup["ready_seconds"]
+
+    def _first_result(self):
+        """
+        Record the time to the first result, if this is it.
+        """
+
+        if self.startup["first_result_seconds"] is None:
+            self.startup["first_result_seconds"] = time.perf_counter() - IMPORT_START
+
+    def _cached_output(self, params):
+        """
+        Answer a request from the result cache if possible.
+
+        Args:
+            params: Dictionary of request parameters.
+        Return:
+            The request's result cache key, and the output JSON string or None if the inputs haven't been reduced
+            before.
+        """
+
+        key = request_key(params, self.results, self.input_root)
+        cutoff = float(params["cutoff"])
+        format = request_format(params)
+        output = self.results.get_output(key, cutoff, format)
+
+        if output is None:
+            reduction = self.results.get_reduction(key)
+
+            if reduction is not None:
+                output = format_output(reduction, cutoff, format, self.store)
+                self.results.put_output(key, cutoff, output, format)
+
+        if output is not None:
+            self._first_result()
+
+        return key, output
+
+    def _finish_request(self, request, result):
+        """
+        Cache the reduction and output of a finished job. This runs on the worker pool's callback thread, which for
+        process workers also hands jobs to the workers, so everything else is done by perform_request in the worker.
+
+        Args:
+            request: Tuple of the request's result cache key and dictionary of parameters, as submitted.
+            result: Reduction dictionary, output JSON string, and profiling spans from perform_request.
+        Return:
+            The output JSON string.
+        """
+
+        key, params = request
+        reduction, output, spans = result
+
+        self.results.put_reduction(key, reduction)
+        self.results.put_output(key, float(params["cutoff"]), output, request_format(params))
+
+        if self.profiles is not None:
+            self.profiles.add(spans)
+
+        self._first_result()
+
+        return output
+
+    @intersect_event(events={RESULT_EVENT: IntersectEventDefinition(event_type=str)})
+    def emit_job_result(self, request, job):
+        """
+        Emit a finished job's status as a data_reduction_result event, so the client that submitted it gets its result
+        without asking for it.
+
+        Args:
+            request: Tuple of the request's result cache key and dictionary of parameters, as submitted.
+            job: Status dictionary of the job from JobQueue.result().
+        """
+
+        _, params = request
+        self.intersect_sdk_emit_event(RESULT_EVENT, job_response(job, params.get("request_id")))
+
+    @intersect_event(events={PROGRESS_EVENT: IntersectEventDefinition(event_type=str)})
+    def emit_progress(self, request, event):
+        """
+        Emit a partial result of a progressive request as a data_reduction_progress event.
+
+        Args:
+            request: Tuple of the request's result cache key and dictionary of parameters, as submitted.
+            event: Dictionary of the partial result from dac.reduce_progressively().
+        """
+
+        _, params = request
+        self.intersect_sdk_emit_event(PROGRESS_EVENT, json.dumps({"request_id": params.get("request_id"), **event}))
+
+    def _reduce_progressively(self, request):
+        """
+        Reduce a progressive request, emitting each partial result as it is ready, as a job on a thread of the job
+        queue. It runs in this process rather than on a worker so that it can emit the events.
+
+        Args:
+            request: Tuple of the request's result cache key and dictionary of parameters.
+        Return:
+            The reduction dictionary, output JSON string, and profiling spans, as from perform_request.
+        """
+
+        from dac import reduce_progressively
+
+        _, params = request
+        profiler = Profiler() if self.profiles is not None else None
+
+        with activate(profiler):
+            for event in reduce_progressively(*load_request(params, self.store, self.cache, self.input_root)):
+                if event["type"] == "reduction":
+                    output = format_output(event["reduction"], float(params["cutoff"]), request_format(params),
+                                           self.store)
+
+                    return event["reduction"], output, profiler.spans if profiler is not None else None
+
+                self._first_result()
+                self.emit_progress(request, event)
+
+    def _submit(self, key, params):
+        """
+        Queue a request's reduction, on a thread of the job queue for progressive requests and on the workers otherwise.
+
+        Args:
+            key: String result cache key of the request.
+            params: Dictionary of request parameters.
+        Return:
+            String ID of the job.
+        """
+
+        return self.jobs.submit((key, params), self._reduce_progressively if request_progressive(params) else None)
+
     @intersect_message()
     def perform_data_reduction(self, params: Dict[str, str]) -> str:
         """
@@ -34,36 +518,153 @@ class DACCapability(IntersectBaseCapabilityImplementation):
         experienced unusual circumstances, each gas for each plant tag that was above the defined threshold, and each
         gas that varied over phenotypes.
 
+        This is kept for existing clients. The reduction runs on the worker pool, but this waits for it in the thread
+        handling messages, so every other request waits behind it. Clients should use submit_data_reduction instead,
+        which returns immediately and delivers the same output as an event.
+
+        With "progressive" set to "true", each part of the results is also emitted as a data_reduction_progress event
+        as soon as it is known, each LICOR's blank statistics and then each plant as described for 
+        dac.reduce_progressively(), before the full output. The events are JSON strings of those dictionaries with the
+        request's "request_id" added. Progressive reductions run on threads of the job queue rather than on the
+        workers, since the events are emitted from this process, but are queued and limited like any other reduction.
+        Requests answered from the result cache emit no progress events.
+
+        Args:
+            params: Dictionary of "data_ref" and "metadata_ref" to JSON object store references for the data and
+                metadata files, which may be chunk manifests from object_store.put_chunked(), "sheet" to the data sheet
+                name, "cutoff" to the high variance cutoff, and optionally "format" to "csv" (the default), "arrow", or
+                "parquet", "request_id" to a correlation ID, and "progressive" to "true" for partial results. With an
+                input directory, "data" and "metadata" may instead be paths to the files relative to it.
+        Return:
+            For csv, JSON string of a dictionary of "data" to output file contents, "abnormal" to a list of tags with 
+            abnormal readings, "above_threshold" for a dictionary of plant tags to gases above the threshold, and 
+            "high_variance" for a list of gases that had high variance over plant tags. Large results are instead a 
+            dictionary of "result_ref" to an object store reference for that JSON. For arrow and parquet, JSON string
+            of the dictionary from result_format.binary_output(), with the plant matrix, above threshold mask, 
+            prevalences, and blank statistics as binary tables. With a "request_id", the response is instead wrapped 
+            by correlate(), and errors are returned in it rather than raised.
+        """
+
+        if "request_id" not in params:
+            return self._perform(params)
+
+        try:
+            return correlate(params["request_id"], self._perform(params))
+        except Exception as error:
+            return correlate(params["request_id"], error=str(error))
+
+    def _perform(self, params):
+        """
+        Answer a request from the cache or wait for its reduction, as described for perform_data_reduction.
+        """
+
+        key, output = self._cached_output(params)
+
+        if output is not None:
+            return output
+
+        job = self.jobs.wait(self._submit(key, params))
+
+        if job["status"] != "done":
+            raise RuntimeError(job.get("error", "Data reduction " + job["status"]))
+
+        return job["result"]
+
+    @intersect_message()
+    def submit_data_reduction(self, params: Dict[str, str]) -> str:
+        """
+        Queue a data reduction and return without waiting for it. When it finishes, its status as returned by
+        get_data_reduction_result is emitted as a data_reduction_result event with the request's "request_id", so
+        clients don't need to poll for it. Requests answered from the result cache emit it immediately.
+
         Args:
-            params: Dictionary of "data" to data file contents and metadata to metadata file contents.
+            params: Dictionary of parameters as for perform_data_reduction. Progressive requests emit their partial
+                results as events before the result.
         Return:
-            JSON string of a dictionary of "data" to output file contents, "abnormal" to a list of tags with abnormal 
-            readings, "above_threshold" for a dictionary of plant tags to gases above the threshold, and "high_variance" 
-            for a list of gases that had high variance over plant tags.
+            JSON string of a dictionary with the "job_id" to request the result with, or an "error" if the queue is
+            full, and the request's "request_id" if it has one. With a "request_id", other errors are returned in the
+            "error" too rather than raised.
+        """
+
+        response = {"request_id": params["request_id"]} if "request_id" in params else {}
+
+        try:
+            key, output = self._cached_output(params)
+
+            if output is not None:
+                response["job_id"] = self.jobs.complete(output, (key, params))
+            else:
+                response["job_id"] = self._submit(key, params)
+        except Exception as error:
+
+            # Like perform_data_reduction, errors are returned to requests with a request_id rather than raised
+            if "request_id" not in params and not isinstance(error, QueueFullError):
+                raise
+
+            response["error"] = str(error)
+
+        return json.dumps(response)
+
+    @intersect_message()
+    def get_data_reduction_result(self, job_id: str) -> str:
         """
+        Get the status of a queued data reduction, and its output once it has finished.
 
-        # Read in the data file and specify the sheet name the data is under
-        df = pd.read_excel(params["data"], sheet_name=params["sheet"])
-        
-        # Read the metadata file
-        metadata = pd.read_excel(params["metadata"])
+        Args:
+            job_id: ID returned by submit_data_reduction.
+        Return:
+            JSON string of a dictionary with the "job_id" and "status", one of "queued", "running", "done", "failed", or
+            "unknown". When done, "result" holds the output as returned by perform_data_reduction, and when failed,
+            "error" holds the error.
+        """
 
-        return json.dumps(data_reduction(data, metadata, params["cutoff"]))
+        return job_response(self.jobs.result(job_id))
 
     @intersect_status()
     def status(self) -> str:
         """
-        Return the status Up at all times, as service is never unavailable when running.
+        Report the service's load.
 
         Return:
-            String 'Up' for the INTERSECT up status.
+            JSON string of a dictionary with "state" Up, the number of "queued" and "running" reductions, counts of
+            "completed", "failed", and "rejected" reductions, recent "latency_seconds", the "result_cache" size
+            and hit counts, and the "startup" seconds to import, warm up, become ready, and return the first result,
+            each counted from the start of the import. With profiling on, "profile" holds the mean and 95th percentile
+            seconds of each stage over recent reductions.
         """
 
-        return "Up"
+        status = {"state": "Up", **self.jobs.status(), "result_cache": self.results.status(), "startup": self.startup}
+
+        if self.profiles is not None:
+            status["profile"] = self.profiles.status()
+
+        return json.dumps(status)
 
 
 if __name__ == "__main__":
 
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", type=int, default=2, help="Number of reductions to run at once")
+    parser.add_argument("--worker-type", type=str, default="thread", choices=["thread", "process"])
+    parser.add_argument("--max-queue", type=int, default=16, 
+                        help="Maximum number of reductions waiting for a worker before new requests are rejected")
+    parser.add_argument("--object-store-dir", type=str, default=None, 
+                        help="Directory shared with clients to exchange files through instead of MinIO")
+    parser.add_argument("--parse-cache-dir", type=str, default=None, 
+                        help="Directory to cache parsed input files in by content hash")
+    parser.add_argument("--result-cache-mb", type=float, default=256, 
+                        help="Memory in MB for each level of the result cache")
+    parser.add_argument("--result-cache-dir", type=str, default=None, 
+                        help="Directory to persist cached reductions and outputs in")
+    parser.add_argument("--profile", action="store_true", 
+                        help="Profile the stages of every reduction and report rolling totals in the status")
+    parser.add_argument("--input-dir", type=str, default=None, 
+                        help="Directory requests may name data and metadata files in by path, which are refused "
+                             "without it")
+    parser.add_argument("--warm-up", action="store_true", 
+                        help="Import the reduction and run a tiny synthetic one on every worker before starting")
+    args = parser.parse_args()
+
     from_config_file = {
         "data_stores": {
             "minio": [
@@ -98,11 +699,24 @@ if __name__ == "__main__":
         **from_config_file,
     )
 
-    capability = DACCapability()
+    store = store_from_config(from_config_file["data_stores"], args.object_store_dir)
+    cache = FrameCache(args.parse_cache_dir) if args.parse_cache_dir is not None else None
+
+    results = ResultCache(int(args.result_cache_mb * 1024 ** 2), args.result_cache_dir)
+
+    capability = DACCapability(args.workers, args.worker_type, args.max_queue, store, cache, results, args.profile,
+                               args.warm_up, args.input_dir)
     capability.capability_name = "data_reduction"
+
+    # Warm up before the service is created, so it only advertises itself once requests will be fast
+    if args.warm_up:
+        capability.warm_up()
+
     service = IntersectService([capability], config)
 
+    capability.ready()
     print("DAC service started.")
+    print(json.dumps(capability.startup))
     default_intersect_lifecycle_loop(
         service,
     )
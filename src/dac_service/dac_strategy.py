@@ -1,7 +1,14 @@
 import dac
+import json
+import pandas as pd
 
 from active.strategy.decorators import ActiveStrategy
 
+from incremental import IncrementalReduction
+from profiling import activate, Profiler, span
+from result_format import encode_tables, EXTENSIONS
+from streaming import read_chunks
+
 @ActiveStrategy("DAC Strategy")
 class DACStrategy():
     '''
@@ -12,7 +19,8 @@ class DACStrategy():
     Note: requires ACTIVE (open source release forthcoming) installation to run.
     '''
     
-    def __init__(self, cutoff_value, data_file, data_store, metadata_file, sheet_name):
+    def __init__(self, cutoff_value, data_file, data_store, metadata_file, sheet_name, profile_file=None, 
+                 output_format="parquet"):
         '''
         Default constructor.
         
@@ -32,9 +40,13 @@ class DACStrategy():
             cutoff_value: Float that defines the cutoff for standard deviations over mean over all measurements for
                 all plants above which a gas will be considered as "high variance".
             data_file: String path to the file containing measurement data
-            data_store: DataStore to save the csv average gas per plant data.
+            data_store: DataStore to save the average gas per plant data.
             metadata_file: String path to the file containing measurement metadata
             sheet_name: String name for the sheet inside of data_file containing the data
+            profile_file: Optional string name to save a Chrome trace of the stages of each step to in data_store
+            output_format: String "parquet" or "arrow" to save the plant matrix, above threshold mask, prevalences, and
+                blank statistics as binary tables, out_<table>.<format>, or "csv" to save only the plant matrix as 
+                out.csv
         '''
         
         self.cutoff_value = cutoff_value
@@ -42,19 +54,52 @@ class DACStrategy():
         self.data_store = data_store
         self.metadata_file = metadata_file
         self.sheet_name = sheet_name
+        self.profile_file = profile_file
+        self.output_format = output_format
+        
+        # Reduction state kept between steps so that each step only processes newly arrived data
+        self.reduction = IncrementalReduction()
         
     def step(self, final_episode=False):
         '''
-        Perform the entire analysis. 
+        Perform the analysis, adding only the data rows and measurements that arrived since the last step.
         '''
         
-        data, metadata = dac.load_files(self.data_file, self.sheet_name, self.metadata_file)
-        pd.set_option('display.max_colwidth', None)
-        pd.set_option('display.max_columns', None)
-    
-        output = dac.data_reduction(data, metadata, self.cutoff)
+        profiler = Profiler() if self.profile_file is not None else None
+        
+        with activate(profiler):
+            with span("strategy.read_metadata"):
+                metadata = pd.read_excel(self.metadata_file)
+            
+            # Start over if measurements were edited or removed rather than only appended
+            if not self.reduction.accepts(metadata):
+                self.reduction = IncrementalReduction()
+            
+            self.reduction.update_metadata(metadata)
+            
+            with span("strategy.update_data") as stage:
+                rows_read = self.reduction.rows_read
+                
+                for chunk in read_chunks(self.data_file, self.sheet_name, start_row=self.reduction.rows_read):
+                    self.reduction.update_data(chunk)
+                
+                stage.count(rows=self.reduction.rows_read - rows_read)
+            
+            pd.set_option('display.max_colwidth', None)
+            pd.set_option('display.max_columns', None)
+        
+            with span("strategy.reduce"):
+                reduction = self.reduction.summarize()
+                output = dac.finish_reduction(reduction, self.cutoff_value, csv=self.output_format == "csv")
+            
+            if self.output_format == "csv":
+                self.data_store.save("", "out.csv", output["data"])
+            else:
+                for name, content in encode_tables(reduction, self.cutoff_value, self.output_format).items():
+                    self.data_store.save("", "out_" + name + EXTENSIONS[self.output_format], content)
         
-        self.data_store.save("", "out.csv", output["data"])
+        if profiler is not None:
+            self.data_store.save("", self.profile_file, json.dumps(profiler.to_chrome_trace()))
             
         print("Abnormal conditions detected for the following plants:")
         print(output["abnormal"])
@@ -64,4 +109,3 @@ class DACStrategy():
         print("\nGases with high variance over different plant species")
         print(output["high_variance"])       
         
-        
\ No newline at end of file
@@ -0,0 +1,266 @@
+import hashlib
+import os
+
+from io import BytesIO
+
+# Size of the blocks the input files are hashed in
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Default limit on the total size of the cache directory, 2 GB
+DEFAULT_MAX_BYTES = 2 * 1024 ** 3
+
+def hash_source(source):
+    '''
+    Compute the content hash of an input file.
+
+    Args:
+        source String path to a file, bytes of a file's contents, or a binary file-like object
+    Return:
+        String of the hex sha256 digest of the file's contents
+    '''
+
+    digest = hashlib.sha256()
+
+    if isinstance(source, (bytes, bytearray, memoryview)):
+        digest.update(source)
+    elif hasattr(source, "read"):
+
+        # Hash a file-like object without moving its position for the reader that comes after
+        position = source.tell()
+        for block in iter(lambda: source.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+        source.seek(position)
+    else:
+        with open(source, "rb") as source_file:
+            for block in iter(lambda: source_file.read(HASH_BLOCK_SIZE), b""):
+                digest.update(block)
+
+    return digest.hexdigest()
+
+def evict_files(directory, extensions, max_bytes):
+    '''
+    Delete the least recently modified files in a cache directory until they total at most max_bytes.
+
+    Args:
+        directory String path to the cache directory
+        extensions Tuple of the string file extensions of cache entries, other files are left alone
+        max_bytes Integer maximum total size of the entries in bytes
+    '''
+
+    entries = []
+
+    for entry in os.scandir(directory):
+        if entry.is_file() and entry.name.endswith(extensions):
+            stat = entry.stat()
+            entries.append((stat.st_mtime, stat.st_size, entry.path))
+
+    total = sum(size for _, size, _ in entries)
+
+    for _, size, path in sorted(entries):
+        if total <= max_bytes:
+            break
+
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+
+        total -= size
+
+class FrameCache():
+    '''
+    On disk cache of parsed Excel sheets, keyed by the content hash of the workbook and the sheet name.
+
+    Sheets are stored as uncompressed Arrow IPC files so that later loads memory map them instead of parsing the
+    workbook's XML again. Requires pyarrow. Without it, or for sheets Arrow can't represent (non-string column names or
+    mixed type columns), reads fall through to pandas.read_excel uncached.
+
+    When the directory grows beyond max_bytes the least recently used entries are removed.
+    '''
+
+    def __init__(self, directory, max_bytes=DEFAULT_MAX_BYTES):
+        '''
+        Default constructor.
+
+        Args:
+            directory String path to the directory to store cached sheets in. Created if it doesn't exist.
+            max_bytes Integer maximum total size of the cached files in bytes
+        '''
+
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+
+    def key(self, source, sheet_name, content_hash=None):
+        '''
+        Get the cache key for a sheet of a workbook.
+
+        Args:
+            source String path, bytes, or binary file-like object for the workbook
+            sheet_name String or integer sheet the frame was read from
+            content_hash Optional string sha256 of the workbook, if already known, to avoid hashing it again
+        Return:
+            String cache key
+        '''
+
+        sheet_digest = hashlib.sha256(str(sheet_name).encode("utf-8")).hexdigest()[:16]
+        return (content_hash or hash_source(source)) + "-" + sheet_digest
+
+    def path(self, key):
+        '''
+        Get the path a cache entry is stored at.
+
+        Args:
+            key String cache key
+        Return:
+            String path to the entry's Arrow file
+        '''
+
+        return os.path.join(self.directory, key + ".arrow")
+
+    def get(self, key):
+        '''
+        Load a cached frame.
+
+        Args:
+            key String cache key
+        Return:
+            The cached Dataframe, or None if the key isn't cached
+        '''
+
+        path = self.path(key)
+
+        if not os.path.exists(path):
+            return None
+
+        try:
+            from pyarrow import feather
+        except ImportError:
+            return None
+
+        frame = feather.read_table(path, memory_map=True).to_pandas()
+
+        # Mark the entry as recently used for eviction
+        os.utime(path)
+
+        return frame
+
+    def put(self, key, frame):
+        '''
+        Store a frame in the cache, then evict old entries if the cache is over its size limit.
+
+        Args:
+            key String cache key
+            frame Dataframe to store
+        Return:
+            True if the frame was stored, False if it couldn't be represented in Arrow or pyarrow isn't installed.
+        '''
+
+        try:
+            import pyarrow as pa
+            from pyarrow import feather
+        except ImportError:
+            return False
+
+        import pandas as pd
+
+        # Only default indices and string column names round trip through the Arrow file unchanged
+        if not isinstance(frame.index, pd.RangeIndex) or frame.index.start != 0 or frame.index.step != 1 or \
+            not all(isinstance(column, str) for column in frame.columns) or not frame.columns.is_unique:
+            return False
+
+        try:
+            table = pa.Table.from_pandas(frame, preserve_index=False)
+        except (pa.ArrowException, TypeError, ValueError):
+            return False
+
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        path = self.path(key)
+        temp_path = path + "." + str(os.getpid()) + ".tmp"
+        feather.write_feather(table, temp_path, compression="uncompressed")
+        os.replace(temp_path, path)
+
+        self.evict()
+
+        return True
+
+    def evict(self):
+        '''
+        Delete the least recently used entries until the cache is within its size limit.
+        '''
+
+        evict_files(self.directory, (".arrow",), self.max_bytes)
+
+    def read_excel(self, source, sheet_name=0, content_hash=None, engine=None):
+        '''
+        Read a sheet from a workbook through the cache.
+
+        Args:
+            source String path, bytes, or binary file-like object for the workbook
+            sheet_name String or integer sheet to read, defaulting to the first
+            content_hash Optional string sha256 of the workbook, if already known
+            engine Optional string pandas Excel engine to parse the workbook with on a miss
+        Return:
+            Dataframe with the contents of the sheet
+        '''
+
+        import pandas as pd
+
+        key = self.key(source, sheet_name, content_hash)
+        frame = self.get(key)
+
+        if frame is None:
+            if isinstance(source, (bytes, bytearray, memoryview)):
+                source = BytesIO(source)
+
+            frame = pd.read_excel(source, sheet_name=sheet_name, engine=engine)
+            self.put(key, frame)
+
+        return frame
+
+    def read_excel_sheets(self, source, sheet_names=None, content_hash=None, engine=None):
+        '''
+        Read several sheets from a workbook through the cache, opening and decompressing the workbook at most once for
+        all of the sheets that miss.
+
+        Args:
+            source String path, bytes, or binary file-like object for the workbook
+            sheet_names List of string or integer sheets to read, or None for every sheet
+            content_hash Optional string sha256 of the workbook, if already known
+            engine Optional string pandas Excel engine to parse the workbook with on a miss
+        Return:
+            A dictionary from sheet names to Dataframes with the contents of each sheet, in the order of sheet_names
+        '''
+
+        import pandas as pd
+
+        content_hash = content_hash or hash_source(source)
+        if isinstance(source, (bytes, bytearray, memoryview)):
+            source = BytesIO(source)
+
+        workbook = None
+        frames = {}
+
+        try:
+            # The sheet names are only known from the workbook itself
+            if sheet_names is None:
+                workbook = pd.ExcelFile(source, engine=engine)
+                sheet_names = workbook.sheet_names
+
+            for sheet_name in sheet_names:
+                key = self.key(source, sheet_name, content_hash)
+                frame = self.get(key)
+
+                if frame is None:
+                    if workbook is None:
+                        workbook = pd.ExcelFile(source, engine=engine)
+
+                    frame = workbook.parse(sheet_name)
+                    self.put(key, frame)
+
+                frames[sheet_name] = frame
+        finally:
+            if workbook is not None:
+                workbook.close()
+
+        return frames
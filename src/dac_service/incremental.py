@@ -0,0 +1,364 @@
+import numpy as np
+import pandas as pd
+
+from dac import blank_threshold, finish_reduction, is_abnormal, measurement_windows, NON_GAS_COLUMNS, \
+    subtract_blank, summarize_plants
+from stats import RunningStats
+from streaming import HOUSEKEEPING_COLUMNS
+
+# Metadata columns that must be unchanged for earlier results to be reused
+METADATA_COLUMNS = ["Plant Tag", "LICOR", "PTR Start Time"]
+
+class IncrementalReduction():
+    '''
+    Data reduction state that is brought up to date as new rows of data and metadata arrive, instead of reducing the
+    whole campaign again.
+
+    The time line is divided into bins at each distinct metadata start time, and running statistics are kept for each
+    bin. Every measurement window is a run of consecutive bins, so new metadata rows only add bins and never require
+    rows already added to be removed. Rows after the latest start time are kept raw until the next metadata row
+    arrives, since that row may split them, along with running statistics over them, so adding rows to the open last
+    measurement only costs as much as the new rows.
+
+    Window statistics, blank statistics for each LICOR, and each plant's blank subtracted results are cached and only
+    recomputed when the bins beneath them change.
+
+    Metadata must only grow by appending rows with start times no earlier than those already seen. Anything else
+    requires a new IncrementalReduction, which accepts() reports.
+    '''
+
+    def __init__(self):
+        '''
+        Default constructor.
+        '''
+
+        # Metadata reduced so far
+        self.metadata = None
+
+        # Number of data rows added so far, including those filtered out by DO1, to read the next rows from
+        self.rows_read = 0
+
+        self.gas_columns = None
+
+        # Distinct metadata start times in ascending order. Bin i runs from bin_starts[i] to bin_starts[i + 1].
+        self.bin_starts = np.array([], dtype="datetime64[ns]")
+        self.bin_gas = []
+        self.bin_housekeeping = []
+
+        # Change counter, and the value it had when each bin and the tail last changed
+        self.version = 0
+        self.bin_versions = []
+        self.tail_version = 0
+
+        # Raw rows at or after the last start time, or all rows if there is no metadata yet, as a list of the times,
+        # gas values, and housekeeping values of each batch they were added in, and their earliest and latest times
+        self.tail_rows = []
+        self.tail_first = None
+        self.tail_last = None
+
+        # Running statistics over the tail rows
+        self.tail_gas = RunningStats([])
+        self.tail_housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+
+        # Caches from metadata position or LICOR to a key identifying the inputs and the cached results
+        self.window_cache = {}
+        self.blank_cache = {}
+        self.plant_cache = {}
+
+    def accepts(self, metadata):
+        '''
+        Check whether new metadata only appends measurements to the metadata reduced so far.
+
+        Args:
+            metadata Dataframe of all measurement metadata
+        Return:
+            True if this reduction can be updated with metadata, False if a new one is needed
+        '''
+
+        if self.metadata is None:
+            return True
+
+        if len(metadata) < len(self.metadata):
+            return False
+
+        previous = self.metadata[METADATA_COLUMNS].reset_index(drop=True)
+        current = normalize_metadata(metadata.iloc[:len(self.metadata)])[METADATA_COLUMNS].reset_index(drop=True)
+
+        if not previous.equals(current):
+            return False
+
+        new_starts = pd.to_datetime(metadata["PTR Start Time"].iloc[len(self.metadata):]).to_numpy()
+
+        return len(new_starts) == 0 or len(self.bin_starts) == 0 or \
+            new_starts.astype("datetime64[ns]").min() >= self.bin_starts[-1]
+
+    def update_metadata(self, metadata):
+        '''
+        Add any new measurements in the metadata, splitting the raw tail rows into bins at their start times.
+
+        Args:
+            metadata Dataframe of all measurement metadata, which accepts() must allow
+        '''
+
+        metadata = normalize_metadata(metadata)
+        starts = np.unique(metadata["PTR Start Time"].to_numpy().astype("datetime64[ns]"))
+
+        if len(self.bin_starts) > 0:
+            starts = starts[starts > self.bin_starts[-1]]
+
+        for start in starts:
+            self._close_tail(start)
+
+        self.metadata = metadata
+
+    def _close_tail(self, start):
+        '''
+        Start a new bin, moving tail rows before its start time into the bin that it ends. The tail's statistics are only
+        recomputed from its rows when the start time falls among them.
+
+        Args:
+            start datetime64[ns] start time of the new bin
+        '''
+
+        if len(self.tail_rows) == 0 or self.tail_last < start:
+
+            # Every tail row is before the start time, so the tail's statistics become the bin's
+            gas, housekeeping = self.tail_gas, self.tail_housekeeping
+            self.tail_rows = []
+            self.tail_first = self.tail_last = None
+            self.tail_gas = RunningStats(gas.columns)
+            self.tail_housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+        elif self.tail_first >= start:
+            gas = RunningStats(self.tail_gas.columns)
+            housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+        else:
+            times, gas_values, housekeeping_values = (np.concatenate(parts) for parts in zip(*self.tail_rows))
+            before = times < start
+
+            gas = RunningStats(self.tail_gas.columns)
+            housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+            gas.update(gas_values[before])
+            housekeeping.update(housekeeping_values[before])
+
+            self.tail_rows = [(times[~before], gas_values[~before], housekeeping_values[~before])]
+            self.tail_first = times[~before].min()
+            self.tail_gas = RunningStats(gas.columns)
+            self.tail_housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+            self.tail_gas.update(gas_values[~before])
+            self.tail_housekeeping.update(housekeeping_values[~before])
+
+        # Rows before the first start time don't belong to any measurement
+        if len(self.bin_starts) > 0:
+            self.bin_gas.append(gas)
+            self.bin_housekeeping.append(housekeeping)
+            self.bin_versions.append(self.tail_version)
+
+        self.bin_starts = np.append(self.bin_starts, start)
+        self.version += 1
+        self.tail_version = self.version
+
+    def update_data(self, chunk):
+        '''
+        Add new rows of instrument data.
+
+        Args:
+            chunk Dataframe of new instrument data rows
+        '''
+
+        self.rows_read += len(chunk)
+
+        # DO1 is 0 or 1, with 1 represent one of the middle three measurements which are to be kept
+        chunk = chunk[chunk.DO1 == 1]
+
+        if self.gas_columns is None:
+            self.gas_columns = [column for column in chunk.columns if column not in NON_GAS_COLUMNS]
+            self.tail_gas = RunningStats(self.gas_columns)
+            self.bin_gas = [RunningStats(self.gas_columns) for _ in self.bin_gas]
+
+        times = pd.to_datetime(chunk["time_string"]).to_numpy().astype("datetime64[ns]")
+        present = ~np.isnat(times)
+        times = times[present]
+        gas_values = chunk[self.gas_columns].to_numpy(dtype=float)[present]
+        housekeeping_values = chunk[HOUSEKEEPING_COLUMNS].to_numpy(dtype=float)[present]
+
+        if len(times) == 0:
+            return
+
+        self.version += 1
+
+        if len(self.bin_starts) == 0:
+            in_tail = np.ones(len(times), dtype=bool)
+        else:
+            bins = np.searchsorted(self.bin_starts, times, side="right") - 1
+            in_tail = bins == len(self.bin_starts) - 1
+
+            # Rows that fall in closed bins, for instance late arrivals, update those bins' statistics
+            closed = ~in_tail & (bins >= 0)
+            for i in np.unique(bins[closed]):
+                rows = closed & (bins == i)
+                self.bin_gas[i].update(gas_values[rows])
+                self.bin_housekeeping[i].update(housekeeping_values[rows])
+                self.bin_versions[i] = self.version
+
+        if in_tail.any():
+            times = times[in_tail]
+            self.tail_rows.append((times, gas_values[in_tail], housekeeping_values[in_tail]))
+            self.tail_gas.update(gas_values[in_tail])
+            self.tail_housekeeping.update(housekeeping_values[in_tail])
+            self.tail_first = times.min() if self.tail_first is None else min(self.tail_first, times.min())
+            self.tail_last = times.max() if self.tail_last is None else max(self.tail_last, times.max())
+            self.tail_version = self.version
+
+    def _window_stats(self, segment, first_bin, stop_bin, include_tail):
+        '''
+        Get the statistics for a measurement window from its bins, reusing the cached statistics if none have changed.
+
+        Args:
+            segment Integer metadata position of the measurement
+            first_bin Integer index of the window's first bin
+            stop_bin Integer index one past the window's last closed bin
+            include_tail Boolean whether the window includes the tail rows
+        Return:
+            A key that changes whenever the window's rows change, and RunningStats over the gas and housekeeping
+            columns of the window
+        '''
+
+        key = (first_bin, stop_bin, max(self.bin_versions[first_bin:stop_bin], default=-1),
+               self.tail_version if include_tail else -1)
+        cached = self.window_cache.get(segment)
+
+        if cached is not None and cached[0] == key:
+            return cached
+
+        gas = RunningStats(self.gas_columns)
+        housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+
+        for i in range(first_bin, stop_bin):
+            gas.merge(self.bin_gas[i])
+            housekeeping.merge(self.bin_housekeeping[i])
+
+        if include_tail:
+            gas.merge(self.tail_gas)
+            housekeeping.merge(self.tail_housekeeping)
+
+        self.window_cache[segment] = (key, gas, housekeeping)
+        return self.window_cache[segment]
+
+    def reduce(self, cutoff):
+        '''
+        Produce the data reduction output for all data and metadata added so far.
+
+        Args:
+            cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the
+                high variance list
+        Return:
+            The output Dictionary as described for dac.data_reduction()
+        '''
+
+        return finish_reduction(self.summarize(), cutoff)
+
+    def summarize(self):
+        '''
+        Produce the cutoff independent part of the data reduction for all data and metadata added so far.
+
+        Return:
+            The reduction Dictionary as described for dac.summarize_plants()
+        '''
+
+        if self.metadata is None or self.gas_columns is None:
+            raise ValueError("No data or metadata has been added")
+
+        windows = measurement_windows(self.metadata)
+
+        # Find the statistics of every window from its bins
+        window_stats = {}
+        ends = windows["PTR End Time"].to_numpy().astype("datetime64[ns]")
+        first_bins = np.searchsorted(self.bin_starts, windows["PTR Start Time"].to_numpy().astype("datetime64[ns]"))
+
+        for segment in windows.index:
+            first_bin = first_bins[segment]
+
+            if np.isnat(ends[segment]):
+                window_stats[segment] = self._window_stats(segment, first_bin, len(self.bin_gas), True)
+            else:
+                stop_bin = max(np.searchsorted(self.bin_starts, ends[segment]), first_bin)
+                window_stats[segment] = self._window_stats(segment, first_bin, stop_bin, False)
+
+        plant_tags = []
+        plant_licors = []
+        full_df = []
+        plants_to_gases = {}
+        abnormal_tags = []
+        blanks_per_licor = {}
+        blank_std_per_licor = {}
+
+        for licor in windows["LICOR"].unique():
+            licor_windows = windows[windows["LICOR"] == licor]
+            blank_segments = licor_windows.index[licor_windows["blank"]]
+
+            if len(blank_segments) == 0:
+                raise ValueError("No blank measurements for LICOR " + str(licor))
+
+            # Combine the statistics of all this LICOR's blanks, unless none of them changed
+            blank_key = tuple(window_stats[segment][0] for segment in blank_segments)
+            cached = self.blank_cache.get(licor)
+
+            if cached is None or cached[0] != blank_key:
+                blank = RunningStats(self.gas_columns)
+                blank_housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+
+                for segment in blank_segments:
+                    blank.merge(window_stats[segment][1])
+                    blank_housekeeping.merge(window_stats[segment][2])
+
+                blank_std = blank.stds()
+                cached = (blank_key, blank.means(), blank_std, blank_threshold(blank_std),
+                          blank_housekeeping.means()["21 m/z"])
+                self.blank_cache[licor] = cached
+
+            _, blank_mean, blank_std, threshold, blank_21mz_mean = cached
+            blanks_per_licor[licor] = blank_mean
+            blank_std_per_licor[licor] = blank_std
+
+            # Later measurements with the same plant tag replace earlier ones, as in data_reduction()
+            plant_segments = {}
+            for segment in licor_windows.index[~licor_windows["blank"]]:
+                plant_segments[licor_windows.at[segment, "Plant Tag"]] = segment
+
+            for plant_tag, segment in plant_segments.items():
+                plant_key = (window_stats[segment][0], blank_key)
+                cached = self.plant_cache.get(segment)
+
+                if cached is None or cached[0] != plant_key:
+                    housekeeping = window_stats[segment][2]
+                    plant_df, above_threshold = subtract_blank(window_stats[segment][1].means(), blank_mean, threshold)
+                    abnormal = is_abnormal(housekeeping.min[0], housekeeping.max[0], housekeeping.min[1],
+                                           housekeeping.max[1], blank_21mz_mean)
+                    cached = (plant_key, plant_df, above_threshold, abnormal)
+                    self.plant_cache[segment] = cached
+
+                _, plant_df, plants_to_gases[plant_tag], abnormal = cached
+
+                if abnormal:
+                    abnormal_tags.append(plant_tag)
+
+                plant_tags.append(plant_tag)
+                plant_licors.append(licor)
+                full_df.append(plant_df)
+
+        return summarize_plants(plant_tags, plant_licors, full_df, plants_to_gases, abnormal_tags, blanks_per_licor,
+                                blank_std_per_licor)
+
+def normalize_metadata(metadata):
+    '''
+    Convert metadata start times to datetime64[ns] so that metadata read at different times compares equal.
+
+    Args:
+        metadata Dataframe of measurement metadata
+    Return:
+        A copy of metadata with normalized start times
+    '''
+
+    metadata = metadata.copy()
+    metadata["PTR Start Time"] = pd.to_datetime(metadata["PTR Start Time"]).astype("datetime64[ns]")
+    return metadata
@@ -0,0 +1,340 @@
+import os
+import time
+import warnings
+
+import pandas as pd
+
+from contextlib import contextmanager
+
+from dac import NON_GAS_COLUMNS
+from profiling import span
+
+class DataSchema():
+    '''
+    Declared layout of the instrument data: the timestamp column, the column rows are kept by, the housekeeping columns
+    used for the abnormal condition checks, and the gas concentration columns.
+
+    Only these columns are loaded. Any other non gas columns in the file, such as time_number and Mpvalve, are skipped.
+    '''
+
+    def __init__(self, time_column="time_string", filter_column="DO1", filter_value=1,
+                 housekeeping_columns=("21 m/z", "PC_Pressure"), gas_columns=None):
+        '''
+        Default constructor.
+
+        Args:
+            time_column String name of the timestamp column
+            filter_column String name of the column rows are kept by, DO1 marks the middle three measurements
+            filter_value Value of filter_column for the rows to keep
+            housekeeping_columns Tuple of string names of the housekeeping columns
+            gas_columns Optional list of string names of the gas columns to load, in the order to load them. By
+                default every column not in dac.NON_GAS_COLUMNS is a gas.
+        '''
+
+        self.time_column = time_column
+        self.filter_column = filter_column
+        self.filter_value = filter_value
+        self.housekeeping_columns = list(housekeeping_columns)
+        self.gas_columns = None if gas_columns is None else list(gas_columns)
+
+    def wanted(self, column):
+        '''
+        Check whether a column of the file should be loaded.
+
+        Args:
+            column Name of the column
+        Return:
+            True if the column is the time, filter, housekeeping, or a gas column
+        '''
+
+        if column == self.time_column or column == self.filter_column or column in self.housekeeping_columns:
+            return True
+
+        if self.gas_columns is None:
+            return column not in NON_GAS_COLUMNS
+
+        return column in self.gas_columns
+
+    def missing(self, columns):
+        '''
+        Args:
+            columns Names of the columns of a loaded frame
+        Return:
+            A list of the names of the time, filter, and housekeeping columns that aren't among them
+        '''
+
+        return [column for column in [self.time_column, self.filter_column] + self.housekeeping_columns
+                if column not in columns]
+
+    def gases(self, columns):
+        '''
+        Args:
+            columns Names of the columns of a loaded frame
+        Return:
+            A list of the names of the gas columns among them
+        '''
+
+        keep = set([self.time_column, self.filter_column] + self.housekeeping_columns)
+        return [column for column in columns if column not in keep and self.wanted(column)]
+
+# Default schema matching the PTR data files
+DEFAULT_SCHEMA = DataSchema()
+
+def read_excel_table(path, sheet, schema, engine="openpyxl"):
+    '''
+    Read the wanted columns of a sheet with pandas.read_excel.
+
+    Args:
+        path String path, bytes, or binary file-like object for the workbook
+        sheet String sheet name where the data is saved
+        schema DataSchema of the data
+        engine String pandas Excel engine, "openpyxl" or "calamine"
+    Return:
+        A Dataframe of the sheet's wanted columns, and False since rows aren't filtered while reading
+    '''
+
+    return pd.read_excel(path, sheet_name=sheet, usecols=schema.wanted, engine=engine), False
+
+def read_calamine_table(path, sheet, schema):
+    '''
+    Read the wanted columns of a sheet with the Rust calamine parser, which is many times faster than openpyxl.
+    Requires the python-calamine package.
+    '''
+
+    return read_excel_table(path, sheet, schema, engine="calamine")
+
+def read_csv_table(path, sheet, schema, chunk_rows=100000):
+    '''
+    Read the wanted columns of a csv file, dropping filtered rows one block at a time so the unfiltered file is never
+    held in memory.
+
+    Args:
+        path String path to the csv file
+        sheet Unused, csv files have one table
+        schema DataSchema of the data
+        chunk_rows Integer number of rows to read at a time
+    Return:
+        A Dataframe of the kept rows of the wanted columns, and True since rows are already filtered
+    '''
+
+    # Round trip parsing reads back exactly the floats that were written, where the default parser can be off in the
+    # last bit
+    chunks = [chunk[chunk[schema.filter_column] == schema.filter_value]
+              for chunk in pd.read_csv(path, usecols=schema.wanted, chunksize=chunk_rows, float_precision="round_trip")]
+
+    return pd.concat(chunks), True
+
+def read_parquet_table(path, sheet, schema):
+    '''
+    Read the wanted columns of a Parquet file, pushing the row filter down into the reader. Requires pyarrow.
+
+    Args:
+        path String path to the Parquet file
+        sheet Unused, Parquet files have one table
+        schema DataSchema of the data
+    Return:
+        A Dataframe of the kept rows of the wanted columns, and True since rows are already filtered
+    '''
+
+    from pyarrow import parquet
+
+    columns = [column for column in parquet.read_schema(path).names if schema.wanted(column)]
+    table = parquet.read_table(path, columns=columns, filters=[(schema.filter_column, "==", schema.filter_value)])
+
+    return table.to_pandas(), True
+
+# Reader backends by name. Each takes a path, a sheet name, and a DataSchema, and returns a Dataframe of the wanted
+# columns along with whether its rows have already been filtered.
+READERS = {
+    "openpyxl": read_excel_table,
+    "calamine": read_calamine_table,
+    "csv": read_csv_table,
+    "parquet": read_parquet_table,
+}
+
+def default_engine(path):
+    '''
+    Choose the reader backend for a file from its extension, preferring calamine for workbooks when it is installed.
+
+    Args:
+        path String path to the file
+    Return:
+        String name of the backend in READERS
+    '''
+
+    extension = os.path.splitext(str(path))[1].lower()
+
+    if extension == ".csv":
+        return "csv"
+    elif extension in (".parquet", ".pq"):
+        return "parquet"
+
+    try:
+        import python_calamine
+        return "calamine"
+    except ImportError:
+        return "openpyxl"
+
+@contextmanager
+def stage(name, timings, **counts):
+    '''
+    Time a loading stage, recording its seconds in timings and a "load." span in the active profiler.
+
+    Args:
+        name String name of the stage
+        timings Dictionary to record the stage's seconds in
+        counts Integer counts for the span, such as rows
+    Return:
+        A context manager yielding the profiling span
+    '''
+
+    start = time.perf_counter()
+
+    with span("load." + name, **counts) as profiled:
+        yield profiled
+
+    # Stages repeated for several sheets add up
+    timings[name] = timings.get(name, 0.0) + time.perf_counter() - start
+
+def apply_schema(frame, schema, filtered=False, timings=None, prefix="data_"):
+    '''
+    Select, filter, and convert the columns of loaded data to the schema.
+
+    Args:
+        frame Dataframe of the loaded data
+        schema DataSchema of the data
+        filtered Boolean whether the reader already dropped the filtered rows
+        timings Optional dictionary to record the seconds each stage took in
+        prefix String prefix for the stage names in timings
+    Return:
+        A Dataframe of the kept rows, with datetime64 timestamps and float gas columns
+    '''
+
+    timings = timings if timings is not None else {}
+
+    with stage(prefix + "filter", timings, rows=len(frame)) as profiled:
+        frame = frame[[column for column in frame.columns if schema.wanted(column)]]
+
+        if not filtered:
+            frame = frame[frame[schema.filter_column] == schema.filter_value]
+        profiled.count(kept_rows=len(frame))
+
+    # Parse every timestamp at once instead of converting them row by row
+    with stage(prefix + "timestamps", timings, rows=len(frame)):
+        frame = frame.copy()
+        frame[schema.time_column] = pd.to_datetime(frame[schema.time_column])
+
+    with stage(prefix + "convert", timings, rows=len(frame)):
+        gases = schema.gases(frame.columns)
+        frame[gases] = frame[gases].astype(float)
+
+    return frame
+
+def load_data(path, sheet=None, schema=DEFAULT_SCHEMA, engine=None, cache=None, content_hash=None, timings=None):
+    '''
+    Load the instrument data, keeping only the schema's columns and rows.
+
+    Args:
+        path String path to an xlsx, csv, or Parquet data file
+        sheet String sheet name where the data is saved, only used for workbooks
+        schema DataSchema of the data
+        engine Optional string name of the reader backend in READERS, chosen from the file extension by default
+        cache Optional FrameCache to read previously parsed workbooks from
+        content_hash Optional string sha256 of the file for the cache, if already known
+        timings Optional dictionary to record the seconds each stage took in
+    Return:
+        A Dataframe of the kept rows, with datetime64 timestamps and float gas columns
+    '''
+
+    timings = timings if timings is not None else {}
+    engine = engine or default_engine(path)
+
+    with stage("data_read", timings, engine=engine) as profiled:
+        if cache is not None and engine in ("openpyxl", "calamine"):
+            frame, filtered = cache.read_excel(path, sheet_name=sheet, content_hash=content_hash, engine=engine), False
+        else:
+            frame, filtered = READERS[engine](path, sheet, schema)
+        profiled.count(rows=len(frame), columns=len(frame.columns))
+
+    return apply_schema(frame, schema, filtered, timings)
+
+def load_sheets(path, sheets=None, schema=DEFAULT_SCHEMA, engine=None, cache=None, content_hash=None, timings=None):
+    '''
+    Load the instrument data from several sheets of one workbook, opening and decompressing the workbook once for all of
+    them instead of once per sheet.
+
+    Args:
+        path String path to an xlsx data file
+        sheets List of string sheet names to load, or None for every sheet
+        schema DataSchema of the data
+        engine Optional string name of the Excel engine, "openpyxl" or "calamine", chosen by default_engine() by default
+        cache Optional FrameCache to read previously parsed sheets from
+        content_hash Optional string sha256 of the file for the cache, if already known
+        timings Optional dictionary to record the seconds each stage took in, summed over the sheets
+    Return:
+        A dictionary from sheet names to Dataframes of the kept rows of each, as from load_data(). With sheets None, 
+        sheets without the schema's time, filter, and housekeeping columns, such as notes or summaries, are skipped with
+        a warning.
+    '''
+
+    timings = timings if timings is not None else {}
+    engine = engine or default_engine(path)
+
+    if engine not in ("openpyxl", "calamine"):
+        raise ValueError("Only workbooks have several sheets, not " + engine + " files")
+
+    with stage("data_read", timings, engine=engine) as profiled:
+        if cache is not None:
+            frames = cache.read_excel_sheets(path, sheets, content_hash=content_hash, engine=engine)
+        else:
+            frames = pd.read_excel(path, sheet_name=sheets, usecols=schema.wanted, engine=engine)
+        profiled.count(sheets=len(frames), rows=sum(len(frame) for frame in frames.values()))
+
+    loaded = {}
+
+    for sheet, frame in frames.items():
+        missing = schema.missing(frame.columns)
+
+        if missing and sheets is not None:
+            raise ValueError("Sheet " + str(sheet) + " is missing the columns " + ", ".join(missing))
+
+        if missing:
+            warnings.warn("Skipping sheet " + str(sheet) + ", which is missing the columns " + ", ".join(missing))
+            continue
+
+        loaded[sheet] = apply_schema(frame, schema, False, timings)
+
+    if not loaded:
+        raise ValueError("No sheet of " + str(path) + " has the " + schema.time_column + " and " + schema.filter_column + 
+                         " columns")
+
+    return loaded
+
+def load_metadata(path, engine=None, cache=None, content_hash=None, timings=None):
+    '''
+    Load the measurement metadata.
+
+    Args:
+        path String path to the xlsx metadata file
+        engine Optional string name of the Excel engine, "openpyxl" or "calamine", chosen by default_engine() by default
+        cache Optional FrameCache to read previously parsed workbooks from
+        content_hash Optional string sha256 of the file for the cache, if already known
+        timings Optional dictionary to record the seconds each stage took in
+    Return:
+        A Dataframe of the metadata with datetime64 start times
+    '''
+
+    timings = timings if timings is not None else {}
+    engine = engine or default_engine(path)
+
+    with stage("metadata_read", timings) as profiled:
+        if cache is not None:
+            metadata = cache.read_excel(path, content_hash=content_hash, engine=engine)
+        else:
+            metadata = pd.read_excel(path, engine=engine)
+        profiled.count(segments=len(metadata))
+
+    with stage("metadata_timestamps", timings, segments=len(metadata)):
+        metadata["PTR Start Time"] = pd.to_datetime(metadata["PTR Start Time"])
+
+    return metadata
@@ -0,0 +1,310 @@
+import threading
+import time
+import traceback
+import uuid
+
+from collections import deque, OrderedDict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+class QueueFullError(Exception):
+    '''
+    Raised when a job is submitted while the queue is already at its depth limit.
+    '''
+
+class JobQueue():
+    '''
+    Queue of jobs executed on a pool of worker threads or processes.
+
+    Submitting a job returns an ID immediately and the result is collected later, so one long job doesn't block the
+    caller. Submissions are rejected with QueueFullError once max_queue jobs are waiting for a worker. Finished jobs are
+    kept until their result is taken or until max_finished newer jobs have finished. Jobs that must run in this process
+    are submitted with their own function, which runs on threads here even with process workers.
+    '''
+
+    def __init__(self, function, workers=2, worker_type="thread", max_queue=16, max_finished=256, latency_window=100,
+                 on_result=None, on_finish=None, initializer=None):
+        '''
+        Default constructor.
+
+        Args:
+            function Function to run for each job, taking the job's parameters. With worker_type "process" it must be
+                picklable, that is defined at the top level of a module.
+            workers Integer number of worker threads or processes
+            worker_type String "thread" or "process"
+            max_queue Integer maximum number of jobs waiting for a worker
+            max_finished Integer maximum number of finished jobs to keep results for
+            latency_window Integer number of recent jobs to report latency over
+            on_result Optional function run in this process on each job's parameters and the function's return value,
+                whose return value becomes the job's result. It runs on the pool's callback thread, which for process
+                workers is the one thread that also hands jobs to the workers, so it should only do quick bookkeeping
+                and leave the work to the function.
+            on_finish Optional function run in this process on each job's parameters and its status as returned by
+                result() once the job has finished and its result can be taken, such as to notify whoever submitted
+                it. It runs on the same thread as on_result.
+            initializer Optional function without arguments that warm() runs in this process and that every worker 
+                process runs as it starts, before taking any job, such as to import the modules jobs use. With 
+                worker_type "process" it must be picklable.
+        '''
+
+        if worker_type == "thread":
+            self.executor = self.local_executor = ThreadPoolExecutor(max_workers=workers)
+        elif worker_type == "process":
+            self.executor = ProcessPoolExecutor(max_workers=workers, initializer=initializer)
+
+            # Jobs that must run in this process, such as ones that emit events, run on as many threads here
+            self.local_executor = ThreadPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError("Unknown worker type " + str(worker_type))
+
+        self.function = function
+        self.on_result = on_result
+        self.on_finish = on_finish
+        self.initializer = initializer
+        self.workers = workers
+        self.worker_type = worker_type
+        self.max_queue = max_queue
+        self.max_finished = max_finished
+
+        self.lock = threading.Lock()
+
+        # Dictionary from job IDs to the futures of jobs that haven't finished, the submission time and parameters of
+        # each, and an event set when each finishes
+        self.pending = {}
+        self.submitted = {}
+        self.params = {}
+        self.finished_events = {}
+
+        # Ordered dictionary from job IDs to the status dictionaries of finished jobs, oldest first
+        self.finished = OrderedDict()
+
+        # Seconds from submission to completion for recent jobs
+        self.latencies = deque(maxlen=latency_window)
+
+        self.completed_count = 0
+        self.failed_count = 0
+        self.rejected_count = 0
+
+    def submit(self, params, local_function=None):
+        '''
+        Queue a job.
+
+        Args:
+            params Parameters to pass to the job's function
+            local_function Optional function to run the job with instead of the queue's function, on a thread of this
+                process even with process workers, for jobs that must run here such as ones that emit events. It is
+                queued and limited like any other job.
+        Return:
+            String ID of the job
+        '''
+
+        with self.lock:
+            if self._waiting() >= self.max_queue:
+                self.rejected_count += 1
+                raise QueueFullError("Job queue is full with " + str(self._waiting()) + " jobs waiting")
+
+            job_id = str(uuid.uuid4())
+            self.submitted[job_id] = time.perf_counter()
+            self.params[job_id] = params
+            self.finished_events[job_id] = threading.Event()
+            if local_function is None:
+                future = self.executor.submit(self.function, params)
+            else:
+                future = self.local_executor.submit(local_function, params)
+            self.pending[job_id] = future
+
+        future.add_done_callback(lambda future: self._finish(job_id, future))
+
+        return job_id
+
+    def _waiting(self):
+        '''
+        Return:
+            Integer number of jobs waiting for a worker. Must be called with the lock held.
+        '''
+
+        return sum(1 for future in self.pending.values() if not future.running() and not future.done())
+
+    def complete(self, result, params=None):
+        '''
+        Record a job that finished without running on a worker, such as one answered from a cache.
+
+        Args:
+            result Result of the job
+            params Parameters of the job, for on_finish
+        Return:
+            String ID of the job
+        '''
+
+        job_id = str(uuid.uuid4())
+
+        with self.lock:
+            self.latencies.append(0.0)
+            self.completed_count += 1
+            status = {"job_id": job_id, "status": "done", "result": result, "seconds": 0.0}
+            self._record(job_id, status)
+
+        if self.on_finish is not None:
+            self.on_finish(params, status)
+
+        return job_id
+
+    def _finish(self, job_id, future):
+        '''
+        Record a finished job's result or error.
+
+        Args:
+            job_id String ID of the job
+            future Future of the job
+        '''
+
+        with self.lock:
+            params = self.params.pop(job_id)
+
+        # Errors from on_result fail the job like errors from the function itself
+        try:
+            result = future.result()
+
+            if self.on_result is not None:
+                result = self.on_result(params, result)
+
+            status = {"job_id": job_id, "status": "done", "result": result}
+        except Exception as error:
+            status = {"job_id": job_id, "status": "failed",
+                      "error": "".join(traceback.format_exception(type(error), error, error.__traceback__))}
+
+        with self.lock:
+            latency = time.perf_counter() - self.submitted.pop(job_id)
+            self.pending.pop(job_id, None)
+            self.latencies.append(latency)
+            status["seconds"] = latency
+
+            if status["status"] == "done":
+                self.completed_count += 1
+            else:
+                self.failed_count += 1
+
+            self._record(job_id, status)
+            self.finished_events.pop(job_id).set()
+
+        if self.on_finish is not None:
+            self.on_finish(params, status)
+
+    def _record(self, job_id, status):
+        '''
+        Keep a finished job's status, dropping the oldest beyond max_finished. Must be called with the lock held.
+
+        Args:
+            job_id String ID of the job
+            status Status dictionary of the job
+        '''
+
+        self.finished[job_id] = status
+
+        while len(self.finished) > self.max_finished:
+            self.finished.popitem(last=False)
+
+    def result(self, job_id, remove=True):
+        '''
+        Get the status of a job and its result if it has finished.
+
+        Args:
+            job_id String ID of the job
+            remove Boolean whether to forget a finished job once its result is returned
+        Return:
+            A dictionary with the "job_id" and its "status", one of "queued", "running", "done", "failed", or "unknown".
+            Done jobs include the "result" and failed jobs the "error", along with the "seconds" from submission.
+        '''
+
+        with self.lock:
+            if job_id in self.finished:
+                return self.finished.pop(job_id) if remove else self.finished[job_id]
+
+            future = self.pending.get(job_id)
+
+        if future is None:
+            return {"job_id": job_id, "status": "unknown"}
+
+        return {"job_id": job_id, "status": "running" if future.running() else "queued"}
+
+    def wait(self, job_id, timeout=None, remove=True):
+        '''
+        Wait for a job to finish.
+
+        Args:
+            job_id String ID of the job
+            timeout Float maximum seconds to wait, or None to wait indefinitely
+            remove Boolean whether to forget the job once its result is returned
+        Return:
+            The job's status as returned by result()
+        '''
+
+        with self.lock:
+            finished_event = self.finished_events.get(job_id)
+
+        if finished_event is not None:
+            finished_event.wait(timeout)
+
+        return self.result(job_id, remove)
+
+    def status(self):
+        '''
+        Summarize the queue's current load and recent performance.
+
+        Return:
+            A dictionary with the number of "queued" and "running" jobs, the "workers" and "max_queue" limits, counts of
+            "completed", "failed", and "rejected" jobs, and the mean and 95th percentile "latency_seconds" over recent
+            jobs
+        '''
+
+        with self.lock:
+            running = sum(1 for future in self.pending.values() if future.running())
+            queued = self._waiting()
+            latencies = sorted(self.latencies)
+
+        latency = {"mean": None, "p95": None, "count": len(latencies)}
+
+        if latencies:
+            latency["mean"] = sum(latencies) / len(latencies)
+            latency["p95"] = latencies[min(len(latencies) - 1, int(0.95 * len(latencies)))]
+
+        return {
+            "queued": queued,
+            "running": running,
+            "workers": self.workers,
+            "worker_type": self.worker_type,
+            "max_queue": self.max_queue,
+            "completed": self.completed_count,
+            "failed": self.failed_count,
+            "rejected": self.rejected_count,
+            "latency_seconds": latency,
+        }
+
+    def warm(self):
+        '''
+        Run the initializer in this process and start every worker process before any jobs arrive. Thread workers share
+        this process's modules, so it only runs here for them.
+        '''
+
+        if self.initializer is None:
+            return
+
+        self.initializer()
+
+        # Each worker runs the initializer as it starts, whichever of these tasks it then takes, so a worker that takes 
+        # several can't leave another cold. A burst of one task per worker starts every worker.
+        if self.worker_type == "process":
+            for future in [self.executor.submit(int) for worker in range(self.workers)]:
+                future.result()
+
+    def shutdown(self, wait=True):
+        '''
+        Stop the worker pool.
+
+        Args:
+            wait Boolean whether to wait for running and queued jobs to finish
+        '''
+
+        self.executor.shutdown(wait=wait, cancel_futures=not wait)
+
+        if self.local_executor is not self.executor:
+            self.local_executor.shutdown(wait=wait, cancel_futures=not wait)
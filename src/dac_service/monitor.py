@@ -0,0 +1,354 @@
+import argparse
+import csv
+import json
+import os
+import socket
+import time
+
+import numpy as np
+import pandas as pd
+
+from dac import find_abnormal, is_abnormal, measurement_windows
+from ingest import DEFAULT_SCHEMA
+
+# Seconds to wait before checking a tailed file for new rows
+DEFAULT_POLL_SECONDS = 0.5
+
+# Columns of the per measurement extremes, as from dac.SegmentIndex.extremes()
+EXTREME_COLUMNS = ["21 m/z min", "21 m/z max", "PC_Pressure min", "PC_Pressure max"]
+
+class AbnormalMonitor():
+    '''
+    Checks instrument rows for abnormal conditions as they are written, instead of after the whole campaign.
+
+    Each row belongs to the measurement with the latest metadata start time at or before it. Rows of blanks update a
+    running 21 m/z average for their LICOR, and rows of plants are checked against it and the pressure range with
+    dac.is_abnormal(), so a plant is flagged by the first row that violates a limit. When a blank finishes, the LICOR's
+    earlier plants are checked again against the updated average, since the batch reduction compares them against the
+    average of all of the LICOR's blanks.
+
+    Only the 21 m/z and PC_Pressure extremes of each measurement and two sums per LICOR are kept, so memory doesn't grow
+    with the number of rows and each row costs one binary search over the start times.
+
+    The batch reduction also extends each LICOR's last plant measurement to the end of the data. Online there is no way
+    to know which measurement is last, so rows only ever count towards the latest measurement.
+    '''
+
+    def __init__(self, metadata=None, schema=DEFAULT_SCHEMA):
+        '''
+        Default constructor.
+
+        Args:
+            metadata Optional Dataframe of the measurement metadata known so far
+            schema DataSchema naming the time, filter, and housekeeping columns of the rows
+        '''
+
+        self.schema = schema
+        self.windows = None
+        self.group_starts = np.array([], dtype="datetime64[ns]")
+        self.groups = []
+
+        # Extremes of each metadata position's rows, and whether it has been reported abnormal
+        self.extremes = np.empty((0, len(EXTREME_COLUMNS)))
+        self.flagged = np.zeros(0, dtype=bool)
+
+        # Running sum and count of 21 m/z over each LICOR's blank rows
+        self.blank_sums = {}
+        self.blank_counts = {}
+
+        # Group the latest row belonged to, to notice when a blank finishes
+        self.active_group = None
+
+        self.rows = 0
+        self.row_seconds = 0.0
+        self.max_row_seconds = 0.0
+
+        if metadata is not None:
+            self.update_metadata(metadata)
+
+    def update_metadata(self, metadata):
+        '''
+        Replace the metadata, such as when new measurements have been added to it. Statistics of measurements already
+        seen are kept.
+
+        Args:
+            metadata Dataframe of all measurement metadata so far
+        '''
+
+        windows = measurement_windows(metadata)
+        previous = len(self.flagged)
+
+        # Metadata rows that share a start time share rows of data
+        starts = windows["PTR Start Time"].to_numpy().astype("datetime64[ns]")
+        self.group_starts, group_of = np.unique(starts, return_inverse=True)
+        self.groups = [[] for start in self.group_starts]
+
+        for position, group in enumerate(group_of.reshape(-1)):
+            self.groups[group].append(position)
+
+        extremes = np.full((len(windows), len(EXTREME_COLUMNS)), np.nan)
+        extremes[:min(previous, len(windows))] = self.extremes[:len(windows)]
+        flagged = np.zeros(len(windows), dtype=bool)
+        flagged[:min(previous, len(windows))] = self.flagged[:len(windows)]
+
+        self.windows = windows
+        self.tags = windows["Plant Tag"].to_numpy()
+        self.licors = windows["LICOR"].to_numpy()
+        self.blanks = windows["blank"].to_numpy(dtype=bool)
+        self.extremes = extremes
+        self.flagged = flagged
+        self.active_group = None
+
+    def baseline(self, licor):
+        '''
+        Args:
+            licor String LICOR name
+        Return:
+            Float average 21 m/z over the LICOR's blank rows so far, or NaN before any
+        '''
+
+        count = self.blank_counts.get(licor, 0)
+
+        return self.blank_sums[licor] / count if count > 0 else np.nan
+
+    def add_row(self, row):
+        '''
+        Check one row of instrument data.
+
+        Args:
+            row Dictionary from column names to the row's values, as strings or numbers
+        Return:
+            A list of alert dictionaries, one for each plant this row or the blank it finished newly showed to be
+            abnormal, with the "plant_tag", "licor", "time" of the row, its "21 m/z" and "PC_Pressure", the LICOR's
+            "blank_21mz_mean", and the "trigger", "row" or "blank"
+        '''
+
+        start = time.perf_counter()
+        alerts = []
+
+        if self.windows is not None and float(row[self.schema.filter_column]) == self.schema.filter_value:
+            alerts = self._check(row)
+
+        seconds = time.perf_counter() - start
+        self.rows += 1
+        self.row_seconds += seconds
+        self.max_row_seconds = max(self.max_row_seconds, seconds)
+
+        return alerts
+
+    def _check(self, row):
+        '''
+        Check a kept row against the measurement it belongs to, as described for add_row().
+        '''
+
+        timestamp = np.datetime64(pd.Timestamp(row[self.schema.time_column]), "ns")
+        mz21 = float(row[self.schema.housekeeping_columns[0]])
+        pressure = float(row[self.schema.housekeeping_columns[1]])
+
+        group = int(np.searchsorted(self.group_starts, timestamp, side="right")) - 1
+        if group < 0:
+            return []
+
+        alerts = []
+
+        if self.active_group is not None and group != self.active_group:
+            alerts += self._finish_group(self.active_group)
+        self.active_group = group
+
+        for position in self.groups[group]:
+            licor = self.licors[position]
+            extremes = self.extremes[position]
+
+            extremes[0] = np.fmin(extremes[0], mz21)
+            extremes[1] = np.fmax(extremes[1], mz21)
+            extremes[2] = np.fmin(extremes[2], pressure)
+            extremes[3] = np.fmax(extremes[3], pressure)
+
+            if self.blanks[position]:
+                self.blank_sums[licor] = self.blank_sums.get(licor, 0.0) + mz21
+                self.blank_counts[licor] = self.blank_counts.get(licor, 0) + 1
+
+            # Only the new row can have crossed a limit, so check it alone
+            elif not self.flagged[position] and is_abnormal(mz21, mz21, pressure, pressure, self.baseline(licor)):
+                self.flagged[position] = True
+                alerts.append(self._alert(position, timestamp, mz21, pressure, "row"))
+
+        return alerts
+
+    def _finish_group(self, group):
+        '''
+        Check the LICOR's earlier plants again once a blank has finished and its running average has changed.
+
+        Args:
+            group Integer index of the group of measurements that finished
+        Return:
+            A list of alert dictionaries as from add_row()
+        '''
+
+        alerts = []
+
+        for licor in set(self.licors[position] for position in self.groups[group] if self.blanks[position]):
+            baseline = self.baseline(licor)
+            candidates = np.flatnonzero((self.licors == licor) & ~self.blanks & ~self.flagged &
+                                        ~np.isnan(self.extremes[:, 0]))
+
+            for position in candidates:
+                if is_abnormal(*self.extremes[position], baseline):
+                    self.flagged[position] = True
+                    alerts.append(self._alert(position, None, None, None, "blank"))
+
+        return alerts
+
+    def _alert(self, position, timestamp, mz21, pressure, trigger):
+        '''
+        Return:
+            An alert dictionary as described for add_row()
+        '''
+
+        return {
+            "plant_tag": self.tags[position],
+            "licor": self.licors[position],
+            "time": None if timestamp is None else str(pd.Timestamp(timestamp)),
+            "21 m/z": mz21,
+            "PC_Pressure": pressure,
+            "blank_21mz_mean": self.baseline(self.licors[position]),
+            "trigger": trigger,
+        }
+
+    def abnormal_tags(self):
+        '''
+        Find the plants with abnormal conditions among the rows seen so far, judged against the current blank averages
+        in the same way and order as the batch reduction. Earlier alerts against a partial blank average may no longer
+        hold.
+
+        Return:
+            A list of plant tags
+        '''
+
+        extremes = pd.DataFrame(self.extremes, columns=EXTREME_COLUMNS)
+        abnormal_tags = []
+
+        for licor in pd.unique(self.licors):
+
+            # Later duplicate tags replace the earlier measurement, as in dac.licor_measurements()
+            plant_segments = {}
+            for position in np.flatnonzero((self.licors == licor) & ~self.blanks):
+                plant_segments[self.tags[position]] = position
+
+            abnormal_tags += find_abnormal(extremes, plant_segments, self.baseline(licor))
+
+        return abnormal_tags
+
+    def status(self):
+        '''
+        Return:
+            A dictionary of the number of "rows" checked, the "mean_row_seconds" and "max_row_seconds" spent on each,
+            and the number of "flagged" plants
+        '''
+
+        return {
+            "rows": self.rows,
+            "mean_row_seconds": self.row_seconds / self.rows if self.rows > 0 else None,
+            "max_row_seconds": self.max_row_seconds,
+            "flagged": int(self.flagged.sum()),
+        }
+
+def tail_csv(path, follow=True, poll_seconds=DEFAULT_POLL_SECONDS):
+    '''
+    Read the rows of a csv file as they are appended to it.
+
+    Args:
+        path String path to the csv file, with a header row
+        follow Boolean whether to keep waiting for new rows at the end of the file, or to stop there
+        poll_seconds Float seconds to wait between checks for new rows
+    Return:
+        A generator of dictionaries from column names to the string values of each row, yielding None whenever it
+        waits so the caller can do other work
+    '''
+
+    with open(path, "r", newline="") as csv_file:
+        header = None
+        partial = ""
+
+        while True:
+            line = csv_file.readline()
+
+            # A line without its newline is still being written, so keep it until the rest arrives
+            if not line.endswith("\n"):
+                partial += line
+
+                if not follow:
+                    if partial.strip() and header is not None:
+                        yield dict(zip(header, next(csv.reader([partial]))))
+                    return
+
+                yield None
+                time.sleep(poll_seconds)
+                continue
+
+            line = partial + line
+            partial = ""
+
+            if not line.strip():
+                continue
+
+            values = next(csv.reader([line]))
+
+            if header is None:
+                header = values
+            else:
+                yield dict(zip(header, values))
+
+def read_socket(address):
+    '''
+    Read csv rows from a TCP socket, a stand-in for the instrument's live feed. The first line is the header.
+
+    Args:
+        address String "host:port" to connect to
+    Return:
+        A generator of dictionaries from column names to the string values of each row
+    '''
+
+    host, port = address.rsplit(":", 1)
+
+    with socket.create_connection((host, int(port))) as connection:
+        reader = csv.reader(connection.makefile("r", newline=""))
+        header = next(reader)
+
+        for values in reader:
+            if values:
+                yield dict(zip(header, values))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Flag plants with abnormal conditions as the instrument writes rows.")
+    parser.add_argument("metadata", type=str)
+    source = parser.add_mutually_exclusive_group(required=True)
+    source.add_argument("--csv", type=str, default=None, help="Path to a csv data file to tail")
+    source.add_argument("--socket", type=str, default=None, help="host:port to read csv rows from")
+    parser.add_argument("--no-follow", dest="follow", action="store_false",
+                        help="Stop at the end of the csv file instead of waiting for more rows")
+    parser.add_argument("--poll", type=float, default=DEFAULT_POLL_SECONDS,
+                        help="Seconds between checks for new rows and changes to the metadata")
+    args = parser.parse_args()
+
+    monitor = AbnormalMonitor(pd.read_excel(args.metadata))
+    metadata_mtime = os.path.getmtime(args.metadata)
+
+    rows = tail_csv(args.csv, args.follow, args.poll) if args.csv is not None else read_socket(args.socket)
+
+    for row in rows:
+
+        # Pick up measurements added to the metadata while waiting for rows
+        if row is None:
+            if os.path.getmtime(args.metadata) != metadata_mtime:
+                metadata_mtime = os.path.getmtime(args.metadata)
+                monitor.update_metadata(pd.read_excel(args.metadata))
+            continue
+
+        for alert in monitor.add_row(row):
+            print(json.dumps(alert), flush=True)
+
+    print("Abnormal conditions detected for the following plants:")
+    print(monitor.abnormal_tags())
+    print(json.dumps(monitor.status()))
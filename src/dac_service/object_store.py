@@ -0,0 +1,358 @@
+import hashlib
+import json
+import os
+import re
+import shutil
+import tempfile
+import zlib
+
+from frame_cache import hash_source
+
+# Results larger than this many bytes are returned by reference instead of inline, 1 MB
+DEFAULT_INLINE_LIMIT = 1024 * 1024
+
+# Size of the uncompressed pieces put_chunked() splits files into, 8 MB
+DEFAULT_CHUNK_BYTES = 8 * 1024 * 1024
+
+# zlib level put_chunked() compresses chunks with, favoring speed since workbooks are already compressed
+DEFAULT_COMPRESSION_LEVEL = 1
+
+# Objects are named by the lowercase hex sha256 digest of their contents
+DIGEST_PATTERN = re.compile("[0-9a-f]{64}")
+
+def object_path(directory, digest):
+    '''
+    Build the path of an object named by its hash. References come from requests, so anything that isn't a sha256 
+    digest, or that would resolve outside the directory, is rejected rather than joined into a path.
+
+    Args:
+        directory String path to the directory of objects
+        digest String hex sha256 digest naming the object
+    Return:
+        String path to the object in directory
+    '''
+
+    if not isinstance(digest, str) or DIGEST_PATTERN.fullmatch(digest) is None:
+        raise ValueError("Invalid object hash " + repr(digest))
+
+    path = os.path.join(directory, digest)
+
+    if os.path.dirname(os.path.realpath(path)) != os.path.realpath(directory):
+        raise ValueError("Object " + digest + " is outside " + str(directory))
+
+    return path
+
+def install_verified(temp_path, path, digest):
+    '''
+    Move a downloaded or reassembled file into place only if its contents match their hash, so a corrupt or forged 
+    object is never installed under a name that marks it as verified.
+
+    Args:
+        temp_path String path to the file
+        path String path to install it at
+        digest String hex sha256 digest the contents must have
+    '''
+
+    if hash_source(temp_path) != digest:
+        os.remove(temp_path)
+        raise ValueError("Content of " + digest + " does not match its sha256")
+
+    os.replace(temp_path, path)
+
+class LocalObjectStore():
+    '''
+    Content addressed object store in a local (or shared network) directory, standing in for MinIO when no data
+    store is available.
+    '''
+
+    def __init__(self, root):
+        '''
+        Default constructor.
+
+        Args:
+            root String path to the directory to store objects in. Created if it doesn't exist.
+        '''
+
+        self.root = root
+        os.makedirs(root, exist_ok=True)
+
+    def put_file(self, path):
+        '''
+        Store a file under its content hash.
+
+        Args:
+            path String path to the file
+        Return:
+            A reference dictionary for the object
+        '''
+
+        content_hash = hash_source(path)
+        destination = os.path.join(self.root, content_hash)
+
+        if not os.path.exists(destination):
+            temp_path = destination + "." + str(os.getpid()) + ".tmp"
+            shutil.copyfile(path, temp_path)
+            os.replace(temp_path, destination)
+
+        return {"store": "local", "key": content_hash, "sha256": content_hash, "size": os.path.getsize(destination)}
+
+    def put_bytes(self, content):
+        '''
+        Store bytes under their content hash.
+
+        Args:
+            content Bytes to store
+        Return:
+            A reference dictionary for the object
+        '''
+
+        content_hash = hashlib.sha256(content).hexdigest()
+        destination = os.path.join(self.root, content_hash)
+
+        if not os.path.exists(destination):
+            temp_path = destination + "." + str(os.getpid()) + ".tmp"
+            with open(temp_path, "wb") as object_file:
+                object_file.write(content)
+            os.replace(temp_path, destination)
+
+        return {"store": "local", "key": content_hash, "sha256": content_hash, "size": len(content)}
+
+    def fetch(self, reference, directory=None):
+        '''
+        Get a local path to an object's contents.
+
+        Args:
+            reference Reference dictionary from put_file() or put_bytes()
+            directory Unused, objects are already local
+        Return:
+            String path to the object
+        '''
+
+        return object_path(self.root, reference["key"])
+
+class MinioObjectStore():
+    '''
+    Content addressed object store in a MinIO bucket. Requires the minio package.
+    '''
+
+    def __init__(self, host, port, username, password, bucket="bessd-dac", secure=False):
+        '''
+        Default constructor.
+
+        Args:
+            host String MinIO host name
+            port Integer MinIO port
+            username String MinIO access key
+            password String MinIO secret key
+            bucket String bucket to store objects in. Created if it doesn't exist.
+            secure Boolean whether to connect over https
+        '''
+
+        self.endpoint = host + ":" + str(port)
+        self.username = username
+        self.password = password
+        self.bucket = bucket
+        self.secure = secure
+        self._client = None
+
+    def __getstate__(self):
+        '''
+        Leave the client connection out when the store is sent to a worker process.
+        '''
+
+        state = self.__dict__.copy()
+        state["_client"] = None
+        return state
+
+    def client(self):
+        '''
+        Return:
+            The minio.Minio client, connecting on first use
+        '''
+
+        if self._client is None:
+            from minio import Minio
+
+            self._client = Minio(self.endpoint, access_key=self.username, secret_key=self.password,
+                                 secure=self.secure)
+
+            if not self._client.bucket_exists(self.bucket):
+                self._client.make_bucket(self.bucket)
+
+        return self._client
+
+    def _reference(self, content_hash, size):
+        return {"store": "minio", "bucket": self.bucket, "key": content_hash, "sha256": content_hash, "size": size}
+
+    def _exists(self, key):
+        try:
+            self.client().stat_object(self.bucket, key)
+            return True
+        except Exception:
+            return False
+
+    def put_file(self, path):
+        '''
+        Upload a file under its content hash, skipping the upload if the object already exists.
+
+        Args:
+            path String path to the file
+        Return:
+            A reference dictionary for the object
+        '''
+
+        content_hash = hash_source(path)
+
+        if not self._exists(content_hash):
+            self.client().fput_object(self.bucket, content_hash, path)
+
+        return self._reference(content_hash, os.path.getsize(path))
+
+    def put_bytes(self, content):
+        '''
+        Upload bytes under their content hash.
+
+        Args:
+            content Bytes to upload
+        Return:
+            A reference dictionary for the object
+        '''
+
+        from io import BytesIO
+
+        content_hash = hashlib.sha256(content).hexdigest()
+
+        if not self._exists(content_hash):
+            self.client().put_object(self.bucket, content_hash, BytesIO(content), len(content))
+
+        return self._reference(content_hash, len(content))
+
+    def fetch(self, reference, directory=None):
+        '''
+        Download an object to a local file named by its hash, unless it was already downloaded. The download is only
+        kept if its contents match the hash.
+
+        Args:
+            reference Reference dictionary from put_file() or put_bytes()
+            directory String path to the directory to download to, defaulting to the system temporary directory
+        Return:
+            String path to the downloaded object
+        '''
+
+        directory = directory or os.path.join(tempfile.gettempdir(), "bessd-dac-objects")
+        os.makedirs(directory, exist_ok=True)
+        path = object_path(directory, reference["sha256"])
+
+        if not os.path.exists(path):
+            if not isinstance(reference["key"], str) or DIGEST_PATTERN.fullmatch(reference["key"]) is None:
+                raise ValueError("Invalid object key " + repr(reference["key"]))
+
+            temp_path = path + "." + str(os.getpid()) + ".tmp"
+            self.client().fget_object(reference.get("bucket", self.bucket), reference["key"], temp_path)
+            install_verified(temp_path, path, reference["sha256"])
+
+        return path
+
+def store_from_config(data_stores, local_directory=None):
+    '''
+    Create an object store from an INTERSECT data_stores configuration.
+
+    Args:
+        data_stores Dictionary of the "data_stores" section of the INTERSECT configuration
+        local_directory Optional string path to use a LocalObjectStore instead
+    Return:
+        A LocalObjectStore if local_directory is given, otherwise a MinioObjectStore for the first MinIO entry
+    '''
+
+    if local_directory is not None:
+        return LocalObjectStore(local_directory)
+
+    minio = data_stores["minio"][0]
+    return MinioObjectStore(minio["host"], minio["port"], minio["username"], minio["password"])
+
+def put_chunked(store, path, chunk_bytes=DEFAULT_CHUNK_BYTES, level=DEFAULT_COMPRESSION_LEVEL):
+    '''
+    Store a file as compressed chunks, each under the hash of its compressed bytes, so a transfer can be checked and
+    resumed one chunk at a time and chunks already in the store aren't uploaded again.
+
+    Args:
+        store LocalObjectStore or MinioObjectStore to put the chunks in
+        path String path to the file
+        chunk_bytes Integer size of the uncompressed chunks
+        level Integer zlib compression level
+    Return:
+        A manifest reference dictionary with the "chunks" references in order, their "compression", and the "sha256"
+        and "size" of the whole file, which fetch_verified() accepts in place of a reference
+    '''
+
+    chunks = []
+
+    with open(path, "rb") as source:
+        for block in iter(lambda: source.read(chunk_bytes), b""):
+            chunks.append(store.put_bytes(zlib.compress(block, level)))
+
+    return {"chunks": chunks, "compression": "zlib", "sha256": hash_source(path), "size": os.path.getsize(path)}
+
+def fetch_chunked(store, manifest, directory=None):
+    '''
+    Reassemble a file from the chunks of a put_chunked() manifest, checking each chunk and the whole file against their
+    hashes. The file is kept under its hash, so it is only reassembled once.
+
+    Args:
+        store LocalObjectStore or MinioObjectStore holding the chunks
+        manifest Manifest dictionary from put_chunked()
+        directory String path to the directory to reassemble in, defaulting to the system temporary directory
+    Return:
+        String path to the reassembled file
+    '''
+
+    directory = directory or os.path.join(tempfile.gettempdir(), "bessd-dac-objects")
+    os.makedirs(directory, exist_ok=True)
+    path = object_path(directory, manifest["sha256"])
+
+    if os.path.exists(path):
+        return path
+
+    if manifest["compression"] != "zlib":
+        raise ValueError("Unknown chunk compression " + str(manifest["compression"]))
+
+    temp_path = path + "." + str(os.getpid()) + ".tmp"
+
+    try:
+        with open(temp_path, "wb") as target:
+            for chunk in manifest["chunks"]:
+                with open(fetch_verified(store, chunk, directory), "rb") as chunk_file:
+                    target.write(zlib.decompress(chunk_file.read()))
+    except BaseException:
+        os.remove(temp_path)
+        raise
+
+    # The whole file is checked before it's installed under its hash, since later fetches trust the name
+    install_verified(temp_path, path, manifest["sha256"])
+
+    return path
+
+def fetch_verified(store, reference, directory=None):
+    '''
+    Fetch an object and check its contents against the hash in its reference.
+
+    Args:
+        store LocalObjectStore or MinioObjectStore holding the object
+        reference Reference dictionary, or a JSON string of one. Manifests from put_chunked() are reassembled.
+        directory Optional string path to download to
+    Return:
+        String path to the object's contents
+    '''
+
+    if isinstance(reference, str):
+        reference = json.loads(reference)
+
+    if "chunks" in reference:
+        path = fetch_chunked(store, reference, directory)
+    else:
+        path = store.fetch(reference, directory)
+
+    if hash_source(path) != reference["sha256"]:
+        raise ValueError("Content of " + reference.get("key", reference["sha256"]) + " does not match its sha256")
+
+    return path
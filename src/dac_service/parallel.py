@@ -0,0 +1,224 @@
+import os
+
+import numpy as np
+
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from dac import collect_reduction, find_abnormal, finish_reduction, licor_measurements, prepare_reduction
+from gas_matrix import blank_statistics, column_means
+from profiling import span
+from stats import QuantileSketch
+
+# Default number of data rows of plant measurements in each partition
+DEFAULT_PARTITION_ROWS = 20000
+
+def reduce_plant_partition(columns, plant_windows, sketches=False):
+    '''
+    Average one partition of a LICOR's plant measurements. The blanks are subtracted from every partition at once
+    afterwards, so partitions don't wait on the blank statistics.
+
+    Args:
+        columns Index of the gas names
+        plant_windows List of arrays of shape (gases, rows) of each plant's measurement from GasMatrix.window()
+        sketches Boolean whether to also sketch each plant's gases
+    Return:
+        An array of shape (plants, gases) of each plant's average concentrations, and a list of the QuantileSketch of
+        each plant, or None without sketches, both in the order of plant_windows
+    '''
+
+    means = np.empty((len(plant_windows), len(columns)), dtype=plant_windows[0].dtype)
+
+    for row, window in enumerate(plant_windows):
+        means[row] = column_means(window)
+
+    return means, [sketch_windows(columns, [window]) for window in plant_windows] if sketches else None
+
+def sketch_windows(columns, windows):
+    '''
+    Args:
+        columns Index of the gas names
+        windows List of arrays of shape (gases, rows) of measurements from GasMatrix.window()
+    Return:
+        A QuantileSketch of the gases over all of the windows
+    '''
+
+    sketch = QuantileSketch(columns)
+
+    for window in windows:
+        sketch.update(window.T)
+
+    return sketch
+
+def plant_partitions(plant_segments, segment_index, partition_rows=DEFAULT_PARTITION_ROWS):
+    '''
+    Split a LICOR's plant measurements into consecutive time ranges of about partition_rows rows.
+
+    Args:
+        plant_segments Dictionary from plant tags to the position of each plant's measurement
+        segment_index SegmentIndex of the campaign
+        partition_rows Integer number of rows to aim for in each partition. Measurements are never split.
+    Return:
+        A list of lists of (plant tag, segment) pairs, in the order of plant_segments
+    '''
+
+    partitions = [[]]
+    rows = 0
+
+    for plant_tag, segment in plant_segments.items():
+        window_rows = segment_index.row_stop[segment] - segment_index.row_start[segment]
+
+        if partitions[-1] and rows + window_rows > partition_rows:
+            partitions.append([])
+            rows = 0
+
+        partitions[-1].append((plant_tag, segment))
+        rows += window_rows
+
+    return [partition for partition in partitions if partition]
+
+def parallel_reduce_campaign(df, metadata, workers=None, worker_type="thread", partition_rows=DEFAULT_PARTITION_ROWS,
+                             executor=None, sketches=False, dtype="float64", baselines=None):
+    '''
+    Perform the cutoff independent part of the data reduction with each LICOR's blanks and each time range of its
+    plant measurements reduced as an independent partition on a pool of workers.
+
+    Partitions are aligned to measurement windows, so each produces the complete statistics for its windows and the
+    partitions combine by concatenation. Workers are sent the windows of the GasMatrix, which are views for thread
+    workers and only the partition's own rows for process workers. Every statistic is computed by the same operations
+    as dac.reduce_campaign(), so the output is identical to it.
+
+    Args:
+        df Dataframe of the LICOR data
+        metadata Dataframe of the measurement metadata
+        workers Integer number of workers, default one per CPU
+        worker_type String "thread" or "process"
+        partition_rows Integer number of plant measurement rows to aim for in each partition
+        executor Optional executor to run partitions on instead of creating a pool
+        sketches Boolean whether to also sketch the distribution of every gas for each plant and each LICOR's blanks
+        dtype String "float64", or "float32" to halve the memory of the gas concentrations at the cost of precision
+        baselines Optional baselines.BaselineCache, as described for dac.reduce_campaign(). Only the blanks it doesn't
+            have are sent to the workers.
+    Return:
+        The reduction Dictionary as described for dac.reduce_campaign()
+    '''
+
+    if executor is None:
+        workers = workers or os.cpu_count()
+
+        if worker_type == "thread":
+            pool = ThreadPoolExecutor(max_workers=workers)
+        elif worker_type == "process":
+            pool = ProcessPoolExecutor(max_workers=workers)
+        else:
+            raise ValueError("Unknown worker type " + str(worker_type))
+
+        with pool:
+            return parallel_reduce_campaign(df, metadata, partition_rows=partition_rows, executor=pool, sketches=sketches,
+                                            dtype=dtype, baselines=baselines)
+
+    df, segment_index, gas_matrix, extremes = prepare_reduction(df, metadata, dtype=dtype)
+    columns = gas_matrix.columns
+    licor_names = metadata.LICOR.unique()
+
+    # Submit every LICOR's blanks and plant partitions at once, since the plant means don't need the blank statistics
+    measurements = {}
+    blank_futures = {}
+    blank_keys = {}
+    cached_blanks = {}
+    blank_sketch_futures = {}
+    plant_futures = {}
+
+    for licor in licor_names:
+        blank_segments, plant_segments = licor_measurements(segment_index, licor)
+        measurements[licor] = plant_segments
+        blank_windows = [gas_matrix.window(segment) for segment in blank_segments]
+
+        if baselines is not None:
+            blank_keys[licor], cached_blanks[licor] = baselines.lookup(licor, gas_matrix, blank_segments)
+
+        if cached_blanks.get(licor) is None:
+            blank_futures[licor] = executor.submit(blank_statistics, columns, blank_windows,
+                                                   [gas_matrix.housekeeping_window("21 m/z", segment)
+                                                    for segment in blank_segments])
+
+        if sketches:
+            blank_sketch_futures[licor] = executor.submit(sketch_windows, columns, blank_windows)
+
+        plant_futures[licor] = [
+            executor.submit(reduce_plant_partition, columns,
+                            [gas_matrix.window(segment) for plant_tag, segment in partition], sketches)
+            for partition in plant_partitions(plant_segments, segment_index, partition_rows)
+        ]
+
+    blanks_per_licor = {}
+    blank_std_per_licor = {}
+    blank_21mz_mean_per_licor = {}
+
+    with span("parallel.blank_statistics", partitions=len(licor_names)):
+        for licor in licor_names:
+            if licor in blank_futures:
+                cached_blanks[licor] = blank_futures[licor].result()
+
+                if baselines is not None:
+                    baselines.save(licor, blank_keys[licor], cached_blanks[licor])
+
+            blanks_per_licor[licor], blank_std_per_licor[licor], blank_21mz_mean_per_licor[licor] = \
+                cached_blanks[licor]
+
+    abnormal_tags = []
+
+    with span("reduce.abnormal_detection", segments=sum(len(plants) for plants in measurements.values())):
+        for licor in licor_names:
+            abnormal_tags += find_abnormal(extremes, measurements[licor], blank_21mz_mean_per_licor[licor])
+
+    # Combine the partitions in order, so the plants come out in the same order as the serial reduction
+    means_per_licor = {}
+    plant_sketches = {}
+
+    with span("parallel.plant_partitions", partitions=sum(len(futures) for futures in plant_futures.values())):
+        for licor in licor_names:
+            results = [future.result() for future in plant_futures[licor]]
+            means_per_licor[licor] = np.concatenate([means for means, partition_sketches in results]) if results \
+                else np.empty((0, len(columns)), dtype=gas_matrix.values.dtype)
+
+            if sketches:
+                plant_sketches.update(zip(measurements[licor].keys(),
+                                          [sketch for means, partition_sketches in results
+                                           for sketch in partition_sketches]))
+
+    reduction = collect_reduction({licor: list(plants.keys()) for licor, plants in measurements.items()},
+                                  means_per_licor, columns, blanks_per_licor, blank_std_per_licor, abnormal_tags)
+
+    if sketches:
+        reduction["plant_sketches"] = plant_sketches
+        reduction["blank_sketches"] = {licor: future.result() for licor, future in blank_sketch_futures.items()}
+
+    return reduction
+
+def parallel_data_reduction(df, metadata, cutoff, workers=None, worker_type="thread",
+                            partition_rows=DEFAULT_PARTITION_ROWS, executor=None, sketches=False, dtype="float64",
+                            baselines=None):
+    '''
+    Perform the data reduction with partitions reduced in parallel, as described for parallel_reduce_campaign().
+
+    Args:
+        df Dataframe of the LICOR data
+        metadata Dataframe of the measurement metadata
+        cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high
+            variance list
+        workers Integer number of workers, default one per CPU
+        worker_type String "thread" or "process"
+        partition_rows Integer number of plant measurement rows to aim for in each partition
+        executor Optional executor to run partitions on instead of creating a pool
+        sketches Boolean whether to also return "plant_sketches" and "blank_sketches" as described for
+            dac.reduce_campaign()
+        dtype String "float64", or "float32" to halve the memory of the gas concentrations at the cost of precision
+        baselines Optional baselines.BaselineCache, as described for dac.reduce_campaign()
+    Return:
+        The output Dictionary as described for dac.data_reduction()
+    '''
+
+    reduction = parallel_reduce_campaign(df, metadata, workers, worker_type, partition_rows, executor, sketches, dtype,
+                                         baselines)
+
+    return finish_reduction(reduction, cutoff)
@@ -0,0 +1,343 @@
+import json
+import os
+import threading
+import time
+import tracemalloc
+
+from collections import deque
+from contextlib import contextmanager
+
+# Profiler collecting spans on each thread, if any
+_active = threading.local()
+
+class Span():
+    '''
+    One timed stage of a reduction. Used as a context manager by Profiler.span().
+    '''
+
+    def __init__(self, profiler, name, counts):
+        '''
+        Default constructor.
+
+        Args:
+            profiler Profiler to record the span in
+            name String name of the stage
+            counts Dictionary of initial counts, such as rows or segments
+        '''
+
+        self.profiler = profiler
+        self.name = name
+        self.counts = dict(counts)
+        self.peak = 0
+
+    def count(self, **counts):
+        '''
+        Record counts found during the stage, such as the number of rows read.
+
+        Args:
+            counts Integer counts by name
+        '''
+
+        self.counts.update(counts)
+
+    def __enter__(self):
+        stack = self.profiler.stack()
+
+        if self.profiler.trace_memory:
+
+            # Resetting the peak for this span would lose the enclosing span's peak so far, so pass that up first
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, tracemalloc.get_traced_memory()[1])
+            self.memory_start = tracemalloc.get_traced_memory()[0]
+            tracemalloc.reset_peak()
+
+        stack.append(self)
+        self.start = time.perf_counter()
+        self.cpu_start = time.thread_time()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        wall_seconds = time.perf_counter() - self.start
+        cpu_seconds = time.thread_time() - self.cpu_start
+        stack = self.profiler.stack()
+        stack.pop()
+
+        peak_mb = None
+
+        if self.profiler.trace_memory:
+            self.peak = max(self.peak, tracemalloc.get_traced_memory()[1])
+            peak_mb = (self.peak - self.memory_start) / 1024 ** 2
+
+            if stack:
+                stack[-1].peak = max(stack[-1].peak, self.peak)
+
+        self.profiler.record({
+            "name": self.name,
+            "start": self.start - self.profiler.origin,
+            "wall_seconds": wall_seconds,
+            "cpu_seconds": cpu_seconds,
+            "peak_mb": peak_mb,
+            "depth": len(stack),
+            "thread": threading.get_ident(),
+            "counts": self.counts,
+        })
+
+        return False
+
+class NullSpan():
+    '''
+    Span that records nothing, returned by span() when profiling is off.
+    '''
+
+    def count(self, **counts):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        return False
+
+NULL_SPAN = NullSpan()
+
+class Profiler():
+    '''
+    Collects named spans around the stages of a reduction, recording wall time, CPU time, optionally peak traced memory,
+    and counts such as rows or segments for each.
+
+    Code marks its stages with the module level span() function, which records into the profiler activated on the
+    current thread with activate() and does nothing otherwise, so instrumented code costs almost nothing when profiling
+    is off.
+    '''
+
+    def __init__(self, trace_memory=False):
+        '''
+        Default constructor.
+
+        Args:
+            trace_memory Boolean whether to trace the peak memory of each span. This slows Python code down
+                considerably.
+        '''
+
+        self.trace_memory = trace_memory
+        self.origin = time.perf_counter()
+        self.spans = []
+        self.lock = threading.Lock()
+        self.stacks = threading.local()
+
+    def stack(self):
+        '''
+        Return:
+            The list of open spans on the current thread, innermost last
+        '''
+
+        if not hasattr(self.stacks, "spans"):
+            self.stacks.spans = []
+
+        return self.stacks.spans
+
+    def span(self, name, **counts):
+        '''
+        Args:
+            name String name of the stage
+            counts Integer counts by name, such as rows or segments
+        Return:
+            A Span context manager timing the stage
+        '''
+
+        return Span(self, name, counts)
+
+    def record(self, span):
+        '''
+        Add a finished span.
+
+        Args:
+            span Dictionary describing the span
+        '''
+
+        with self.lock:
+            self.spans.append(span)
+
+    def summary(self):
+        '''
+        Return:
+            A dictionary from span names to the "calls", "wall_seconds", and "cpu_seconds" totals, "max_peak_mb", and
+            summed counts of all spans with that name, in the order stages first finished
+        '''
+
+        return summarize_spans(self.spans)
+
+    def to_json(self):
+        '''
+        Return:
+            A dictionary of the recorded "spans" in the order they finished and their "summary"
+        '''
+
+        return {"spans": list(self.spans), "summary": self.summary()}
+
+    def to_chrome_trace(self):
+        '''
+        Convert the spans to the Chrome trace event format, which chrome://tracing and Perfetto display as a timeline.
+
+        Return:
+            A dictionary of "traceEvents"
+        '''
+
+        events = []
+
+        for span in self.spans:
+            args = dict(span["counts"], cpu_seconds=span["cpu_seconds"])
+            if span["peak_mb"] is not None:
+                args["peak_mb"] = span["peak_mb"]
+
+            events.append({"name": span["name"], "ph": "X", "ts": span["start"] * 1e6, "dur": span["wall_seconds"] * 1e6,
+                           "pid": os.getpid(), "tid": span["thread"], "args": args})
+
+        return {"traceEvents": events, "displayTimeUnit": "ms"}
+
+    def write(self, path, format="json"):
+        '''
+        Write the recorded spans to a file.
+
+        Args:
+            path String path to write to
+            format String "json" for to_json() or "chrome" for to_chrome_trace()
+        '''
+
+        with open(path, "w") as profile_file:
+            json.dump(self.to_chrome_trace() if format == "chrome" else self.to_json(), profile_file, indent=2)
+
+    def print_summary(self):
+        '''
+        Print a table of the time spent in each stage.
+        '''
+
+        print("%-28s %6s %10s %10s %10s" % ("stage", "calls", "wall s", "cpu s", "peak MB"))
+
+        for name, stage in self.summary().items():
+            peak = "-" if stage["max_peak_mb"] is None else "%.1f" % stage["max_peak_mb"]
+            print("%-28s %6d %10.4f %10.4f %10s" % (name, stage["calls"], stage["wall_seconds"], stage["cpu_seconds"],
+                                                    peak))
+
+def summarize_spans(spans):
+    '''
+    Total spans by name.
+
+    Args:
+        spans List of span dictionaries from a Profiler
+    Return:
+        The summary dictionary as described for Profiler.summary()
+    '''
+
+    summary = {}
+
+    for span in spans:
+        stage = summary.setdefault(span["name"], {"calls": 0, "wall_seconds": 0.0, "cpu_seconds": 0.0,
+                                                  "max_peak_mb": None, "counts": {}})
+        stage["calls"] += 1
+        stage["wall_seconds"] += span["wall_seconds"]
+        stage["cpu_seconds"] += span["cpu_seconds"]
+
+        if span["peak_mb"] is not None:
+            stage["max_peak_mb"] = max(stage["max_peak_mb"] or 0.0, span["peak_mb"])
+
+        for key, value in span["counts"].items():
+            if isinstance(value, (int, float)):
+                stage["counts"][key] = stage["counts"].get(key, 0) + value
+
+    return summary
+
+@contextmanager
+def activate(profiler):
+    '''
+    Make a profiler the one span() records into on the current thread for the duration of a with block. Activating None
+    turns profiling off within it.
+
+    Args:
+        profiler Profiler to activate, or None
+    Return:
+        A context manager yielding the profiler
+    '''
+
+    previous = getattr(_active, "profiler", None)
+    _active.profiler = profiler
+
+    started_tracing = profiler is not None and profiler.trace_memory and not tracemalloc.is_tracing()
+    if started_tracing:
+        tracemalloc.start()
+
+    try:
+        yield profiler
+    finally:
+        _active.profiler = previous
+
+        if started_tracing:
+            tracemalloc.stop()
+
+def span(name, **counts):
+    '''
+    Time a stage in the profiler active on this thread.
+
+    Args:
+        name String name of the stage
+        counts Integer counts by name, such as rows or segments
+    Return:
+        A Span context manager, or a NullSpan if no profiler is active
+    '''
+
+    profiler = getattr(_active, "profiler", None)
+
+    if profiler is None:
+        return NULL_SPAN
+
+    return profiler.span(name, **counts)
+
+class ProfileAggregates():
+    '''
+    Rolling per stage statistics over the profiles of recent reductions, for the service's status.
+    '''
+
+    def __init__(self, window=100):
+        '''
+        Default constructor.
+
+        Args:
+            window Integer number of recent reductions to aggregate over
+        '''
+
+        self.profiles = deque(maxlen=window)
+        self.lock = threading.Lock()
+
+    def add(self, spans):
+        '''
+        Args:
+            spans List of span dictionaries from one reduction's Profiler
+        '''
+
+        with self.lock:
+            self.profiles.append(summarize_spans(spans))
+
+    def status(self):
+        '''
+        Return:
+            A dictionary from stage names to the number of "reductions" that ran the stage and the "mean" and "p95" of
+            its total wall seconds per reduction
+        '''
+
+        with self.lock:
+            profiles = list(self.profiles)
+
+        seconds = {}
+
+        for profile in profiles:
+            for name, stage in profile.items():
+                seconds.setdefault(name, []).append(stage["wall_seconds"])
+
+        status = {}
+
+        for name, values in seconds.items():
+            values.sort()
+            status[name] = {"reductions": len(values), "mean": sum(values) / len(values),
+                            "p95": values[min(len(values) - 1, int(0.95 * len(values)))]}
+
+        return status
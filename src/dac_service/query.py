@@ -0,0 +1,357 @@
+import argparse
+
+import numpy as np
+import pandas as pd
+
+from dac import blank_threshold, count_prevalences, find_abnormal, gas_columns, licor_measurements, load_files, \
+    prepare_reduction
+from gas_matrix import DTYPES, GasMatrix, subtract_blanks
+
+class Campaign():
+    '''
+    A loaded campaign that is reduced lazily, for only the gases and plants each query asks for, instead of reducing
+    every gas of every plant as data_reduction() does.
+
+    The data is filtered and segmented once, on the first query. A gas column is copied out of the data the first time
+    a query uses it, and each LICOR's blank statistics are computed for a gas the first time a query needs them, so
+    follow up queries on the same campaign only average the windows of the plants they select.
+
+    The results of a selection are identical to the same gases and plants in the full reduction.
+    '''
+
+    def __init__(self, df, metadata, dtype="float64", baselines=None):
+        '''
+        Default constructor.
+
+        Args:
+            df Dataframe of the LICOR data
+            metadata Dataframe of the measurement metadata. Its start times are converted in place on the first query.
+            dtype String "float64" or "float32" for the gas concentrations, as described for dac.reduce_campaign()
+            baselines Optional baselines.BaselineCache to take each LICOR's blank statistics from. The cache keeps one
+                baseline of every gas for each LICOR, which queries take their gases from.
+        '''
+
+        self.df = df
+        self.metadata = metadata
+        self.dtype = dtype
+        self.baselines = baselines
+        self.gases = gas_columns(df)
+
+        # Rows of df kept by DO1, their SegmentIndex, the GasMatrix of their housekeeping columns, and the 21 m/z and
+        # PC_Pressure extremes in each window, set on the first query
+        self.keep = None
+        self.segment_index = None
+        self.housekeeping = None
+        self.extremes = None
+
+        # Kept rows of each gas column used so far
+        self.columns = {}
+
+        # Dictionary from LICOR names to their blank and plant measurements from dac.licor_measurements()
+        self.measurements = None
+
+        # Dictionary from LICOR names to dictionaries of the "mean" and "std" of each gas over the LICOR's blanks
+        # computed so far, and the blank's "21mz_mean"
+        self.blanks = {}
+
+    @staticmethod
+    def load(data, sheet, metadata, gases=None, cache=None, engine=None, dtype="float64", baselines=None):
+        '''
+        Load a campaign from its files, reading only some of its gas columns.
+
+        Args:
+            data String path to the xlsx, csv, or Parquet format data file
+            sheet String sheet name where data has the data saved
+            metadata String path to the xlsx format metadata file
+            gases Optional list of the gas columns to load, every gas by default. Later selections can only include
+                these gases.
+            cache Optional FrameCache to read previously parsed sheets from
+            engine Optional string name of the reader backend for the data file in ingest.READERS
+            dtype String "float64" or "float32" for the gas concentrations
+            baselines Optional baselines.BaselineCache to take blank statistics from
+        Return:
+            The Campaign
+        '''
+
+        from ingest import DataSchema
+
+        schema = None if gases is None else DataSchema(gas_columns=gases)
+        df, metadata = load_files(data, sheet, metadata, cache=cache, engine=engine, schema=schema)
+
+        return Campaign(df, metadata, dtype=dtype, baselines=baselines)
+
+    def prepare(self):
+        '''
+        Filter and segment the data, the first time it's needed. No gas columns are copied.
+        '''
+
+        if self.segment_index is not None:
+            return
+
+        self.keep = (self.df.DO1 == 1).to_numpy()
+        _, self.segment_index, self.housekeeping, self.extremes = prepare_reduction(self.df, self.metadata,
+                                                                                    dtype=self.dtype, gases=[])
+
+        self.measurements = {}
+        for licor in self.metadata.LICOR.unique():
+            self.measurements[licor] = licor_measurements(self.segment_index, licor)
+
+    def matrix(self, gases):
+        '''
+        Args:
+            gases List of gas names
+        Return:
+            A GasMatrix of the kept rows of only those gases
+        '''
+
+        self.prepare()
+
+        values = np.empty((len(gases), int(np.count_nonzero(self.keep))), dtype=DTYPES[self.dtype])
+
+        for row, gas in enumerate(gases):
+            if gas not in self.columns:
+                self.columns[gas] = self.df[gas].to_numpy()[self.keep].astype(DTYPES[self.dtype])
+
+            values[row] = self.columns[gas]
+
+        return GasMatrix(pd.Index(gases), values, self.housekeeping.housekeeping, self.segment_index)
+
+    def blank_statistics(self, licor, gases):
+        '''
+        Get a LICOR's blank statistics for some gases, only computing those of gases no earlier query needed. With
+        baselines, every LICOR's baseline of every gas is taken from the cache the first time any is needed instead.
+
+        Args:
+            licor Name of the LICOR
+            gases List of gas names
+        Return:
+            A Series of the average of each gas over the blanks, a Series of the standard deviation of each gas over the
+            blanks, and the average 21 m/z over the blanks
+        '''
+
+        self.prepare()
+
+        if self.baselines is not None and not self.blanks:
+            self.load_baselines()
+
+        blanks = self.blanks.setdefault(licor, {"mean": {}, "std": {}, "21mz_mean": None})
+        missing = [gas for gas in gases if gas not in blanks["mean"]]
+
+        if missing or blanks["21mz_mean"] is None:
+            blank_mean, blank_std, blanks["21mz_mean"] = \
+                self.matrix(missing).blank_statistics(self.measurements[licor][0])
+            blanks["mean"].update(blank_mean.items())
+            blanks["std"].update(blank_std.items())
+
+        return pd.Series(np.array([blanks["mean"][gas] for gas in gases], dtype=DTYPES[self.dtype]), index=gases), \
+            pd.Series(np.array([blanks["std"][gas] for gas in gases], dtype=DTYPES[self.dtype]), index=gases), \
+            blanks["21mz_mean"]
+
+    def load_baselines(self):
+        '''
+        Take every LICOR's blank statistics of every gas from the baselines, so the cache holds one whole baseline per
+        LICOR, as the full reduction's, rather than one for each combination of gases queried.
+        '''
+
+        # A block of every gas only lives long enough to key and compute the baselines, and isn't kept with the columns
+        matrix = GasMatrix.from_frame(self.df, self.gases, self.segment_index, self.keep, dtype=self.dtype)
+
+        for licor, (blank_segments, _) in self.measurements.items():
+            blank_mean, blank_std, mz21_mean = self.baselines.blank_statistics(licor, matrix, blank_segments)
+            self.blanks[licor] = {"mean": dict(blank_mean.items()), "std": dict(blank_std.items()), 
+                                  "21mz_mean": mz21_mean}
+
+    def select(self, gases=None, plants=None):
+        '''
+        Args:
+            gases Optional list of gas names, every gas by default
+            plants Optional list of plant tags, every plant by default
+        Return:
+            A Selection of the campaign's results for those gases and plants
+        '''
+
+        gases = self.gases if gases is None else list(gases)
+        unknown = [gas for gas in gases if gas not in self.gases]
+
+        if unknown:
+            raise ValueError("Gases not in the campaign's data: " + ", ".join(map(str, unknown)))
+
+        self.prepare()
+
+        wanted = None if plants is None else set(plants)
+        plant_segments = {}
+
+        for licor, (_, segments) in self.measurements.items():
+            segments = {tag: segment for tag, segment in segments.items() if wanted is None or tag in wanted}
+            if segments:
+                plant_segments[licor] = segments
+
+        if wanted is not None:
+            unknown = wanted.difference(tag for segments in plant_segments.values() for tag in segments)
+            if unknown:
+                raise ValueError("Plant tags not in the campaign's metadata: " + ", ".join(map(str, sorted(unknown))))
+
+        return Selection(self, gases, plant_segments)
+
+class Selection():
+    '''
+    A campaign's results for some of its gases and plants. Nothing is computed until a result is asked for, and then
+    only what that result needs: abnormal() reads no gas columns at all, and the plants' windows are averaged once for
+    all of the other results.
+    '''
+
+    def __init__(self, campaign, gases, plant_segments):
+        '''
+        Default constructor.
+
+        Args:
+            campaign Campaign the selection is from
+            gases List of the selected gas names
+            plant_segments Dictionary from LICOR names to dictionaries from the selected plant tags to the position of
+                each plant's measurement, in the order of the full reduction
+        '''
+
+        self.campaign = campaign
+        self.gases = pd.Index(gases)
+        self.plant_segments = plant_segments
+
+        # Blank subtracted concentrations and whether each is above the threshold, from the first result that needs them
+        self.subtracted = None
+        self.above = None
+
+    def plant_tags(self):
+        '''
+        Return:
+            A list of the selected plant tags, in the order of the full reduction
+        '''
+
+        return [tag for segments in self.plant_segments.values() for tag in segments]
+
+    def blanks(self):
+        '''
+        Return:
+            A dictionary from the names of the selected plants' LICORs to Series of the average of each selected gas
+            over the LICOR's blanks
+        '''
+
+        return {licor: self.campaign.blank_statistics(licor, self.gases.to_list())[0] for licor in self.plant_segments}
+
+    def blank_stds(self):
+        '''
+        Return:
+            A dictionary from the names of the selected plants' LICORs to Series of the standard deviation of each
+            selected gas over the LICOR's blanks
+        '''
+
+        return {licor: self.campaign.blank_statistics(licor, self.gases.to_list())[1] for licor in self.plant_segments}
+
+    def evaluate(self):
+        '''
+        Average the selected gases over the selected plants' windows and subtract each LICOR's blank, the first time a
+        result needs them.
+        '''
+
+        if self.subtracted is not None:
+            return
+
+        matrix = self.campaign.matrix(self.gases.to_list())
+        subtracted = []
+        above = []
+
+        for licor, segments in self.plant_segments.items():
+            blank_mean, blank_std, _ = self.campaign.blank_statistics(licor, self.gases.to_list())
+            licor_subtracted, licor_above = subtract_blanks(matrix.window_means(list(segments.values())), blank_mean,
+                                                            blank_threshold(blank_std))
+            subtracted.append(licor_subtracted)
+            above.append(licor_above)
+
+        self.subtracted = np.concatenate(subtracted) if subtracted else np.empty((0, len(self.gases)))
+        self.above = np.concatenate(above) if above else np.empty((0, len(self.gases)), dtype=bool)
+
+    def concentrations(self):
+        '''
+        Return:
+            A Dataframe of a "plant_tag" column followed by each selected plant's blank subtracted concentration of each
+            selected gas, as the "plants" of the full reduction
+        '''
+
+        self.evaluate()
+
+        # One row per plant, with each gas's values contiguous as the full reduction lays them out
+        plants = pd.DataFrame(np.ascontiguousarray(self.subtracted.T).T, columns=self.gases)
+        plants.insert(0, "plant_tag", self.plant_tags())
+
+        return plants
+
+    def above_threshold(self):
+        '''
+        Return:
+            A dictionary from the selected plant tags to lists of the selected gases above the threshold for that plant
+        '''
+
+        self.evaluate()
+
+        return {tag: self.gases[self.above[row]].to_list() for row, tag in enumerate(self.plant_tags())}
+
+    def prevalences(self):
+        '''
+        Return:
+            A Dataframe of "Gas" and "Prevalence" columns of the fraction of the selected plants each selected gas was
+            above the threshold for, sorted by descending prevalence
+        '''
+
+        return count_prevalences(self.above_threshold())
+
+    def gas_std(self):
+        '''
+        Return:
+            A Series of the standard deviation of each selected gas over the selected plants
+        '''
+
+        return self.concentrations().drop(columns="plant_tag").std()
+
+    def high_variance(self, cutoff):
+        '''
+        Args:
+            cutoff Float cutoff point for the standard deviation over the selected plants
+        Return:
+            A list of the selected gases whose standard deviation over the selected plants is at least cutoff
+        '''
+
+        gas_std = self.gas_std()
+
+        return gas_std.index[(gas_std >= cutoff).to_list()].to_list()
+
+    def abnormal(self):
+        '''
+        Return:
+            A list of the selected plant tags with abnormal conditions
+        '''
+
+        self.campaign.prepare()
+
+        abnormal_tags = []
+
+        for licor, segments in self.plant_segments.items():
+            abnormal_tags += find_abnormal(self.campaign.extremes, segments,
+                                           self.campaign.blank_statistics(licor, [])[2])
+
+        return abnormal_tags
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Reduce only some gases and plants of a campaign.")
+    parser.add_argument("data", type=str, help="Path to the data file")
+    parser.add_argument("sheet", type=str, help="Name of the sheet the data is in")
+    parser.add_argument("metadata", type=str, help="Path to the metadata file")
+    parser.add_argument("query", type=str, choices=["concentrations", "above_threshold", "prevalences", "gas_std",
+                                                    "abnormal"])
+    parser.add_argument("--gases", type=str, nargs="+", default=None, help="Only load and reduce these gases")
+    parser.add_argument("--plants", type=str, nargs="+", default=None, help="Only reduce these plant tags")
+    args = parser.parse_args()
+
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', None)
+
+    campaign = Campaign.load(args.data, args.sheet, args.metadata, gases=args.gases)
+    print(getattr(campaign.select(plants=args.plants), args.query)())
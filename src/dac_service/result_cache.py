@@ -0,0 +1,300 @@
+import hashlib
+import os
+import pickle
+import threading
+
+from collections import OrderedDict
+
+from frame_cache import evict_files
+
+# Default limit on the memory held by each level of the cache, 256 MB
+DEFAULT_MAX_BYTES = 256 * 1024 ** 2
+
+# Default limit on the total size of the persisted entries, 2 GB
+DEFAULT_MAX_DISK_BYTES = 2 * 1024 ** 3
+
+def reduction_size(reduction):
+    '''
+    Estimate the memory held by a reduction from dac.summarize_plants().
+
+    Args:
+        reduction Reduction dictionary
+    Return:
+        Integer estimated size in bytes
+    '''
+
+    size = len(reduction.get("data", "")) + int(reduction["plants"].memory_usage(deep=True).sum())
+    size += int(reduction["gas_std"].memory_usage(deep=True)) * (1 + 2 * len(reduction["blanks"]))
+
+    return size
+
+class LRULevel():
+    '''
+    One level of the result cache, a dictionary that drops its least recently used entries beyond a total size.
+    '''
+
+    def __init__(self, max_bytes, size):
+        '''
+        Default constructor.
+
+        Args:
+            max_bytes Integer maximum total size of the entries
+            size Function returning the size in bytes of a value
+        '''
+
+        self.max_bytes = max_bytes
+        self.size = size
+        self.entries = OrderedDict()
+        self.total = 0
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key):
+        '''
+        Args:
+            key String key of the entry
+        Return:
+            The entry's value, or None if it isn't cached
+        '''
+
+        entry = self.entries.get(key)
+
+        if entry is None:
+            self.misses += 1
+            return None
+
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[0]
+
+    def put(self, key, value):
+        '''
+        Store an entry, then drop old entries until the level is within its size limit. Values larger than the whole
+        limit aren't kept.
+
+        Args:
+            key String key of the entry
+            value Value to store
+        '''
+
+        size = self.size(value)
+
+        if key in self.entries:
+            self.total -= self.entries.pop(key)[1]
+
+        if size > self.max_bytes:
+            return
+
+        self.entries[key] = (value, size)
+        self.total += size
+
+        while self.total > self.max_bytes:
+            self.total -= self.entries.popitem(last=False)[1][1]
+
+    def status(self):
+        '''
+        Return:
+            A dictionary of the number of "entries", their total "bytes", and the "hits" and "misses" so far
+        '''
+
+        return {"entries": len(self.entries), "bytes": self.total, "hits": self.hits, "misses": self.misses}
+
+class ResultCache():
+    '''
+    Two level cache of data reduction results.
+
+    The first level holds the cutoff independent reduction from dac.reduce_campaign(), the per plant averages and blank
+    statistics, keyed by the content hashes of the inputs and the data sheet. The second holds the final serialized
+    output keyed by the same key and the cutoff. A repeated request is answered from the second level, and a request
+    that only changes the cutoff only repeats dac.finish_reduction() on the first.
+
+    Both levels are kept in memory with least recently used eviction. With a directory, entries are also persisted
+    there so that they survive restarts and are shared between service processes, again evicting the least recently
+    used beyond max_disk_bytes.
+    '''
+
+    def __init__(self, max_bytes=DEFAULT_MAX_BYTES, directory=None, max_disk_bytes=DEFAULT_MAX_DISK_BYTES):
+        '''
+        Default constructor.
+
+        Args:
+            max_bytes Integer maximum memory in bytes for each of the two levels
+            directory Optional string path to the directory to persist entries in. Created if it doesn't exist.
+            max_disk_bytes Integer maximum total size of the persisted entries in bytes
+        '''
+
+        self.reductions = LRULevel(max_bytes, reduction_size)
+        self.outputs = LRULevel(max_bytes, len)
+        self.directory = directory
+        self.max_disk_bytes = max_disk_bytes
+        self.lock = threading.Lock()
+
+        if directory is not None:
+            os.makedirs(directory, exist_ok=True)
+
+    def key(self, data_hash, sheet_name, metadata_hash):
+        '''
+        Get the cache key for a request's inputs.
+
+        Args:
+            data_hash String sha256 of the data workbook
+            sheet_name String sheet name the data was read from
+            metadata_hash String sha256 of the metadata workbook
+        Return:
+            String cache key
+        '''
+
+        return hashlib.sha256("\n".join([data_hash, str(sheet_name), metadata_hash]).encode("utf-8")).hexdigest()
+
+    def output_key(self, key, cutoff, format="csv"):
+        '''
+        Get the second level key for an output.
+
+        Args:
+            key String cache key from key()
+            cutoff Float high variance cutoff
+            format String output format from result_format.FORMATS
+        Return:
+            String output key
+        '''
+
+        # csv outputs keep the keys they had before there were other formats, so persisted entries stay valid
+        variant = repr(float(cutoff)) if format == "csv" else repr(float(cutoff)) + "\n" + format
+
+        return key + "-" + hashlib.sha256(variant.encode("utf-8")).hexdigest()[:16]
+
+    def path(self, name, extension):
+        '''
+        Args:
+            name String key of a persisted entry
+            extension String file extension for the level the entry is in
+        Return:
+            String path to the entry's file
+        '''
+
+        return os.path.join(self.directory, name + extension)
+
+    def _load(self, name, extension):
+        '''
+        Load a persisted entry, marking it as recently used.
+
+        Return:
+            The entry's bytes, or None if it isn't persisted
+        '''
+
+        if self.directory is None:
+            return None
+
+        path = self.path(name, extension)
+
+        try:
+            with open(path, "rb") as entry_file:
+                content = entry_file.read()
+            os.utime(path)
+        except FileNotFoundError:
+            return None
+
+        return content
+
+    def _save(self, name, extension, content):
+        '''
+        Persist an entry, then evict old entries if the directory is over its size limit.
+        '''
+
+        if self.directory is None:
+            return
+
+        # Write to a temporary file first so that concurrent readers never see a partial entry
+        path = self.path(name, extension)
+        temp_path = path + "." + str(os.getpid()) + "." + str(threading.get_ident()) + ".tmp"
+
+        with open(temp_path, "wb") as entry_file:
+            entry_file.write(content)
+
+        os.replace(temp_path, path)
+        evict_files(self.directory, (".pkl", ".json"), self.max_disk_bytes)
+
+    def get_reduction(self, key):
+        '''
+        Args:
+            key String cache key from key()
+        Return:
+            The cached reduction dictionary, or None if it isn't cached
+        '''
+
+        with self.lock:
+            reduction = self.reductions.get(key)
+
+        if reduction is None:
+            content = self._load(key, ".pkl")
+
+            if content is not None:
+                reduction = pickle.loads(content)
+
+                with self.lock:
+                    self.reductions.put(key, reduction)
+
+        return reduction
+
+    def put_reduction(self, key, reduction):
+        '''
+        Args:
+            key String cache key from key()
+            reduction Reduction dictionary from dac.reduce_campaign()
+        '''
+
+        with self.lock:
+            self.reductions.put(key, reduction)
+
+        self._save(key, ".pkl", pickle.dumps(reduction, protocol=pickle.HIGHEST_PROTOCOL))
+
+    def get_output(self, key, cutoff, format="csv"):
+        '''
+        Args:
+            key String cache key from key()
+            cutoff Float high variance cutoff
+            format String output format from result_format.FORMATS
+        Return:
+            The cached output string, or None if it isn't cached
+        '''
+
+        output_key = self.output_key(key, cutoff, format)
+
+        with self.lock:
+            output = self.outputs.get(output_key)
+
+        if output is None:
+            content = self._load(output_key, ".json")
+
+            if content is not None:
+                output = content.decode("utf-8")
+
+                with self.lock:
+                    self.outputs.put(output_key, output)
+
+        return output
+
+    def put_output(self, key, cutoff, output, format="csv"):
+        '''
+        Args:
+            key String cache key from key()
+            cutoff Float high variance cutoff
+            output String serialized output
+            format String output format from result_format.FORMATS
+        '''
+
+        output_key = self.output_key(key, cutoff, format)
+
+        with self.lock:
+            self.outputs.put(output_key, output)
+
+        self._save(output_key, ".json", output.encode("utf-8"))
+
+    def status(self):
+        '''
+        Return:
+            A dictionary of the status of the "reductions" and "outputs" levels as from LRULevel.status()
+        '''
+
+        with self.lock:
+            return {"reductions": self.reductions.status(), "outputs": self.outputs.status()}
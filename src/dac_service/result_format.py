@@ -0,0 +1,265 @@
+import base64
+import io
+
+import numpy as np
+import pandas as pd
+
+from dac import blank_threshold
+from profiling import span
+
+# Output formats. "csv" is the original output of dac.data_reduction(), with the plant matrix as a csv string. The
+# others return each table of result_tables() as an Arrow IPC file or a Parquet file. These require pyarrow.
+FORMATS = ["csv", "arrow", "parquet"]
+
+# File extension for each binary format
+EXTENSIONS = {"arrow": ".arrow", "parquet": ".parquet"}
+
+def result_tables(reduction, cutoff):
+    '''
+    Arrange a reduction into tables for the binary output formats, keeping every number as a float instead of
+    formatting it as text.
+
+    Args:
+        reduction Reduction dictionary from dac.reduce_campaign()
+        cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high
+            variance list
+    Return:
+        A dictionary of Dataframes:
+        {
+            "plants": "plant_tag" and "licor" columns followed by each plant's blank subtracted concentrations, one row
+                per measurement as in the csv output,
+            "above_threshold": the same "plant_tag" and "licor" columns followed by whether each gas was above the
+                LICOR's threshold,
+            "gases": "Gas", its standard deviation over plants "std", and whether it is "high_variance" for the cutoff,
+            "prevalences": "Gas" and "Prevalence" as in the gas_prevelances output,
+            "blanks": "licor" and "statistic" columns, "mean", "std", or "threshold", followed by each gas's blank
+                statistic
+        }
+    '''
+
+    with span("format.tables", plants=len(reduction["plants"])):
+        plants = reduction["plants"]
+        gases = plants.columns[1:]
+        licors = list(reduction["blanks"].keys())
+
+        matrix = plants.drop(columns="plant_tag").reset_index(drop=True)
+        matrix.insert(0, "plant_tag", plants["plant_tag"].to_list())
+        matrix.insert(1, "licor", reduction["plant_licors"])
+
+        # Each measurement compared against its LICOR's threshold, as in dac.subtract_blank()
+        thresholds = {licor: blank_threshold(reduction["blank_stds"][licor]) for licor in licors}
+        licor_thresholds = np.vstack([thresholds[licor].reindex(gases).to_numpy(dtype=float) for licor in licors])
+        licor_rows = np.array([licors.index(licor) for licor in reduction["plant_licors"]], dtype=int)
+        above = plants[gases].to_numpy(dtype=float) > licor_thresholds[licor_rows]
+
+        above_threshold = pd.DataFrame(above, columns=gases)
+        above_threshold.insert(0, "plant_tag", matrix["plant_tag"])
+        above_threshold.insert(1, "licor", matrix["licor"])
+
+        gas_std = reduction["gas_std"]
+        gas_table = pd.DataFrame({"Gas": gas_std.index.to_list(), "std": gas_std.to_numpy(dtype=float),
+                                  "high_variance": (gas_std >= cutoff).to_numpy()})
+
+        blank_rows = []
+        blank_labels = []
+        for licor in licors:
+            for statistic, values in (("mean", reduction["blanks"][licor]), ("std", reduction["blank_stds"][licor]),
+                                      ("threshold", thresholds[licor])):
+                blank_rows.append(values.reindex(gases))
+                blank_labels.append((licor, statistic))
+
+        blanks = pd.DataFrame(blank_rows, columns=gases).reset_index(drop=True)
+        blanks.insert(0, "licor", [licor for licor, statistic in blank_labels])
+        blanks.insert(1, "statistic", [statistic for licor, statistic in blank_labels])
+
+    return {
+        "plants": matrix,
+        "above_threshold": above_threshold,
+        "gases": gas_table,
+        "prevalences": reduction["gas_prevelances"],
+        "blanks": blanks,
+    }
+
+def encode_table(table, format):
+    '''
+    Write a table in a binary format.
+
+    Args:
+        table Dataframe to write
+        format String "arrow" for an Arrow IPC file or "parquet"
+    Return:
+        Bytes of the file
+    '''
+
+    import pyarrow
+
+    arrow_table = pyarrow.Table.from_pandas(table, preserve_index=False)
+    sink = io.BytesIO()
+
+    if format == "arrow":
+        with pyarrow.ipc.new_file(sink, arrow_table.schema) as writer:
+            writer.write_table(arrow_table)
+    elif format == "parquet":
+        from pyarrow import parquet
+
+        parquet.write_table(arrow_table, sink)
+    else:
+        raise ValueError("Unknown binary format " + str(format))
+
+    return sink.getvalue()
+
+def decode_table(content, format):
+    '''
+    Read a table written by encode_table().
+
+    Args:
+        content Bytes, or a string path to a file, of the table
+        format String "arrow" or "parquet"
+    Return:
+        The Dataframe
+    '''
+
+    import pyarrow
+
+    source = pyarrow.BufferReader(content) if isinstance(content, bytes) else content
+
+    if format == "arrow":
+        with pyarrow.ipc.open_file(source) as reader:
+            return reader.read_all().to_pandas()
+    elif format == "parquet":
+        from pyarrow import parquet
+
+        return parquet.read_table(source).to_pandas()
+
+    raise ValueError("Unknown binary format " + str(format))
+
+def encode_tables(reduction, cutoff, format):
+    '''
+    Write every table of a reduction in a binary format.
+
+    Args:
+        reduction Reduction dictionary from dac.reduce_campaign()
+        cutoff Float high variance cutoff
+        format String "arrow" or "parquet"
+    Return:
+        A dictionary from the table names of result_tables() to the bytes of each file
+    '''
+
+    tables = result_tables(reduction, cutoff)
+
+    with span("format.encode", tables=len(tables)) as stage:
+        encoded = {name: encode_table(table, format) for name, table in tables.items()}
+        stage.count(bytes=sum(len(content) for content in encoded.values()))
+
+    return encoded
+
+def binary_output(reduction, cutoff, format, store=None, inline_limit=None):
+    '''
+    Build the response for a binary output format.
+
+    Args:
+        reduction Reduction dictionary from dac.reduce_campaign()
+        cutoff Float high variance cutoff
+        format String "arrow" or "parquet"
+        store Optional object store to return the tables through
+        inline_limit Integer total size in bytes above which the tables are put in the store, or None to always put them
+            there when there is a store
+    Return:
+        A JSON serializable dictionary of the "format", the "abnormal" plant tags, the "high_variance" gases, and
+        "tables" from each table name to either {"ref": object store reference} or {"base64": encoded file}
+    '''
+
+    encoded = encode_tables(reduction, cutoff, format)
+    by_reference = store is not None and (inline_limit is None or sum(map(len, encoded.values())) > inline_limit)
+
+    with span("format.package", by_reference=int(by_reference)):
+        if by_reference:
+            tables = {name: {"ref": store.put_bytes(content)} for name, content in encoded.items()}
+        else:
+            tables = {name: {"base64": base64.b64encode(content).decode("ascii")} for name, content in encoded.items()}
+
+    gas_std = reduction["gas_std"]
+
+    return {
+        "format": format,
+        "abnormal": reduction["abnormal"],
+        "high_variance": gas_std.index[(gas_std >= cutoff).to_list()].to_list(),
+        "tables": tables,
+    }
+
+def fetch_tables(output, store=None):
+    '''
+    Get the files of the tables of a response from binary_output().
+
+    Args:
+        output Dictionary from binary_output()
+        store Object store the tables were put in, if they were returned by reference
+    Return:
+        A dictionary from table names to the bytes of each file
+    '''
+
+    from object_store import fetch_verified
+
+    tables = {}
+
+    for name, table in output["tables"].items():
+        if "ref" in table:
+            with open(fetch_verified(store, table["ref"]), "rb") as table_file:
+                tables[name] = table_file.read()
+        else:
+            tables[name] = base64.b64decode(table["base64"])
+
+    return tables
+
+def read_binary_output(output, store=None):
+    '''
+    Read the tables of a response from binary_output().
+
+    Args:
+        output Dictionary from binary_output()
+        store Object store the tables were put in, if they were returned by reference
+    Return:
+        A dictionary from table names to Dataframes
+    '''
+
+    return {name: decode_table(content, output["format"]) for name, content in fetch_tables(output, store).items()}
+
+def above_threshold_lists(above_threshold):
+    '''
+    Convert the above_threshold table back into the lists of the csv output.
+
+    Args:
+        above_threshold Dataframe of the above_threshold table from result_tables()
+    Return:
+        A dictionary from plant tags to lists of the gases above the threshold, where later measurements of a plant tag
+        replace earlier ones as in dac.collect_reduction()
+    '''
+
+    gases = above_threshold.columns[2:]
+    mask = above_threshold[gases].to_numpy(dtype=bool)
+
+    return {plant_tag: gases[mask[row]].to_list() for row, plant_tag in enumerate(above_threshold["plant_tag"])}
+
+def write_tables(tables, prefix, format):
+    '''
+    Save encoded tables as files named prefix_<table><extension>.
+
+    Args:
+        tables Dictionary from table names to the bytes of each file
+        prefix String path prefix for the files
+        format String "arrow" or "parquet"
+    Return:
+        A list of the string paths written
+    '''
+
+    paths = []
+
+    for name, content in tables.items():
+        path = prefix + "_" + name + EXTENSIONS[format]
+
+        with open(path, "wb") as table_file:
+            table_file.write(content)
+
+        paths.append(path)
+
+    return paths
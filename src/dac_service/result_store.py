@@ -0,0 +1,503 @@
+import argparse
+import hashlib
+import sqlite3
+
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from dac import blank_threshold
+from frame_cache import hash_source
+from profiling import span
+
+# Tables of the store. Gases are numbered once in "gases" so the per plant rows hold an integer instead of the name.
+# "gas_summaries" holds the count, mean, and sum of squared deviations of every gas over each campaign's plants on
+# each LICOR, which cross campaign prevalence, variance, and trend queries combine without reading the plant rows.
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS campaigns (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE,
+    source_key TEXT,
+    started TEXT,
+    ingested TEXT NOT NULL,
+    plants INTEGER NOT NULL,
+    gases INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS campaigns_source_key ON campaigns (source_key);
+CREATE TABLE IF NOT EXISTS gases (
+    id INTEGER PRIMARY KEY,
+    name TEXT NOT NULL UNIQUE
+);
+CREATE TABLE IF NOT EXISTS plants (
+    campaign INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    plant_tag TEXT NOT NULL,
+    licor TEXT NOT NULL,
+    abnormal INTEGER NOT NULL,
+    PRIMARY KEY (campaign, position)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS plants_plant_tag ON plants (plant_tag);
+CREATE INDEX IF NOT EXISTS plants_licor ON plants (licor, campaign);
+CREATE TABLE IF NOT EXISTS plant_gases (
+    campaign INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    gas INTEGER NOT NULL,
+    concentration REAL,
+    above INTEGER NOT NULL,
+    PRIMARY KEY (campaign, position, gas)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS plant_gases_gas ON plant_gases (gas, campaign);
+CREATE TABLE IF NOT EXISTS blanks (
+    campaign INTEGER NOT NULL,
+    licor TEXT NOT NULL,
+    gas INTEGER NOT NULL,
+    mean REAL,
+    std REAL,
+    threshold REAL,
+    PRIMARY KEY (campaign, licor, gas)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS gas_summaries (
+    campaign INTEGER NOT NULL,
+    licor TEXT NOT NULL,
+    gas INTEGER NOT NULL,
+    plants INTEGER NOT NULL,
+    above INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    mean REAL,
+    m2 REAL,
+    PRIMARY KEY (campaign, licor, gas)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS gas_summaries_gas ON gas_summaries (gas, campaign);
+'''
+
+# Tables holding rows of a campaign, in the order they are deleted when it is replaced
+CAMPAIGN_TABLES = ["plant_gases", "plants", "blanks", "gas_summaries"]
+
+def source_key(data, sheet, metadata):
+    '''
+    Identify a campaign's inputs by their contents, the same way as result_cache.ResultCache.key().
+
+    Args:
+        data String path to the data file
+        sheet String sheet name of the data
+        metadata String path to the metadata file
+    Return:
+        String key that changes whenever either file or the sheet does
+    '''
+
+    return hashlib.sha256("\n".join([hash_source(data), str(sheet), hash_source(metadata)]).encode("utf-8")).hexdigest()
+
+def campaign_start(metadata):
+    '''
+    Args:
+        metadata Dataframe of the measurement metadata
+    Return:
+        The Timestamp of the first measurement, or None without any
+    '''
+
+    starts = pd.to_datetime(metadata["PTR Start Time"])
+
+    return starts.min() if len(starts) else None
+
+def combine_moments(summaries, by):
+    '''
+    Combine the counts, means, and sums of squared deviations of groups of plants into those of their union.
+
+    Args:
+        summaries Dataframe of gas_summaries rows with "plants", "above", "count", "mean", and "m2" columns
+        by List of the columns to combine within
+    Return:
+        A Dataframe indexed by the by columns of the total "plants", the "Prevalence" of plants above the threshold,
+        the "count" of plants with a concentration, and its "mean" and sample standard deviation "std"
+    '''
+
+    measured = summaries["count"] > 0
+    summaries = summaries.assign(weighted=np.where(measured, summaries["count"] * summaries["mean"], 0.0),
+                                 m2=np.where(measured, summaries["m2"], 0.0))
+
+    totals = summaries.groupby(by)[["plants", "above", "count", "weighted", "m2"]].sum()
+
+    with np.errstate(all="ignore"):
+        totals["mean"] = totals["weighted"] / totals["count"]
+
+    # Each group's spread around the combined mean is added to the squared deviations within the groups
+    combined = summaries.join(totals["mean"].rename("combined"), on=by)
+    spread = np.where(measured, combined["count"] * (combined["mean"] - combined["combined"]) ** 2, 0.0)
+    totals["m2"] += pd.Series(spread, index=summaries.index).groupby([summaries[column] for column in by]).sum()
+
+    with np.errstate(all="ignore"):
+        totals["std"] = np.sqrt(totals["m2"] / (totals["count"] - 1)).where(totals["count"] > 1)
+        totals["Prevalence"] = totals["above"] / totals["plants"]
+
+    return totals[["plants", "Prevalence", "count", "mean", "std"]]
+
+class ResultStore():
+    '''
+    Persistent store of the reduced results of many campaigns in a SQLite database.
+
+    Each campaign's blank subtracted concentration of every gas for every plant, whether it was above the threshold,
+    its abnormal flag, and each LICOR's blank statistics are kept, indexed by campaign, LICOR, plant tag, and gas, so
+    questions across a season are answered from the database instead of by reducing every workbook again. Campaigns are
+    identified by name and optionally by a key of their inputs from source_key(), so ingesting a campaign again is
+    skipped unless its inputs changed.
+    '''
+
+    def __init__(self, path):
+        '''
+        Default constructor.
+
+        Args:
+            path String path to the database file, created if it doesn't exist. Several processes may share it.
+        '''
+
+        self.path = path
+        self.connection = sqlite3.connect(path, timeout=60)
+
+        # Readers don't block the writer of a batch in write ahead logging mode
+        if path != ":memory:":
+            self.connection.execute("PRAGMA journal_mode=WAL")
+
+        with self.connection:
+            self.connection.executescript(SCHEMA)
+
+    def close(self):
+        '''
+        Close the database connection.
+        '''
+
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exception):
+        self.close()
+
+    def has(self, key):
+        '''
+        Args:
+            key String key of a campaign's inputs from source_key()
+        Return:
+            True if a campaign with those inputs was already ingested
+        '''
+
+        return self.connection.execute("SELECT 1 FROM campaigns WHERE source_key = ?", (key,)).fetchone() is not None
+
+    def _gas_ids(self, gases):
+        '''
+        Number any new gases.
+
+        Args:
+            gases List of gas names
+        Return:
+            An array of the id of each gas
+        '''
+
+        self.connection.executemany("INSERT OR IGNORE INTO gases (name) VALUES (?)", [(gas,) for gas in gases])
+        ids = dict(self.connection.execute("SELECT name, id FROM gases"))
+
+        return np.array([ids[gas] for gas in gases], dtype=np.int64)
+
+    def _delete(self, campaign):
+        '''
+        Delete every row of a campaign, within the caller's transaction.
+
+        Args:
+            campaign Integer id of the campaign
+        '''
+
+        for table in CAMPAIGN_TABLES:
+            self.connection.execute("DELETE FROM " + table + " WHERE campaign = ?", (campaign,))
+
+        self.connection.execute("DELETE FROM campaigns WHERE id = ?", (campaign,))
+
+    def add(self, name, reduction, key=None, started=None):
+        '''
+        Ingest a campaign's reduction. It is skipped if a campaign with the same key is already stored under any name,
+        or if the name is already stored and there is no key. A campaign stored under the name with another key, from
+        inputs that have since changed, is replaced.
+
+        Args:
+            name String name of the campaign
+            reduction Reduction dictionary from dac.reduce_campaign()
+            key Optional string key of the campaign's inputs from source_key()
+            started Optional Timestamp or string of the campaign's first measurement, which trend() orders by
+        Return:
+            True if the campaign was ingested, False if it was skipped
+        '''
+
+        plants = reduction["plants"]
+        gases = list(plants.columns[1:])
+        licors = np.array(reduction["plant_licors"], dtype=object)
+        values = plants[gases].to_numpy(dtype=float)
+        abnormal = set(reduction["abnormal"])
+        thresholds = {licor: blank_threshold(reduction["blank_stds"][licor]) for licor in reduction["blanks"]}
+
+        # Each measurement compared against its LICOR's threshold, as in result_format.result_tables()
+        above = np.zeros(values.shape, dtype=bool)
+        for licor, threshold in thresholds.items():
+            rows = licors == licor
+            above[rows] = values[rows] > threshold.reindex(gases).to_numpy(dtype=float)
+
+        with span("store.add", plants=len(plants), gases=len(gases)), self.connection:
+            existing = self.connection.execute("SELECT id FROM campaigns WHERE name = ?", (name,)).fetchone()
+
+            if (key is not None and self.has(key)) or (existing is not None and key is None):
+                return False
+
+            if existing is not None:
+                self._delete(existing[0])
+
+            campaign = self.connection.execute(
+                "INSERT INTO campaigns (name, source_key, started, ingested, plants, gases) VALUES (?, ?, ?, ?, ?, ?)",
+                (name, key, None if started is None else str(pd.Timestamp(started)), datetime.now().isoformat(),
+                 len(plants), len(gases))).lastrowid
+            gas_ids = self._gas_ids(gases)
+            tags = plants["plant_tag"].to_list()
+
+            self.connection.executemany(
+                "INSERT INTO plants (campaign, position, plant_tag, licor, abnormal) VALUES (?, ?, ?, ?, ?)",
+                [(campaign, position, str(tag), str(licor), int(tag in abnormal))
+                 for position, (tag, licor) in enumerate(zip(tags, licors))])
+
+            # One row per plant and gas. SQLite stores NaN concentrations as NULL.
+            positions = np.repeat(np.arange(len(plants)), len(gases))
+            self.connection.executemany(
+                "INSERT INTO plant_gases (campaign, position, gas, concentration, above) VALUES (?, ?, ?, ?, ?)",
+                zip([campaign] * values.size, positions.tolist(), np.tile(gas_ids, len(plants)).tolist(),
+                    values.ravel().tolist(), above.ravel().astype(int).tolist()))
+
+            blank_rows = []
+            summary_rows = []
+
+            for licor in reduction["blanks"]:
+                statistics = zip(reduction["blanks"][licor].reindex(gases), reduction["blank_stds"][licor].reindex(gases),
+                                 thresholds[licor].reindex(gases))
+                blank_rows += [(campaign, str(licor), int(gas), *(None if np.isnan(value) else float(value)
+                                                                   for value in row))
+                               for gas, row in zip(gas_ids, statistics)]
+
+                rows = licors == licor
+                licor_values = values[rows]
+                count = np.count_nonzero(~np.isnan(licor_values), axis=0)
+
+                with np.errstate(all="ignore"):
+                    mean = np.nansum(licor_values, axis=0) / count
+                    m2 = np.nansum((licor_values - mean) ** 2, axis=0)
+
+                summary_rows += [(campaign, str(licor), int(gas), int(rows.sum()), int(gas_above), int(gas_count),
+                                  None if gas_count == 0 else float(gas_mean), None if gas_count == 0 else float(gas_m2))
+                                 for gas, gas_above, gas_count, gas_mean, gas_m2
+                                 in zip(gas_ids, above[rows].sum(axis=0), count, mean, m2)]
+
+            self.connection.executemany(
+                "INSERT INTO blanks (campaign, licor, gas, mean, std, threshold) VALUES (?, ?, ?, ?, ?, ?)", blank_rows)
+            self.connection.executemany(
+                "INSERT INTO gas_summaries (campaign, licor, gas, plants, above, count, mean, m2) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", summary_rows)
+
+        return True
+
+    def remove(self, name):
+        '''
+        Delete a campaign.
+
+        Args:
+            name String name of the campaign
+        Return:
+            True if the campaign was stored
+        '''
+
+        with self.connection:
+            existing = self.connection.execute("SELECT id FROM campaigns WHERE name = ?", (name,)).fetchone()
+
+            if existing is None:
+                return False
+
+            self._delete(existing[0])
+
+        return True
+
+    def _query(self, sql, conditions, clauses=()):
+        '''
+        Run a query with optional filters.
+
+        Args:
+            sql String query, with "{where}" where the filter conditions go
+            conditions List of (string column, list of values or None) pairs. Columns whose values are None aren't
+                filtered on.
+            clauses List of string conditions that always apply
+        Return:
+            A Dataframe of the results
+        '''
+
+        clauses = list(clauses)
+        values = []
+
+        for column, selected in conditions:
+            if selected is not None:
+                selected = list(selected)
+                clauses.append(column + " IN (" + ", ".join("?" * len(selected)) + ")")
+                values += selected
+
+        where = ("WHERE " + " AND ".join(clauses)) if clauses else ""
+
+        with span("store.query"):
+            return pd.read_sql_query(sql.format(where=where), self.connection, params=values)
+
+    def campaigns(self):
+        '''
+        Return:
+            A Dataframe of every campaign's "name", "source_key", "started", "ingested", and number of "plants" and
+            "gases", in the order they started
+        '''
+
+        return self._query("SELECT name, source_key, started, ingested, plants, gases FROM campaigns {where} "
+                           "ORDER BY started, name", [])
+
+    def _summaries(self, gases, campaigns, licors):
+        return self._query('''
+            SELECT c.name AS campaign, c.started, s.licor, g.name AS Gas, s.plants, s.above, s.count, s.mean, s.m2
+            FROM gas_summaries s JOIN campaigns c ON c.id = s.campaign JOIN gases g ON g.id = s.gas {where}
+        ''', [("g.name", gases), ("c.name", campaigns), ("s.licor", licors)])
+
+    def prevalence(self, gases=None, campaigns=None, licors=None):
+        '''
+        Find the fraction of plants each gas was above the threshold for over many campaigns.
+
+        Args:
+            gases Optional list of the gases to include, all of them by default
+            campaigns Optional list of the names of the campaigns to include, all of them by default
+            licors Optional list of the LICORs to include, all of them by default
+        Return:
+            A Dataframe of "Gas", "Prevalence", and the number of "plants", sorted by descending prevalence as in the
+            gas_prevelances output
+        '''
+
+        totals = combine_moments(self._summaries(gases, campaigns, licors), ["Gas"]).reset_index()
+
+        return totals[["Gas", "Prevalence", "plants"]].sort_values("Prevalence", ascending=False).reset_index(drop=True)
+
+    def variance(self, gases=None, campaigns=None, licors=None):
+        '''
+        Find the spread of each gas's concentration over the plants of many campaigns.
+
+        Args:
+            gases Optional list of the gases to include, all of them by default
+            campaigns Optional list of the names of the campaigns to include, all of them by default
+            licors Optional list of the LICORs to include, all of them by default
+        Return:
+            A Dataframe of "Gas", the number of plants measured "count", and the "mean" and standard deviation "std" of
+            the blank subtracted concentration, as used for the high variance cutoff
+        '''
+
+        totals = combine_moments(self._summaries(gases, campaigns, licors), ["Gas"]).reset_index()
+
+        return totals[["Gas", "count", "mean", "std"]]
+
+    def trend(self, gases, licors=None):
+        '''
+        Follow gases from campaign to campaign.
+
+        Args:
+            gases List of the gases to include
+            licors Optional list of the LICORs to include, all of them by default
+        Return:
+            A Dataframe of "campaign", "started", "Gas", the number of "plants", "Prevalence", and the "mean" and "std"
+            of the concentration, one row per campaign and gas in the order the campaigns started
+        '''
+
+        summaries = self._summaries(gases, None, licors)
+        summaries["started"] = summaries["started"].fillna("")
+        totals = combine_moments(summaries, ["started", "campaign", "Gas"]).reset_index()
+        totals["started"] = pd.to_datetime(totals["started"].replace("", None))
+
+        return totals[["campaign", "started", "Gas", "plants", "Prevalence", "mean", "std"]]
+
+    def concentrations(self, gases=None, campaigns=None, licors=None, plants=None):
+        '''
+        Get the stored results of individual plants.
+
+        Args:
+            gases Optional list of the gases to include, all of them by default
+            campaigns Optional list of the names of the campaigns to include, all of them by default
+            licors Optional list of the LICORs to include, all of them by default
+            plants Optional list of the plant tags to include, all of them by default
+        Return:
+            A Dataframe of "campaign", "plant_tag", "licor", "abnormal", "Gas", blank subtracted "concentration", and
+            whether it was "above" the threshold, one row per plant and gas
+        '''
+
+        rows = self._query('''
+            SELECT c.name AS campaign, p.plant_tag, p.licor, p.abnormal, g.name AS Gas, v.concentration, v.above
+            FROM plant_gases v JOIN campaigns c ON c.id = v.campaign JOIN gases g ON g.id = v.gas
+            JOIN plants p ON p.campaign = v.campaign AND p.position = v.position {where}
+            ORDER BY c.started, c.name, v.position, v.gas
+        ''', [("g.name", gases), ("c.name", campaigns), ("p.licor", licors), ("p.plant_tag", plants)])
+
+        rows["abnormal"] = rows["abnormal"].astype(bool)
+        rows["above"] = rows["above"].astype(bool)
+
+        return rows
+
+    def abnormal(self, campaigns=None):
+        '''
+        Args:
+            campaigns Optional list of the names of the campaigns to include, all of them by default
+        Return:
+            A Dataframe of the "campaign", "plant_tag", and "licor" of every plant with abnormal conditions
+        '''
+
+        return self._query('''
+            SELECT c.name AS campaign, p.plant_tag, p.licor FROM plants p JOIN campaigns c ON c.id = p.campaign
+            {where} ORDER BY c.started, c.name, p.position
+        ''', [("c.name", campaigns)], ["p.abnormal = 1"])
+
+    def blanks(self, gases=None, campaigns=None, licors=None):
+        '''
+        Args:
+            gases Optional list of the gases to include, all of them by default
+            campaigns Optional list of the names of the campaigns to include, all of them by default
+            licors Optional list of the LICORs to include, all of them by default
+        Return:
+            A Dataframe of "campaign", "licor", "Gas", and the blank "mean", "std", and "threshold"
+        '''
+
+        return self._query('''
+            SELECT c.name AS campaign, b.licor, g.name AS Gas, b.mean, b.std, b.threshold
+            FROM blanks b JOIN campaigns c ON c.id = b.campaign JOIN gases g ON g.id = b.gas {where}
+            ORDER BY c.started, c.name, b.licor, b.gas
+        ''', [("g.name", gases), ("c.name", campaigns), ("b.licor", licors)])
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Query the reduced results of many campaigns.")
+    parser.add_argument("store", type=str, help="Path to the result store database")
+    parser.add_argument("query", type=str, choices=["campaigns", "prevalence", "variance", "trend", "abnormal", "blanks"])
+    parser.add_argument("--gases", type=str, nargs="+", default=None, help="Only include these gases")
+    parser.add_argument("--campaigns", type=str, nargs="+", default=None, help="Only include these campaigns")
+    parser.add_argument("--licors", type=str, nargs="+", default=None, help="Only include these LICORs")
+    parser.add_argument("--output", type=str, default=None, help="Path to save the result to as csv")
+    args = parser.parse_args()
+
+    if args.query == "trend" and args.gases is None:
+        parser.error("trend requires --gases")
+
+    pd.set_option('display.max_rows', None)
+    pd.set_option('display.width', None)
+
+    with ResultStore(args.store) as store:
+        if args.query == "campaigns":
+            result = store.campaigns()
+        elif args.query == "trend":
+            result = store.trend(args.gases, args.licors)
+        elif args.query == "abnormal":
+            result = store.abnormal(args.campaigns)
+        else:
+            result = getattr(store, args.query)(args.gases, args.campaigns, args.licors)
+
+    if args.output is not None:
+        result.to_csv(args.output, index=False)
+
+    print(result)
@@ -0,0 +1,148 @@
+import argparse
+import json
+
+import pandas as pd
+
+from dac import count_prevalences
+from stats import QuantileSketch
+
+# Quantile of the blanks a plant's median must exceed for a gas to be above the percentile threshold
+DEFAULT_BLANK_QUANTILE = 0.99
+
+def sketch_quantiles(sketches, quantiles):
+    '''
+    Summarize sketches by their quantiles.
+
+    Args:
+        sketches Dictionary from names, such as plant tags or LICOR names, to QuantileSketch
+        quantiles List of float quantiles between 0 and 1
+    Return:
+        A Dataframe of "name" and "quantile" columns followed by each gas's quantile, with one row per name and quantile
+    '''
+
+    tables = []
+
+    for name, sketch in sketches.items():
+        table = sketch.quantiles(list(quantiles))
+        table.insert(0, "quantile", table.index)
+        table.insert(0, "name", name)
+        tables.append(table.reset_index(drop=True))
+
+    return pd.concat(tables, ignore_index=True) if tables else pd.DataFrame(columns=["name", "quantile"])
+
+def quantile_above_threshold(reduction, blank_quantile=DEFAULT_BLANK_QUANTILE, plant_quantile=0.5):
+    '''
+    Find the gases above a percentile threshold for each plant, a robust alternative to the 3 * std threshold: a gas is
+    above it when the plant's quantile, its median by default, exceeds the quantile of the LICOR's blanks.
+
+    Args:
+        reduction Dictionary from dac.reduce_campaign() with sketches
+        blank_quantile Float quantile of the blanks to use as the threshold
+        plant_quantile Float quantile of each plant to compare against it
+    Return:
+        A dictionary from plant tags to lists of the gases above the threshold, and a Dataframe of the prevalences as
+        in the gas_prevelances output
+    '''
+
+    thresholds = {licor: sketch.quantiles(blank_quantile) for licor, sketch in reduction["blank_sketches"].items()}
+
+    # Later measurements with the same plant tag replace earlier ones, as in dac.collect_reduction()
+    plant_licors = dict(zip(reduction["plants"]["plant_tag"], reduction["plant_licors"]))
+    plants_to_gases = {}
+
+    for plant_tag, sketch in reduction["plant_sketches"].items():
+        above = sketch.quantiles(plant_quantile).gt(thresholds[plant_licors[plant_tag]])
+        plants_to_gases[plant_tag] = above[above].index.to_list()
+
+    return plants_to_gases, count_prevalences(plants_to_gases)
+
+def sketches_to_dict(reduction):
+    '''
+    Args:
+        reduction Dictionary from dac.reduce_campaign() or dac.data_reduction() with sketches
+    Return:
+        A JSON serializable dictionary of the "plant_sketches" and "blank_sketches", which sketches_from_dict() converts
+        back
+    '''
+
+    return {kind: {name: sketch.to_dict() for name, sketch in reduction[kind].items()}
+            for kind in ("plant_sketches", "blank_sketches")}
+
+def sketches_from_dict(state):
+    '''
+    Args:
+        state Dictionary from sketches_to_dict()
+    Return:
+        A dictionary of "plant_sketches" and "blank_sketches", each from names to QuantileSketch
+    '''
+
+    return {kind: {name: QuantileSketch.from_dict(sketch) for name, sketch in state[kind].items()}
+            for kind in ("plant_sketches", "blank_sketches")}
+
+def merge_sketches(first, second):
+    '''
+    Merge the sketches of two runs or partitions, such as the same plants measured on different days.
+
+    Args:
+        first Dictionary of "plant_sketches" and "blank_sketches" as from sketches_from_dict()
+        second Dictionary of the same form
+    Return:
+        A new dictionary of the same form, where sketches with the same name are merged
+    '''
+
+    merged = {}
+
+    for kind in ("plant_sketches", "blank_sketches"):
+        merged[kind] = {name: sketch.copy() for name, sketch in first[kind].items()}
+
+        for name, sketch in second[kind].items():
+            if name in merged[kind]:
+                merged[kind][name].merge(sketch)
+            else:
+                merged[kind][name] = sketch.copy()
+
+    return merged
+
+def save_sketches(reduction, path):
+    '''
+    Write the sketches of a reduction to a JSON file.
+
+    Args:
+        reduction Dictionary with "plant_sketches" and "blank_sketches"
+        path String path to write to
+    '''
+
+    with open(path, "w") as sketch_file:
+        json.dump(sketches_to_dict(reduction), sketch_file)
+
+def load_sketches(path):
+    '''
+    Args:
+        path String path to a file from save_sketches()
+    Return:
+        A dictionary of "plant_sketches" and "blank_sketches" as from sketches_from_dict()
+    '''
+
+    with open(path, "r") as sketch_file:
+        return sketches_from_dict(json.load(sketch_file))
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Merge sketch files from dac.py --sketches and summarize them.")
+    parser.add_argument("sketches", type=str, nargs="+", help="Sketch files to merge")
+    parser.add_argument("--quantiles", type=float, nargs="+", default=[0.05, 0.5, 0.95])
+    parser.add_argument("--output", type=str, default=None, help="Path to write the merged sketches to")
+    args = parser.parse_args()
+
+    merged = load_sketches(args.sketches[0])
+    for path in args.sketches[1:]:
+        merged = merge_sketches(merged, load_sketches(path))
+
+    if args.output is not None:
+        save_sketches(merged, args.output)
+
+    pd.set_option('display.max_columns', None)
+    print("Blank quantiles:")
+    print(sketch_quantiles(merged["blank_sketches"], args.quantiles).to_string(index=False))
+    print("\nPlant quantiles:")
+    print(sketch_quantiles(merged["plant_sketches"], args.quantiles).to_string(index=False))
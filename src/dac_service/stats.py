@@ -0,0 +1,332 @@
+import numpy as np
+import pandas as pd
+
+class RunningStats():
+    '''
+    Running count, mean, variance, minimum, and maximum for each of a set of columns.
+
+    Rows are added in batches with Welford's update generalized to batches (Chan et al.), so memory use does not grow
+    with the number of rows. Missing values are skipped, matching pandas' defaults. Two RunningStats over the same
+    columns can be merged into the statistics of the union of their rows.
+    '''
+
+    def __init__(self, columns):
+        '''
+        Default constructor.
+
+        Args:
+            columns List of string column names the statistics are kept for
+        '''
+
+        self.columns = pd.Index(columns)
+        num_columns = len(self.columns)
+
+        self.count = np.zeros(num_columns)
+        self.mean = np.zeros(num_columns)
+        self.m2 = np.zeros(num_columns)
+        self.min = np.full(num_columns, np.nan)
+        self.max = np.full(num_columns, np.nan)
+
+    def update(self, values):
+        '''
+        Add a batch of rows to the statistics.
+
+        Args:
+            values 2D array-like of floats with one row per observation and one column per entry in columns
+        '''
+
+        values = np.asarray(values, dtype=float)
+
+        if values.shape[0] == 0:
+            return
+
+        present = ~np.isnan(values)
+        count = present.sum(axis=0).astype(float)
+        filled = np.where(present, values, 0.0)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            mean = filled.sum(axis=0) / count
+            deviations = np.where(present, values - mean, 0.0)
+
+        m2 = (deviations * deviations).sum(axis=0)
+
+        self._combine(count, np.nan_to_num(mean), m2, np.fmin.reduce(values, axis=0), np.fmax.reduce(values, axis=0))
+
+    def merge(self, other):
+        '''
+        Add the rows summarized by another RunningStats to these statistics.
+
+        Args:
+            other RunningStats over the same columns
+        '''
+
+        self._combine(other.count, other.mean, other.m2, other.min, other.max)
+
+    def _combine(self, count, mean, m2, minimum, maximum):
+        '''
+        Combine partial statistics for another set of rows into these.
+
+        Args:
+            count Array of the number of present values per column in the other rows
+            mean Array of the mean per column of the other rows, 0 where count is 0
+            m2 Array of the sum of squared deviations from the mean per column of the other rows
+            minimum Array of the minimum per column of the other rows
+            maximum Array of the maximum per column of the other rows
+        '''
+
+        total = self.count + count
+        delta = mean - self.mean
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            weight = np.where(total > 0, count / total, 0.0)
+
+        self.mean = self.mean + delta * weight
+        self.m2 = self.m2 + m2 + delta * delta * self.count * weight
+        self.count = total
+        self.min = np.fmin(self.min, minimum)
+        self.max = np.fmax(self.max, maximum)
+
+    def copy(self):
+        '''
+        Create an independent copy of these statistics.
+
+        Return:
+            A new RunningStats with the same values
+        '''
+
+        stats = RunningStats(self.columns)
+        stats.merge(self)
+        return stats
+
+    def means(self):
+        '''
+        Return:
+            A Series of the mean of each column, NaN for columns with no values
+        '''
+
+        return pd.Series(np.where(self.count > 0, self.mean, np.nan), index=self.columns)
+
+    def stds(self, ddof=1):
+        '''
+        Args:
+            ddof Integer delta degrees of freedom, 1 for the sample standard deviation as in pandas
+        Return:
+            A Series of the standard deviation of each column, NaN for columns with ddof or fewer values
+        '''
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            variance = np.where(self.count > ddof, self.m2 / (self.count - ddof), np.nan)
+
+        return pd.Series(np.sqrt(variance), index=self.columns)
+
+    def minimums(self):
+        '''
+        Return:
+            A Series of the minimum of each column, NaN for columns with no values
+        '''
+
+        return pd.Series(self.min, index=self.columns)
+
+    def maximums(self):
+        '''
+        Return:
+            A Series of the maximum of each column, NaN for columns with no values
+        '''
+
+        return pd.Series(self.max, index=self.columns)
+
+# Default number of centroids a QuantileSketch compresses each column to
+DEFAULT_COMPRESSION = 100
+
+class QuantileSketch():
+    '''
+    Mergeable sketch of the distribution of each of a set of columns, for medians and percentiles without keeping the
+    rows.
+
+    Each column is summarized by weighted centroids in the manner of a t-digest. Once more than twice the compression
+    centroids have been added, they are merged into at most compression centroids, smaller near the tails so that
+    extreme percentiles stay accurate, so memory use does not grow with the number of rows. Until then every value is
+    kept and quantiles are exact, matching pandas' linear interpolation. Missing values are skipped. Two sketches over
+    the same columns can be merged, and sketches convert to and from JSON serializable dictionaries so they can be
+    merged across runs and partitions.
+    '''
+
+    def __init__(self, columns, compression=DEFAULT_COMPRESSION):
+        '''
+        Default constructor.
+
+        Args:
+            columns List of string column names the sketches are kept for
+            compression Integer number of centroids to compress each column to
+        '''
+
+        self.columns = pd.Index(columns)
+        self.compression = compression
+        num_columns = len(self.columns)
+
+        # Centroid means and weights, one column per sketched column. Unused entries have weight 0.
+        self.values = np.empty((0, num_columns))
+        self.weights = np.empty((0, num_columns))
+
+        self.count = np.zeros(num_columns)
+        self.min = np.full(num_columns, np.nan)
+        self.max = np.full(num_columns, np.nan)
+
+    def update(self, values):
+        '''
+        Add a batch of rows to the sketches.
+
+        Args:
+            values 2D array-like of floats with one row per observation and one column per entry in columns
+        '''
+
+        values = np.asarray(values, dtype=float)
+
+        if values.shape[0] == 0:
+            return
+
+        present = ~np.isnan(values)
+        self._add(np.where(present, values, 0.0), present.astype(float), np.fmin.reduce(values, axis=0),
+                  np.fmax.reduce(values, axis=0))
+
+    def merge(self, other):
+        '''
+        Add the rows summarized by another QuantileSketch to these sketches.
+
+        Args:
+            other QuantileSketch over the same columns
+        '''
+
+        self._add(other.values, other.weights, other.min, other.max)
+
+    def _add(self, values, weights, minimum, maximum):
+        '''
+        Add centroids, compressing once there are more than twice the compression.
+        '''
+
+        self.values = np.vstack([self.values, values])
+        self.weights = np.vstack([self.weights, weights])
+        self.count = self.count + weights.sum(axis=0)
+        self.min = np.fmin(self.min, minimum)
+        self.max = np.fmax(self.max, maximum)
+
+        if self.values.shape[0] > 2 * self.compression:
+            self._compress()
+
+    def _sorted(self):
+        '''
+        Return:
+            The centroid values and weights with each column sorted by value, unused entries last
+        '''
+
+        order = np.argsort(np.where(self.weights > 0, self.values, np.inf), axis=0, kind="stable")
+
+        return np.take_along_axis(self.values, order, axis=0), np.take_along_axis(self.weights, order, axis=0)
+
+    def _compress(self):
+        '''
+        Merge each column's centroids into at most compression centroids, using the t-digest k1 scale function to
+        assign each centroid to a bucket by the quantile at its middle.
+        '''
+
+        values, weights = self._sorted()
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            middle = np.where(self.count > 0, (np.cumsum(weights, axis=0) - weights / 2) / self.count, 0.0)
+
+        scale = np.arcsin(np.clip(2 * middle - 1, -1, 1)) / np.pi + 0.5
+        buckets = np.clip((scale * self.compression).astype(int), 0, self.compression - 1)
+        columns = np.broadcast_to(np.arange(len(self.columns)), buckets.shape)
+
+        merged_weights = np.zeros((self.compression, len(self.columns)))
+        merged_sums = np.zeros((self.compression, len(self.columns)))
+        np.add.at(merged_weights, (buckets, columns), weights)
+        np.add.at(merged_sums, (buckets, columns), values * weights)
+
+        with np.errstate(invalid="ignore", divide="ignore"):
+            self.values = np.where(merged_weights > 0, merged_sums / merged_weights, 0.0)
+        self.weights = merged_weights
+
+    def copy(self):
+        '''
+        Create an independent copy of these sketches.
+
+        Return:
+            A new QuantileSketch with the same centroids
+        '''
+
+        sketch = QuantileSketch(self.columns, self.compression)
+        sketch.merge(self)
+        return sketch
+
+    def quantiles(self, quantiles):
+        '''
+        Estimate quantiles of each column, interpolating linearly between the ranks at the middle of each centroid as
+        pandas interpolates between values.
+
+        Args:
+            quantiles Float quantile between 0 and 1, or a list of them
+        Return:
+            A Series of the quantile of each column for a float, or a Dataframe with one row per quantile for a list.
+            NaN for columns with no values.
+        '''
+
+        single = np.ndim(quantiles) == 0
+        targets = np.atleast_1d(np.asarray(quantiles, dtype=float))
+        values, weights = self._sorted()
+
+        # The rank at the middle of each centroid, which is its position for centroids of single values
+        centers = np.cumsum(weights, axis=0) - (weights + 1) / 2
+        result = np.full((len(targets), len(self.columns)), np.nan)
+
+        for column in np.flatnonzero(self.count > 0):
+            used = weights[:, column] > 0
+            ranks = np.concatenate([[0.0], centers[used, column], [self.count[column] - 1]])
+            points = np.concatenate([[self.min[column]], values[used, column], [self.max[column]]])
+            result[:, column] = np.interp(targets * (self.count[column] - 1), ranks, points)
+
+        if single:
+            return pd.Series(result[0], index=self.columns)
+
+        return pd.DataFrame(result, index=targets, columns=self.columns)
+
+    def to_dict(self):
+        '''
+        Return:
+            A JSON serializable dictionary of the sketches, which from_dict() converts back
+        '''
+
+        def floats(array):
+            return [None if np.isnan(value) else float(value) for value in array]
+
+        used = self.weights.any(axis=1)
+
+        return {
+            "columns": self.columns.to_list(),
+            "compression": self.compression,
+            "count": self.count.tolist(),
+            "min": floats(self.min),
+            "max": floats(self.max),
+            "values": self.values[used].tolist(),
+            "weights": self.weights[used].tolist(),
+        }
+
+    @staticmethod
+    def from_dict(state):
+        '''
+        Args:
+            state Dictionary from to_dict()
+        Return:
+            The QuantileSketch
+        '''
+
+        sketch = QuantileSketch(state["columns"], state["compression"])
+        num_columns = len(sketch.columns)
+
+        sketch.values = np.array(state["values"], dtype=float).reshape(-1, num_columns)
+        sketch.weights = np.array(state["weights"], dtype=float).reshape(-1, num_columns)
+        sketch.count = np.array(state["count"], dtype=float)
+        sketch.min = np.array([np.nan if value is None else value for value in state["min"]], dtype=float)
+        sketch.max = np.array([np.nan if value is None else value for value in state["max"]], dtype=float)
+
+        return sketch
@@ -0,0 +1,280 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from dac import collect_reduction, finish_reduction, is_abnormal, locate_windows, \
+    measurement_windows, NON_GAS_COLUMNS, sort_times
+from profiling import span
+from stats import QuantileSketch, RunningStats
+
+# Default number of data rows read at a time
+DEFAULT_CHUNK_ROWS = 50000
+
+# Columns used for the abnormal condition checks
+HOUSEKEEPING_COLUMNS = ["21 m/z", "PC_Pressure"]
+
+def read_csv_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, start_row=0):
+    '''
+    Read a csv data file a block of rows at a time.
+
+    Args:
+        path String path to the csv file
+        chunk_rows Integer number of rows per chunk
+        start_row Integer number of data rows at the start of the file to skip
+    Return:
+        A generator of Dataframes of consecutive rows
+    '''
+
+    for chunk in pd.read_csv(path, chunksize=chunk_rows, parse_dates=["time_string"], skiprows=range(1, start_row + 1)):
+        yield chunk
+
+def read_parquet_chunks(path, chunk_rows=DEFAULT_CHUNK_ROWS, start_row=0):
+    '''
+    Read a Parquet data file a block of rows at a time. Requires pyarrow.
+
+    Args:
+        path String path to the Parquet file
+        chunk_rows Integer number of rows per chunk
+        start_row Integer number of data rows at the start of the file to skip
+    Return:
+        A generator of Dataframes of consecutive rows
+    '''
+
+    from pyarrow import parquet
+
+    for batch in parquet.ParquetFile(path).iter_batches(batch_size=chunk_rows):
+        if start_row >= batch.num_rows:
+            start_row -= batch.num_rows
+            continue
+
+        yield batch.slice(start_row).to_pandas()
+        start_row = 0
+
+def read_excel_chunks(path, sheet, chunk_rows=DEFAULT_CHUNK_ROWS, start_row=0):
+    '''
+    Read a sheet of an xlsx data file a block of rows at a time, without loading the whole sheet.
+
+    Args:
+        path String path to the xlsx file
+        sheet String sheet name where the data is saved
+        chunk_rows Integer number of rows per chunk
+        start_row Integer number of data rows at the start of the sheet to skip. Skipped rows are still scanned in the
+            file, but aren't converted to values.
+    Return:
+        A generator of Dataframes of consecutive rows
+    '''
+
+    import openpyxl
+
+    workbook = openpyxl.load_workbook(path, read_only=True, data_only=True)
+
+    try:
+        header = next(workbook[sheet].iter_rows(max_row=1, values_only=True))
+        rows = workbook[sheet].iter_rows(min_row=start_row + 2, values_only=True)
+        chunk = []
+
+        for row in rows:
+            chunk.append(row)
+
+            if len(chunk) == chunk_rows:
+                yield pd.DataFrame(chunk, columns=header)
+                chunk = []
+
+        if len(chunk) > 0:
+            yield pd.DataFrame(chunk, columns=header)
+    finally:
+        workbook.close()
+
+def read_chunks(path, sheet=None, chunk_rows=DEFAULT_CHUNK_ROWS, start_row=0):
+    '''
+    Read a data file a block of rows at a time, choosing the reader from the file extension.
+
+    Args:
+        path String path to a csv, Parquet, or xlsx data file
+        sheet String sheet name where the data is saved, only used for xlsx files
+        chunk_rows Integer number of rows per chunk
+        start_row Integer number of data rows at the start of the file to skip
+    Return:
+        A generator of Dataframes of consecutive rows
+    '''
+
+    extension = os.path.splitext(path)[1].lower()
+
+    if extension == ".csv":
+        return read_csv_chunks(path, chunk_rows, start_row)
+    elif extension in (".parquet", ".pq"):
+        return read_parquet_chunks(path, chunk_rows, start_row)
+    elif extension in (".xlsx", ".xlsm"):
+        return read_excel_chunks(path, sheet, chunk_rows, start_row)
+
+    raise ValueError("Unsupported data file type for streaming: " + path)
+
+def accumulate_chunks(chunks, windows, sketches=False):
+    '''
+    Route each chunk's rows to their measurement windows and add them to running statistics for each window.
+
+    Chunks do not need to arrive in time order, since every row is routed by its own timestamp.
+
+    Args:
+        chunks Iterable of Dataframes of instrument data
+        windows Dataframe of measurement windows from measurement_windows()
+        sketches Boolean whether to also keep a QuantileSketch over the gas columns for each window
+    Return:
+        A list of RunningStats over the gas columns for each window, a list of RunningStats over the housekeeping
+        columns for each window, and a list of QuantileSketch over the gas columns for each window or None without
+        sketches, all in metadata order. The gas lists are None if there was no data.
+    '''
+
+    gas_stats = None
+    gas_sketches = None
+    housekeeping_stats = [RunningStats(HOUSEKEEPING_COLUMNS) for _ in range(len(windows))]
+
+    for chunk in chunks:
+
+        # DO1 is 0 or 1, with 1 represent one of the middle three measurements which are to be kept
+        chunk = chunk[chunk.DO1 == 1]
+
+        if gas_stats is None:
+            gas_columns = [column for column in chunk.columns if column not in NON_GAS_COLUMNS]
+            gas_stats = [RunningStats(gas_columns) for _ in range(len(windows))]
+
+            if sketches:
+                gas_sketches = [QuantileSketch(gas_columns) for _ in range(len(windows))]
+
+        order, sorted_times = sort_times(pd.to_datetime(chunk["time_string"]).to_numpy().astype("datetime64[ns]"))
+        gas_values = chunk[gas_columns].to_numpy(dtype=float)
+        housekeeping_values = chunk[HOUSEKEEPING_COLUMNS].to_numpy(dtype=float)
+
+        if order is not None:
+            gas_values = gas_values[order]
+            housekeeping_values = housekeeping_values[order]
+
+        row_start, row_stop = locate_windows(sorted_times, windows)
+
+        # Only update the windows this chunk overlaps
+        for segment in np.flatnonzero(row_stop > row_start):
+            gas_stats[segment].update(gas_values[row_start[segment]:row_stop[segment]])
+            housekeeping_stats[segment].update(housekeeping_values[row_start[segment]:row_stop[segment]])
+
+            if gas_sketches is not None:
+                gas_sketches[segment].update(gas_values[row_start[segment]:row_stop[segment]])
+
+    return gas_stats, housekeeping_stats, gas_sketches
+
+def streaming_data_reduction(chunks, metadata, cutoff, sketches=False):
+    '''
+    Perform the data reduction over data read a chunk at a time, keeping only running statistics for each measurement.
+
+    Memory use depends on the number of measurements and gases but not on the number of rows. The output matches
+    data_reduction() up to floating point rounding, since means and standard deviations are accumulated incrementally.
+
+    Args:
+        chunks Iterable of Dataframes of instrument data, such as from read_chunks()
+        metadata Dataframe of measurement metadata
+        cutoff Float for the cutoff point for Standard Deviation over all plants for a gas to be included in the high
+            variance list
+        sketches Boolean whether to also sketch the distribution of every gas for each plant and each LICOR's blanks
+    Return:
+        The output Dictionary as described for data_reduction()
+    '''
+
+    return finish_reduction(streaming_reduce_campaign(chunks, metadata, sketches), cutoff)
+
+def streaming_reduce_campaign(chunks, metadata, sketches=False):
+    '''
+    Perform the cutoff independent part of the data reduction over data read a chunk at a time, as described for
+    streaming_data_reduction().
+
+    Args:
+        chunks Iterable of Dataframes of instrument data, such as from read_chunks()
+        metadata Dataframe of measurement metadata
+        sketches Boolean whether to also sketch the distribution of every gas for each plant and each LICOR's blanks
+    Return:
+        The reduction Dictionary as described for dac.reduce_campaign()
+    '''
+
+    windows = measurement_windows(metadata)
+
+    with span("stream.accumulate", segments=len(windows)):
+        gas_stats, housekeeping_stats, gas_sketches = accumulate_chunks(chunks, windows, sketches)
+
+    if gas_stats is None:
+        raise ValueError("No data rows were read")
+
+    with span("stream.window_stats", segments=len(windows)):
+        return reduce_window_stats(windows, gas_stats, housekeeping_stats, gas_sketches)
+
+def reduce_window_stats(windows, gas_stats, housekeeping_stats, gas_sketches=None):
+    '''
+    Perform the cutoff independent part of the data reduction from running statistics for each measurement window.
+
+    Args:
+        windows Dataframe of measurement windows from measurement_windows()
+        gas_stats List of RunningStats over the gas columns for each window
+        housekeeping_stats List of RunningStats over the housekeeping columns for each window
+        gas_sketches Optional list of QuantileSketch over the gas columns for each window
+    Return:
+        The reduction Dictionary as described for dac.reduce_campaign()
+    '''
+
+    plant_sketches = {}
+    blank_sketches = {}
+    blanks_per_licor = {}
+    blank_std_per_licor = {}
+    df_per_licor = {}
+    means_per_licor = {}
+    abnormal_tags = []
+    columns = gas_stats[0].columns
+
+    for licor in windows["LICOR"].unique():
+        licor_windows = windows[windows["LICOR"] == licor]
+        blank_segments = licor_windows.index[licor_windows["blank"]]
+
+        if len(blank_segments) == 0:
+            raise ValueError("No blank measurements for LICOR " + str(licor))
+
+        # Combine the statistics of all this LICOR's blanks
+        blank = RunningStats(columns)
+        blank_housekeeping = RunningStats(HOUSEKEEPING_COLUMNS)
+
+        for segment in blank_segments:
+            blank.merge(gas_stats[segment])
+            blank_housekeeping.merge(housekeeping_stats[segment])
+
+        if gas_sketches is not None:
+            blank_sketches[licor] = QuantileSketch(columns)
+
+            for segment in blank_segments:
+                blank_sketches[licor].merge(gas_sketches[segment])
+
+        blanks_per_licor[licor] = blank.means()
+        blank_std_per_licor[licor] = blank.stds()
+        blank_21mz_mean = blank_housekeeping.means()["21 m/z"]
+
+        df_per_licor[licor] = {}
+
+        for segment in licor_windows.index[~licor_windows["blank"]]:
+            df_per_licor[licor][licor_windows.at[segment, "Plant Tag"]] = segment
+
+        for plant_tag in df_per_licor[licor].keys():
+            housekeeping = housekeeping_stats[df_per_licor[licor][plant_tag]]
+            if is_abnormal(housekeeping.min[0], housekeeping.max[0], housekeeping.min[1], housekeeping.max[1],
+                           blank_21mz_mean):
+                abnormal_tags.append(plant_tag)
+
+        if gas_sketches is not None:
+            for plant_tag, segment in df_per_licor[licor].items():
+                plant_sketches[plant_tag] = gas_sketches[segment]
+
+        means_per_licor[licor] = np.array([gas_stats[segment].means().to_numpy() 
+                                           for segment in df_per_licor[licor].values()]).reshape(-1, len(columns))
+
+    reduction = collect_reduction({licor: list(plants.keys()) for licor, plants in df_per_licor.items()}, 
+                                  means_per_licor, columns, blanks_per_licor, blank_std_per_licor, abnormal_tags)
+
+    if gas_sketches is not None:
+        reduction["plant_sketches"] = plant_sketches
+        reduction["blank_sketches"] = blank_sketches
+
+    return reduction
@@ -0,0 +1,158 @@
+import argparse
+import json
+
+import numpy as np
+import pandas as pd
+
+from dac import BLANK_STD_FLOOR, BLANK_STD_MULTIPLIER, count_prevalences, load_files, reduce_campaign
+from frame_cache import FrameCache
+
+def parse_values(values):
+    '''
+    Expand a list of numbers and ranges from the command line.
+
+    Args:
+        values List of strings, each either a number or an inclusive range "start:stop:step"
+    Return:
+        A list of floats
+    '''
+
+    expanded = []
+
+    for value in values:
+        if ":" not in value:
+            expanded.append(float(value))
+            continue
+
+        start, stop, step = (float(part) for part in value.split(":"))
+
+        if step <= 0:
+            raise ValueError("Range step must be positive: " + value)
+
+        # Count the steps instead of accumulating them, and trim the rounding error so that 0.1:0.3:0.1 gives 0.3
+        for i in range(int(np.floor((stop - start) / step + 1e-9)) + 1):
+            expanded.append(float("%.12g" % (start + i * step)))
+
+    return expanded
+
+def cutoff_sweep(reduction, cutoffs):
+    '''
+    Find the high variance gases for many cutoffs from one reduction.
+
+    The standard deviation of each gas over plants is computed once, by dac.reduce_campaign(), so each cutoff only
+    costs a comparison.
+
+    Args:
+        reduction Reduction dictionary from dac.reduce_campaign()
+        cutoffs List of float cutoffs
+    Return:
+        A dictionary from each cutoff to the list of high variance gases, as in the output of dac.data_reduction(), and
+        a Dataframe of the "cutoff" and "high_variance_count" curve
+    '''
+
+    gas_std = reduction["gas_std"].to_numpy()
+    gases = reduction["gas_std"].index
+
+    # Gases with a standard deviation at least the cutoff, counted by binary search in the sorted deviations. NaN
+    # deviations, from gases measured for fewer than two plants, are never high variance.
+    sorted_std = np.sort(gas_std[~np.isnan(gas_std)])
+    counts = len(sorted_std) - np.searchsorted(sorted_std, cutoffs, side="left")
+
+    high_variance = {cutoff: gases[gas_std >= cutoff].to_list() for cutoff in cutoffs}
+    curve = pd.DataFrame({"cutoff": cutoffs, "high_variance_count": counts})
+
+    return high_variance, curve
+
+def threshold_sweep(reduction, multipliers=(BLANK_STD_MULTIPLIER,), floors=(BLANK_STD_FLOOR,)):
+    '''
+    Find the gases above the threshold for every combination of blank standard deviation multiplier and floor from one
+    reduction.
+
+    The blank subtracted concentrations and each LICOR's blank standard deviations are computed once, by
+    dac.reduce_campaign(), so each combination only costs a comparison of the plant matrix against its thresholds.
+
+    Args:
+        reduction Reduction dictionary from dac.reduce_campaign()
+        multipliers List of float numbers of blank standard deviations a gas must be above the blank
+        floors List of float smallest thresholds
+    Return:
+        A dictionary from each (multiplier, floor) pair to a dictionary of its "above_threshold" and
+        "gas_prevelances", as in the output of dac.data_reduction(), and a Dataframe of the "multiplier", "floor",
+        "above_threshold_count" of plant and gas pairs above the threshold, and "gases_above" count of gases above
+        the threshold for any plant
+    '''
+
+    plants = reduction["plants"]
+    gases = plants.columns[1:]
+    values = plants[gases].to_numpy(dtype=float)
+    plant_tags = plants["plant_tag"].to_list()
+
+    # Blank standard deviations of each LICOR stacked into rows, and the row of each plant's LICOR
+    licors = list(reduction["blank_stds"].keys())
+    blank_stds = np.vstack([reduction["blank_stds"][licor].to_numpy(dtype=float) for licor in licors])
+    licor_rows = np.array([licors.index(licor) for licor in reduction["plant_licors"]], dtype=int)
+
+    results = {}
+    curve = []
+
+    for multiplier in multipliers:
+        for floor in floors:
+            # The same thresholds as dac.blank_threshold(), on the stacked array at once
+            thresholds = blank_stds * multiplier
+            thresholds[thresholds < floor] = floor
+            above = values > thresholds[licor_rows]
+
+            # Later measurements with the same plant tag replace earlier ones, as in dac.collect_reduction()
+            plants_to_gases = {}
+            for row, plant_tag in enumerate(plant_tags):
+                plants_to_gases[plant_tag] = gases[above[row]].to_list()
+
+            results[(multiplier, floor)] = {
+                "above_threshold": plants_to_gases,
+                "gas_prevelances": count_prevalences(plants_to_gases),
+            }
+            curve.append({
+                "multiplier": multiplier,
+                "floor": floor,
+                "above_threshold_count": sum(len(above_gases) for above_gases in plants_to_gases.values()),
+                "gases_above": len(set().union(*plants_to_gases.values())),
+            })
+
+    return results, pd.DataFrame(curve, columns=["multiplier", "floor", "above_threshold_count", "gases_above"])
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Sweep the data reduction's cutoffs over one reduction pass.")
+    parser.add_argument("data", type=str)
+    parser.add_argument("sheet", type=str)
+    parser.add_argument("metadata", type=str)
+    parser.add_argument("--cutoffs", type=str, nargs="+", default=["0.1"],
+                        help="High variance cutoffs, as numbers or inclusive start:stop:step ranges")
+    parser.add_argument("--multipliers", type=str, nargs="+", default=[str(BLANK_STD_MULTIPLIER)],
+                        help="Blank standard deviation multipliers, as numbers or ranges")
+    parser.add_argument("--floors", type=str, nargs="+", default=[str(BLANK_STD_FLOOR)],
+                        help="Threshold floors, as numbers or ranges")
+    parser.add_argument("--cache-dir", type=str, default=None, help="Directory to cache parsed sheets in")
+    parser.add_argument("--output", type=str, default="sweep.json", help="Path to write the full sweep results to")
+    args = parser.parse_args()
+
+    cache = FrameCache(args.cache_dir) if args.cache_dir is not None else None
+    data, metadata = load_files(args.data, args.sheet, args.metadata, cache=cache)
+    reduction = reduce_campaign(data, metadata)
+
+    high_variance, cutoff_curve = cutoff_sweep(reduction, parse_values(args.cutoffs))
+    thresholds, threshold_curve = threshold_sweep(reduction, parse_values(args.multipliers), parse_values(args.floors))
+
+    pd.set_option('display.max_rows', None)
+    print("High variance gases by cutoff:")
+    print(cutoff_curve.to_string(index=False))
+    print("\nGases above the threshold by blank standard deviation multiplier and floor:")
+    print(threshold_curve.to_string(index=False))
+
+    with open(args.output, "w") as output_file:
+        json.dump({
+            "cutoffs": [{"cutoff": cutoff, "high_variance": gases} for cutoff, gases in high_variance.items()],
+            "thresholds": [{"multiplier": multiplier, "floor": floor, "above_threshold": result["above_threshold"],
+                            "gas_prevelances": result["gas_prevelances"].to_dict(orient="records")}
+                           for (multiplier, floor), result in thresholds.items()],
+        }, output_file, indent=2)
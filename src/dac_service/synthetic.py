@@ -0,0 +1,181 @@
+import argparse
+import os
+
+import numpy as np
+import pandas as pd
+
+# Time between PTR measurements in seconds
+SAMPLE_SECONDS = 10
+
+# DO1 pattern over each cycle of five PTR measurements, keeping the middle three
+DO1_CYCLE = [0, 1, 1, 1, 0]
+
+def gas_column_names(gases):
+    '''
+    Create names for synthetic gas concentration columns.
+
+    Args:
+        gases Integer number of gas columns
+    Return:
+        A list of string column names in the style of the PTR export, such as "33.033 m/z"
+    '''
+
+    return ["%.3f m/z" % (22.0 + 1.013 * i) for i in range(gases)]
+
+def measurement_order(licors, plants, blank_placement):
+    '''
+    Lay out the sequence of blank and plant measurements for a campaign.
+
+    Args:
+        licors List of string LICOR names
+        plants Integer number of plant measurements, spread across the LICORs in turn
+        blank_placement String "ends" for blanks on each LICOR before the first and after the last plant, "start" for
+            blanks only before the first plant, or "interleaved" for a blank every ten plants as well as at the ends
+    Return:
+        A list of (plant tag, LICOR) tuples in measurement order
+    '''
+
+    if blank_placement not in ("ends", "start", "interleaved"):
+        raise ValueError("Unknown blank placement " + blank_placement)
+
+    order = [("Blank_" + licor + "_start", licor) for licor in licors]
+
+    for plant in range(plants):
+        licor = licors[plant % len(licors)]
+
+        if blank_placement == "interleaved" and plant > 0 and plant % 10 == 0:
+            order.append(("Blank_" + licor + "_" + str(plant), licor))
+
+        order.append(("Plant_%04d" % plant, licor))
+
+    if blank_placement != "start":
+        order += [("Blank_" + licor + "_end", licor) for licor in licors]
+
+    return order
+
+def generate_campaign(rows=10000, gases=100, licors=2, plants=20, blank_placement="ends", abnormal_fraction=0.1,
+                      start="2024-05-09 08:00:00", seed=0):
+    '''
+    Generate synthetic PTR data and metadata with the same schema as real campaigns.
+
+    Each gas has a log-normal background level per LICOR and each plant raises a random subset of gases above it.
+    Roughly abnormal_fraction of plants get a PC_Pressure or 21 m/z excursion.
+
+    Args:
+        rows Integer number of data rows
+        gases Integer number of gas concentration columns
+        licors Integer number of LICORs
+        plants Integer number of plant measurements
+        blank_placement String placement of blank measurements, as for measurement_order()
+        abnormal_fraction Float fraction of plants with abnormal conditions
+        start String timestamp of the first measurement
+        seed Integer seed for the random number generator
+    Return:
+        A Dataframe of instrument data and a Dataframe of metadata, as returned by dac.load_files()
+    '''
+
+    rng = np.random.default_rng(seed)
+    licor_names = ["LICOR" + str(i + 1) for i in range(licors)]
+    order = measurement_order(licor_names, plants, blank_placement)
+    gas_names = gas_column_names(gases)
+
+    # Divide the rows evenly between the measurements
+    boundaries = np.linspace(0, rows, len(order) + 1).astype(int)
+    start_time = pd.Timestamp(start)
+    times = start_time + pd.to_timedelta(np.arange(rows) * SAMPLE_SECONDS, unit="s")
+
+    metadata = pd.DataFrame({
+        "Plant Tag": [tag for tag, _ in order],
+        "LICOR": [licor for _, licor in order],
+        "PTR Start Time": times[np.minimum(boundaries[:-1], rows - 1)],
+    })
+
+    background = {licor: rng.lognormal(-3, 1, gases) for licor in licor_names}
+    gas_values = np.empty((rows, gases))
+    mz21 = rng.normal(2200, 100, rows)
+    pressure = rng.normal(400, 10, rows)
+
+    for i, (tag, licor) in enumerate(order):
+        first, last = boundaries[i], boundaries[i + 1]
+        level = background[licor].copy()
+
+        if not tag.startswith("Blank"):
+            emitted = rng.random(gases) < 0.2
+            level[emitted] *= rng.uniform(2, 20, emitted.sum())
+
+            if rng.random() < abnormal_fraction and last > first:
+                if rng.random() < 0.5:
+                    pressure[rng.integers(first, last)] = 500
+                else:
+                    mz21[rng.integers(first, last)] = 3000
+
+        gas_values[first:last] = level * rng.lognormal(0, 0.2, (last - first, gases))
+
+    data = pd.DataFrame({
+        "time_string": times,
+        "time_number": np.arange(rows, dtype=float) * SAMPLE_SECONDS,
+        "21 m/z": mz21,
+        "PC_Pressure": pressure,
+        "Mpvalve": np.ones(rows),
+        "DO1": np.resize(DO1_CYCLE, rows),
+    })
+    data = pd.concat([data, pd.DataFrame(gas_values, columns=gas_names)], axis=1)
+
+    return data, metadata
+
+def write_campaign(data, metadata, directory, name="synthetic", formats=("xlsx",), sheet="TS_all_ppbV"):
+    '''
+    Write a synthetic campaign to disk.
+
+    Args:
+        data Dataframe of instrument data
+        metadata Dataframe of metadata
+        directory String path to the directory to write to
+        name String prefix for the file names
+        formats List of data file formats to write, any of "xlsx", "csv", and "parquet". Parquet requires pyarrow.
+        sheet String sheet name for the xlsx data file
+    Return:
+        A dictionary from each format to the path of its data file, plus "metadata" to the path of the xlsx metadata file
+    '''
+
+    os.makedirs(directory, exist_ok=True)
+    paths = {"metadata": os.path.join(directory, name + "_Metadata.xlsx")}
+    metadata.to_excel(paths["metadata"], index=False)
+
+    for data_format in formats:
+        path = os.path.join(directory, name + "_Complete." + data_format)
+
+        if data_format == "xlsx":
+            data.to_excel(path, sheet_name=sheet, index=False)
+        elif data_format == "csv":
+            data.to_csv(path, index=False)
+        elif data_format == "parquet":
+            data.to_parquet(path, index=False)
+        else:
+            raise ValueError("Unknown format " + data_format)
+
+        paths[data_format] = path
+
+    return paths
+
+if __name__ == "__main__":
+
+    parser = argparse.ArgumentParser(description="Generate a synthetic PTR campaign.")
+    parser.add_argument("directory", type=str)
+    parser.add_argument("--name", type=str, default="synthetic")
+    parser.add_argument("--rows", type=int, default=10000)
+    parser.add_argument("--gases", type=int, default=100)
+    parser.add_argument("--licors", type=int, default=2)
+    parser.add_argument("--plants", type=int, default=20)
+    parser.add_argument("--blank-placement", type=str, default="ends", choices=["ends", "start", "interleaved"])
+    parser.add_argument("--abnormal-fraction", type=float, default=0.1)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--format", type=str, nargs="+", default=["xlsx"], choices=["xlsx", "csv", "parquet"])
+    args = parser.parse_args()
+
+    data, metadata = generate_campaign(args.rows, args.gases, args.licors, args.plants, args.blank_placement,
+                                       args.abnormal_fraction, seed=args.seed)
+    paths = write_campaign(data, metadata, args.directory, args.name, args.format)
+
+    for data_format, path in paths.items():
+        print(data_format + ": " + path)